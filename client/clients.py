@@ -4,7 +4,7 @@ import json
 import os
 import re
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
 from urllib.parse import urljoin
 
 import requests
@@ -516,3 +516,62 @@ class UDTClient(BaseClient):
         )
 
         return json.loads(response.content)["data"]
+
+    @check_deployment_decorator
+    def predict_batch(self, texts, top_k=1):
+        """
+        Queries the UDT Model with a batch of texts in a single request.
+
+        Args:
+            texts (List[str]): The texts to perform inference on.
+            top_k (int): The number of top results to retrieve for each text (default is 1).
+
+        Returns:
+            dict: The prediction results for each text, in the same order as the
+            texts, and the time taken for the batch.
+        """
+        response = http_post_with_error(
+            urljoin(self.base_url, "predict-batch"),
+            json={"texts": texts, "top_k": top_k},
+            headers=auth_header(self.login_instance.access_token),
+        )
+
+        return json.loads(response.content)["data"]
+
+    @check_deployment_decorator
+    def predict_stream(
+        self, lines: Iterable[str], data_type: str = "unstructured"
+    ) -> Iterator[dict]:
+        """
+        Streams lines to a token classification model and yields the result for
+        each line as it is predicted, without holding all of the lines or results
+        in memory.
+
+        Args:
+            lines (Iterable[str]): The lines to perform inference on, such as an
+                open log file. Lines must not contain newlines.
+            data_type (str): The data type of the lines, unstructured or xml.
+
+        Yields:
+            dict: {"prediction_results": ...} or {"error": ...} for each line, in
+            the same order as the lines.
+        """
+
+        def body():
+            for line in lines:
+                yield (line.rstrip("\n") + "\n").encode("utf-8")
+
+        with requests.post(
+            urljoin(self.base_url, "predict-stream"),
+            params={"data_type": data_type},
+            data=body(),
+            headers=auth_header(self.login_instance.access_token),
+            stream=True,
+        ) as response:
+            if not (200 <= response.status_code < 300):
+                raise requests.exceptions.HTTPError(
+                    "Failed with status code:", response.status_code, response=response
+                )
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
@@ -231,6 +231,10 @@ async def deploy_single_model(
                 or os.getenv("LLM_PROVIDER", "openai")
             ),
             genai_key=(genai_key or os.getenv("GENAI_KEY", "")),
+            # Unset or empty variables use the defaults.
+            search_threads=os.getenv("NDB_SEARCH_THREADS") or None,
+            search_batching=os.getenv("NDB_SEARCH_BATCHING", "false").lower() == "true",
+            parse_processes=os.getenv("NDB_PARSE_PROCESSES") or None,
         )
         llm_provider = model_options.llm_provider
 
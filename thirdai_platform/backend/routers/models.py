@@ -334,7 +334,8 @@ def upload_chunk(
     Uploads a chunk of a model.
 
     Parameters:
-    - chunk: UploadFile - The raw bytes of the chunk.
+    - chunk: UploadFile - The raw bytes of the chunk, which are copied to storage
+        without reading the whole chunk into memory.
         Example: UploadFile(file=BytesIO(b"chunk data"), filename="chunk1.zip")
     - chunk_number: int - The position of the chunk of the model that is being uploaded.
         Example: 1
@@ -396,10 +397,9 @@ def upload_chunk(
             message=f"Platform reached the disk limit while uploading the model. Please clear {space_needed:.2f} MB space and try again.",
         )
     try:
-        chunk_data = chunk.file.read()
         storage.upload_chunk(
             model_id=payload["model_id"],
-            chunk_data=chunk_data,
+            chunk_file=chunk.file,
             chunk_number=chunk_number,
             model_type=model_type,
             compressed=compressed,
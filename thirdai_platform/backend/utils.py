@@ -20,11 +20,13 @@ from database import schema
 from fastapi import HTTPException, UploadFile, status
 from jinja2 import Template
 from licensing.verify.verify_license import valid_job_allocation, verify_license
+from platform_common.file_handler import save_upload_file
 from platform_common.ndb.ndbv1_parser import convert_to_ndb_file
 from platform_common.pydantic_models.training import LabelEntity
 from platform_common.thirdai_storage import data_types, storage
 from platform_common.utils import model_bazaar_path
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 
 def hash_password(password: str):
@@ -782,22 +784,26 @@ async def create_classification_csv(
         categories.add(category)
         # Get file extension and convert to lowercase
         ext = Path(file.filename).suffix.lower()
-        content = await file.read()
         try:
             if ext == ".txt":
                 # Direct text processing for .txt files
+                content = await file.read()
                 text_content = content.decode("utf-8")
             else:
                 # For other formats, use ndb parser
                 # Save file temporarily
                 temp_file_path = Path(temp_dir) / file.filename
                 os.makedirs(temp_file_path.parent, exist_ok=True)
-                with open(temp_file_path, "wb") as f:
-                    f.write(content)
                 try:
+                    # Saving and parsing block, so they are run in a thread to
+                    # avoid stalling the event loop.
+                    await run_in_threadpool(save_upload_file, file, str(temp_file_path))
                     # Convert to ndb Document
-                    doc = convert_to_ndb_file(
-                        str(temp_file_path), metadata=None, options=None
+                    doc = await run_in_threadpool(
+                        convert_to_ndb_file,
+                        str(temp_file_path),
+                        metadata=None,
+                        options=None,
                     )
                     # Get text content from display column
                     text_content = " ".join(doc.table.df["display"].tolist())
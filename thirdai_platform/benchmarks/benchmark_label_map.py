@@ -0,0 +1,149 @@
+"""
+Benchmark for assigning labels to the PII entities of search results with
+LabelMap, as Guardrail.redact_pii_batch does for the query and references of
+every search.
+
+Generates documents with many entities of a few tags, where some entities are
+repeated or are variations of earlier entities, and labels every entity of every
+document in two ways:
+  - legacy: each entity is compared against every earlier entity of its tag with
+    a brute force longest common substring, which is what LabelMap.get_label did
+    before entities were indexed.
+  - indexed: LabelMap, which looks up the substrings of each entity in an index
+    of the substrings of the earlier entities of its tag.
+
+Both modes must assign the same labels, and the time taken by each is reported.
+
+Usage:
+    python -m benchmarks.benchmark_label_map --documents 2 --entities 300
+"""
+
+import argparse
+import random
+import string
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from deployment_job.guardrail import LabelMap
+
+TAGS = ["NAME", "ADDRESS", "EMAIL", "PHONENUMBER", "ORGANIZATION"]
+
+
+def max_overlap(a: str, b: str) -> int:
+    def longest_prefix(i: int, j: int) -> int:
+        cnt = 0
+        for k in range(0, min(len(a) - i, len(b) - j)):
+            if a[i + k] == b[j + k]:
+                cnt += 1
+            else:
+                break
+        return cnt
+
+    return max(longest_prefix(i, j) for i in range(len(a)) for j in range(len(b)))
+
+
+class LegacyLabelMap:
+    def __init__(self):
+        self.tag_to_entities: Dict[str, Dict[str, str]] = defaultdict(dict)
+        self.next_label = 0
+
+    def get_label(self, tag: str, entity: str) -> str:
+        for label, existing_entity in self.tag_to_entities[tag].items():
+            if entity == existing_entity or max_overlap(entity, existing_entity) > 5:
+                return label
+
+        label = f"[{tag}#{self.next_label}]"
+        self.next_label += 1
+
+        self.tag_to_entities[tag][label] = entity
+        return label
+
+
+def random_entity(rng: random.Random, min_length: int, max_length: int) -> str:
+    # A small alphabet so that entities share many short substrings, which are
+    # not long enough to be a match, as names and addresses do.
+    words = []
+    length = rng.randint(min_length, max_length)
+    while sum(len(word) + 1 for word in words) < length:
+        words.append(
+            "".join(rng.choices(string.ascii_lowercase[:8], k=rng.randint(2, 7)))
+        )
+    return " ".join(words)
+
+
+def generate_documents(
+    n_documents: int, n_entities: int, min_length: int, max_length: int, seed: int
+) -> List[List[Tuple[str, str]]]:
+    rng = random.Random(seed)
+    seen = defaultdict(list)
+    documents = []
+    for _ in range(n_documents):
+        document = []
+        for _ in range(n_entities):
+            tag = rng.choice(TAGS)
+            if seen[tag] and rng.random() < 0.3:
+                # Repeats an earlier entity, possibly with a prefix or suffix, as
+                # in "Dr. John Smith" and "John Smith".
+                entity = rng.choice(seen[tag])
+                if rng.random() < 0.5:
+                    entity = random_entity(rng, 3, 8) + " " + entity
+            else:
+                entity = random_entity(rng, min_length, max_length)
+            seen[tag].append(entity)
+            document.append((tag, entity))
+        documents.append(document)
+    return documents
+
+
+def label_documents(label_map_cls, documents: List[List[Tuple[str, str]]]):
+    label_map = label_map_cls()
+    return [
+        [label_map.get_label(tag=tag, entity=entity) for tag, entity in document]
+        for document in documents
+    ]
+
+
+def run(
+    n_documents: int, n_entities: int, min_length: int, max_length: int, seed: int
+) -> None:
+    documents = generate_documents(
+        n_documents, n_entities, min_length, max_length, seed
+    )
+    print(
+        f"{n_documents} documents with {n_entities} entities of {min_length}-{max_length} characters"
+    )
+    header = f"{'mode':<10} {'time (s)':>10} {'entities/s':>12} {'labels':>8}"
+    print(header)
+    print("-" * len(header))
+
+    labels = {}
+    for name, label_map_cls in [("legacy", LegacyLabelMap), ("indexed", LabelMap)]:
+        start = time.perf_counter()
+        labels[name] = label_documents(label_map_cls, documents)
+        elapsed = time.perf_counter() - start
+        n_labels = len({label for document in labels[name] for label in document})
+        print(
+            f"{name:<10} {elapsed:>10.3f} {n_documents * n_entities / elapsed:>12.0f} {n_labels:>8}"
+        )
+
+    if labels["legacy"] != labels["indexed"]:
+        raise RuntimeError("Indexed labels do not match the legacy labels.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--documents", type=int, default=2)
+    parser.add_argument("--entities", type=int, default=300)
+    parser.add_argument("--min_length", type=int, default=10)
+    parser.add_argument("--max_length", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    run(
+        n_documents=args.documents,
+        n_entities=args.entities,
+        min_length=args.min_length,
+        max_length=args.max_length,
+        seed=args.seed,
+    )
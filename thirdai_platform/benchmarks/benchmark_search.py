@@ -0,0 +1,222 @@
+"""
+Micro-benchmark for the CPU cost of NDB searches in the deployment job.
+
+Builds a NeuralDB over a synthetic corpus, and measures the CPU time per search
+request at top_k=100, from the search parameters to the serialized response
+body. The path used before search results were serialized directly, which
+builds a pydantic Reference for every result and encodes them with
+jsonable_encoder, is included for comparison, as is the cost of the retrieval
+alone. The result cache is disabled so that every request runs a search.
+
+Usage:
+    python -m benchmarks.benchmark_search --license tests/ndb_enterprise_license.json
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import thirdai.neural_db_v2.chunk_stores.constraints as ndbv2_constraints
+from deployment_job.models.ndb_models import NDBModel
+from deployment_job.pydantic_models import inputs
+from fastapi.encoders import jsonable_encoder
+from licensing.verify import verify_license
+from platform_common.logging import JobLogger
+from platform_common.pydantic_models.deployment import (
+    DeploymentConfig,
+    NDBDeploymentOptions,
+)
+from platform_common.utils import orjson_response, response
+from thirdai import neural_db_v2 as ndbv2
+
+MODEL_ID = "benchmark"
+DEPLOYMENT_ID = "benchmark"
+
+VOCAB = [f"word{i}" for i in range(5000)]
+CATEGORIES = ["finance", "sports", "politics", "science", "travel"]
+
+
+def random_text(rng: random.Random, n_words: int) -> str:
+    return " ".join(rng.choice(VOCAB) for _ in range(n_words))
+
+
+def build_model(
+    model_bazaar_dir: str, license_path: str, n_chunks: int, rng: random.Random
+) -> NDBModel:
+    license_info = verify_license.verify_license(license_path)
+    verify_license.verify_and_activate(license_path)
+
+    db = ndbv2.NeuralDB(save_path=os.path.join(model_bazaar_dir, "build.ndb"))
+    db.insert(
+        [
+            ndbv2.InMemoryText(
+                document_name="benchmark.txt",
+                text=[random_text(rng, 60) for _ in range(n_chunks)],
+                chunk_metadata=[
+                    {
+                        "category": rng.choice(CATEGORIES),
+                        "year": rng.randint(2000, 2024),
+                    }
+                    for _ in range(n_chunks)
+                ],
+            )
+        ]
+    )
+    db.save(os.path.join(model_bazaar_dir, "models", MODEL_ID, "model.ndb"))
+
+    config = DeploymentConfig(
+        deployment_id=DEPLOYMENT_ID,
+        user_id="benchmark",
+        model_id=MODEL_ID,
+        model_bazaar_endpoint="",
+        model_bazaar_dir=model_bazaar_dir,
+        host_dir=os.path.join(model_bazaar_dir, "host_dir"),
+        license_key=license_info["boltLicenseKey"],
+        autoscaling_enabled=True,
+        model_options=NDBDeploymentOptions(genai_key="benchmark", search_cache_size=0),
+    )
+    logger = JobLogger(
+        log_dir=Path(model_bazaar_dir) / "logs",
+        log_prefix="benchmark",
+        service_type="deployment",
+        model_id=MODEL_ID,
+        model_type="ndb",
+        user_id="benchmark",
+    )
+    return NDBModel(config=config, logger=logger)
+
+
+def legacy_search(
+    model: NDBModel, query: str, top_k: int, constraints: Dict[str, Dict[str, Any]]
+) -> bytes:
+    # The search path used before search results were serialized directly.
+    constraints = {
+        key: getattr(ndbv2_constraints, constraint["constraint_type"])(
+            **{k: v for k, v in constraint.items() if k != "constraint_type"}
+        )
+        for key, constraint in constraints.items()
+    }
+    results = model.db.search(
+        query=query, top_k=top_k, constraints=constraints, rerank=False
+    )
+    references = [
+        inputs.Reference(
+            id=chunk.chunk_id,
+            text=chunk.text,
+            source=os.path.join(model.doc_save_path(), chunk.document),
+            metadata=chunk.metadata or {},
+            context="",
+            source_id=chunk.doc_id,
+            score=score,
+        )
+        for chunk, score in results
+    ]
+    results = inputs.SearchResultsNDB(query_text=query, references=references)
+    return response(
+        status_code=200, message="Successful", data=jsonable_encoder(results)
+    ).body
+
+
+def fast_search(
+    model: NDBModel, query: str, top_k: int, constraints: Dict[str, Dict[str, Any]]
+) -> bytes:
+    results = model.predict(
+        query=query, top_k=top_k, constraints=constraints, rerank=False
+    )
+    return orjson_response(status_code=200, message="Successful", data=results).body
+
+
+def retrieval_only(
+    model: NDBModel, query: str, top_k: int, constraints: Dict[str, Dict[str, Any]]
+) -> None:
+    model.db.search(
+        query=query,
+        top_k=top_k,
+        constraints={
+            key: getattr(ndbv2_constraints, constraint["constraint_type"])(
+                **{k: v for k, v in constraint.items() if k != "constraint_type"}
+            )
+            for key, constraint in constraints.items()
+        },
+        rerank=False,
+    )
+
+
+def cpu_per_request(
+    search: Callable,
+    model: NDBModel,
+    queries: List[str],
+    top_k: int,
+    constraints: Dict[str, Dict[str, Any]],
+    repeats: int,
+) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.process_time()
+        for query in queries:
+            search(model, query, top_k, constraints)
+        best = min(best, time.process_time() - start)
+    return best / len(queries)
+
+
+def run(
+    license_path: str, n_chunks: int, n_queries: int, top_k: int, repeats: int
+) -> None:
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as model_bazaar_dir:
+        model = build_model(model_bazaar_dir, license_path, n_chunks, rng)
+        queries = [random_text(rng, 8) for _ in range(n_queries)]
+
+        scenarios = {
+            "no constraints": {},
+            "with constraints": {
+                "category": {"constraint_type": "AnyOf", "values": CATEGORIES[:3]}
+            },
+        }
+        paths = {
+            "retrieval only": retrieval_only,
+            "legacy": legacy_search,
+            "fast": fast_search,
+        }
+
+        header = f"{'scenario':<18} {'path':<16} {'cpu ms/request':>16}"
+        print(f"top_k={top_k}, {n_chunks} chunks, {n_queries} queries")
+        print(header)
+        print("-" * len(header))
+        for scenario_name, constraints in scenarios.items():
+            for query in queries[:10]:
+                legacy = json.loads(legacy_search(model, query, top_k, constraints))
+                fast = json.loads(fast_search(model, query, top_k, constraints))
+                if legacy != fast:
+                    raise AssertionError(
+                        f"Fast search response differs from legacy response for '{query}'."
+                    )
+
+            for path_name, search in paths.items():
+                cpu = cpu_per_request(
+                    search, model, queries, top_k, constraints, repeats
+                )
+                print(f"{scenario_name:<18} {path_name:<16} {cpu * 1000:>16.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--license", required=True)
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--top_k", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    run(
+        license_path=args.license,
+        n_chunks=args.chunks,
+        n_queries=args.queries,
+        top_k=args.top_k,
+        repeats=args.repeats,
+    )
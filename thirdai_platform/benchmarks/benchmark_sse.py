@@ -0,0 +1,181 @@
+"""
+Micro-benchmark for parsing streamed LLM responses.
+
+Replays recorded OpenAI and llama.cpp style streams through the SSE decoder under
+different network fragmentations, and reports the parsing throughput and the
+number of tokens lost. The line splitting parser that was used before the SSE
+decoder is included for comparison.
+
+Usage:
+    python -m benchmarks.benchmark_sse --tokens 20000
+"""
+
+import argparse
+import json
+import random
+import time
+from typing import Callable, Iterable, List
+
+from llm_dispatch_job.sse import SSEDecoder
+
+SAMPLE_TEXT = (
+    "The theory of relativity usually encompasses two interrelated physics "
+    "theories by Albert Einstein: special relativity and general relativity, "
+    "proposed and published in 1905 and 1915, respectively. Ünïcödé tökens "
+    "and emoji 😀 are included so that multi-byte characters are split too."
+)
+
+
+def record_openai_stream(tokens: List[str]) -> bytes:
+    events = []
+    for token in tokens:
+        chunk = {
+            "id": "chatcmpl-123",
+            "object": "chat.completion.chunk",
+            "created": 1694268190,
+            "model": "gpt-4o-mini",
+            "choices": [
+                {
+                    "index": 0,
+                    "delta": {"content": token},
+                    "logprobs": None,
+                    "finish_reason": None,
+                }
+            ],
+        }
+        events.append(f"data: {json.dumps(chunk)}\n\n")
+    events.append("data: [DONE]\n\n")
+    return "".join(events).encode("utf-8")
+
+
+def record_llama_cpp_stream(tokens: List[str]) -> bytes:
+    events = []
+    for token in tokens:
+        chunk = {
+            "choices": [
+                {"finish_reason": None, "index": 0, "delta": {"content": token}}
+            ],
+            "created": 1694268190,
+            "id": "chatcmpl-123",
+            "model": "gpt-3.5-turbo",
+            "object": "chat.completion.chunk",
+        }
+        events.append(f"data: {json.dumps(chunk)}\r\n\r\n")
+    events.append("data: [DONE]\r\n\r\n")
+    return "".join(events).encode("utf-8")
+
+
+def make_tokens(n_tokens: int) -> List[str]:
+    words = SAMPLE_TEXT.split(" ")
+    return [" " + words[i % len(words)] for i in range(n_tokens)]
+
+
+def whole_events(stream: bytes) -> List[bytes]:
+    return [event + b"\n\n" for event in stream.split(b"\n\n") if event]
+
+
+def fixed_size(size: int) -> Callable[[bytes], List[bytes]]:
+    def fragment(stream: bytes) -> List[bytes]:
+        return [stream[i : i + size] for i in range(0, len(stream), size)]
+
+    return fragment
+
+
+def random_size(max_size: int, seed: int = 0) -> Callable[[bytes], List[bytes]]:
+    def fragment(stream: bytes) -> List[bytes]:
+        rng = random.Random(seed)
+        chunks = []
+        pos = 0
+        while pos < len(stream):
+            size = rng.randint(1, max_size)
+            chunks.append(stream[pos : pos + size])
+            pos += size
+        return chunks
+
+    return fragment
+
+
+def parse_with_sse_decoder(chunks: Iterable[bytes]) -> List[str]:
+    decoder = SSEDecoder()
+    tokens = []
+    for chunk in chunks:
+        for event in decoder.feed(chunk):
+            if event == "[DONE]":
+                return tokens
+            content = json.loads(event)["choices"][0].get("delta", {}).get("content")
+            if content is not None:
+                tokens.append(content)
+    return tokens
+
+
+def parse_with_line_split(chunks: Iterable[bytes]) -> List[str]:
+    # The parser used before the SSE decoder, which drops any event that is
+    # split across chunks.
+    tokens = []
+    for chunk in chunks:
+        try:
+            text = chunk.decode("utf8")
+        except UnicodeDecodeError:
+            continue
+        for line in text.split("\n"):
+            line = line.strip()
+            if line == "":
+                continue
+            try:
+                data = json.loads(line[len("data: ") :])
+                content = data["choices"][0].get("delta", {}).get("content")
+            except:
+                continue
+            if content is not None:
+                tokens.append(content)
+    return tokens
+
+
+def run(n_tokens: int, repeats: int) -> None:
+    tokens = make_tokens(n_tokens)
+    streams = {
+        "openai": record_openai_stream(tokens),
+        "llama.cpp": record_llama_cpp_stream(tokens),
+    }
+    fragmentations = {
+        "whole events": whole_events,
+        "1460 bytes": fixed_size(1460),
+        "7 bytes": fixed_size(7),
+        "random 1-64 bytes": random_size(64),
+    }
+    parsers = {
+        "sse decoder": parse_with_sse_decoder,
+        "line split": parse_with_line_split,
+    }
+
+    header = f"{'stream':<10} {'fragmentation':<18} {'parser':<12} {'tokens/sec':>12} {'lost':>8}"
+    print(header)
+    print("-" * len(header))
+    for stream_name, stream in streams.items():
+        for fragmentation_name, fragment in fragmentations.items():
+            chunks = fragment(stream)
+            for parser_name, parser in parsers.items():
+                best = float("inf")
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    parsed = parser(chunks)
+                    best = min(best, time.perf_counter() - start)
+
+                lost = len(tokens) - len(parsed)
+                if parser is parse_with_sse_decoder and parsed != tokens:
+                    raise AssertionError(
+                        f"SSE decoder lost tokens for {stream_name} stream with {fragmentation_name} fragments."
+                    )
+                print(
+                    f"{stream_name:<10} {fragmentation_name:<18} {parser_name:<12} "
+                    f"{len(parsed) / best:>12.0f} {lost:>8}"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=20000)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    run(n_tokens=args.tokens, repeats=args.repeats)
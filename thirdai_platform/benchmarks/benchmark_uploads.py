@@ -0,0 +1,177 @@
+"""
+Benchmark for the peak memory used by concurrent file uploads.
+
+Serves an endpoint which saves uploaded files with download_local_files, as the
+train and insert endpoints do, and sends it concurrent multipart uploads. The
+request bodies are generated in chunks and passed directly to the ASGI app, so
+no server or client buffers the uploads. Uploads are handled in two ways:
+  - legacy: each file is read into memory and then written to disk, which is
+    what download_local_file did before uploads were copied in chunks.
+  - streaming: download_local_files, which copies uploads in chunks.
+
+Each mode runs in its own process, and the peak RSS of that process above its
+RSS before the uploads is reported.
+
+Usage:
+    python -m benchmarks.benchmark_uploads --uploads 8 --size_mb 200
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from typing import List
+
+from fastapi import FastAPI, UploadFile
+from platform_common.file_handler import download_local_files
+from platform_common.pydantic_models.training import FileInfo, FileLocation
+
+BOUNDARY = "benchmark-upload-boundary"
+BODY_CHUNK_SIZE = 64 * 1024
+
+
+def legacy_save(files: List[UploadFile], dest_dir: str) -> None:
+    for file in files:
+        with open(os.path.join(dest_dir, file.filename), "wb") as f:
+            f.write(file.file.read())
+
+
+def streaming_save(files: List[UploadFile], dest_dir: str) -> None:
+    download_local_files(
+        files,
+        [FileInfo(path=file.filename, location=FileLocation.local) for file in files],
+        dest_dir,
+    )
+
+
+def create_app(mode: str, dest_dir: str) -> FastAPI:
+    save = legacy_save if mode == "legacy" else streaming_save
+    app = FastAPI()
+
+    @app.post("/upload")
+    def upload(files: List[UploadFile]):
+        save(files, dest_dir)
+        return {"uploaded": len(files)}
+
+    return app
+
+
+async def upload_file(app: FastAPI, filename: str, size: int) -> int:
+    head = (
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="files"; filename="{filename}"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode()
+    tail = f"\r\n--{BOUNDARY}--\r\n".encode()
+
+    def body_chunks():
+        yield head
+        data = b"x" * BODY_CHUNK_SIZE
+        for start in range(0, size, BODY_CHUNK_SIZE):
+            yield data[: min(BODY_CHUNK_SIZE, size - start)]
+        yield tail
+
+    chunks = body_chunks()
+    next_chunk = next(chunks)
+
+    async def receive():
+        nonlocal next_chunk
+        if next_chunk is None:
+            return {"type": "http.disconnect"}
+        chunk, next_chunk = next_chunk, next(chunks, None)
+        # Yield to the event loop so that the uploads are interleaved.
+        await asyncio.sleep(0)
+        return {"type": "http.request", "body": chunk, "more_body": bool(next_chunk)}
+
+    status = {}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status["code"] = message["status"]
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/upload",
+        "raw_path": b"/upload",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode()),
+            (b"content-length", str(len(head) + size + len(tail)).encode()),
+        ],
+        "client": ("127.0.0.1", 0),
+        "server": ("127.0.0.1", 80),
+    }
+    await app(scope, receive, send)
+    return status["code"]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_mode(mode: str, n_uploads: int, size: int) -> None:
+    with tempfile.TemporaryDirectory() as dest_dir:
+        app = create_app(mode, dest_dir)
+
+        async def upload_all():
+            return await asyncio.gather(
+                *[upload_file(app, f"doc_{i}.bin", size) for i in range(n_uploads)]
+            )
+
+        before = peak_rss_mb()
+        statuses = asyncio.run(upload_all())
+        after = peak_rss_mb()
+
+        if any(code != 200 for code in statuses):
+            raise RuntimeError(f"Uploads failed with status codes {statuses}")
+        for i in range(n_uploads):
+            if os.path.getsize(os.path.join(dest_dir, f"doc_{i}.bin")) != size:
+                raise RuntimeError(f"Upload doc_{i}.bin was not saved correctly.")
+
+    print(f"{mode:<12} {before:>16.1f} {after:>16.1f} {after - before:>16.1f}")
+
+
+def run(n_uploads: int, size_mb: int) -> None:
+    print(f"{n_uploads} concurrent uploads of {size_mb}MB")
+    header = f"{'mode':<12} {'rss before (MB)':>16} {'peak rss (MB)':>16} {'increase (MB)':>16}"
+    print(header)
+    print("-" * len(header))
+    sys.stdout.flush()
+    for mode in ["legacy", "streaming"]:
+        # Each mode runs in a new process since the peak RSS cannot be reset.
+        subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.benchmark_uploads",
+                "--uploads",
+                str(n_uploads),
+                "--size_mb",
+                str(size_mb),
+                "--mode",
+                mode,
+            ],
+            check=True,
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uploads", type=int, default=8)
+    parser.add_argument("--size_mb", type=int, default=200)
+    parser.add_argument("--mode", choices=["legacy", "streaming"], default=None)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.uploads, args.size_mb * 1024 * 1024)
+    else:
+        run(args.uploads, args.size_mb)
@@ -0,0 +1,152 @@
+import ast
+import glob
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import Any, Dict, List
+from urllib.parse import quote
+
+import fitz
+import numpy as np
+from thirdai.neural_db_v2.core.types import Chunk
+
+
+def offsets(lengths: List[int]) -> np.ndarray:
+    result = np.zeros(len(lengths) + 1, dtype=np.int64)
+    result[1:] = np.cumsum(lengths)
+    return result
+
+
+@dataclass
+class ChunkBoxIndex:
+    """
+    The text and bounding boxes of every chunk of a version of a PDF document.
+    The texts and boxes of all chunks are stored in flat arrays. The text of
+    chunk i is the utf-8 text[text_offsets[i]:text_offsets[i + 1]], and its boxes
+    are boxes[box_offsets[i]:box_offsets[i + 1]], on the corresponding pages.
+    This is saved as an uncompressed npz file so that loading it only requires
+    reading the arrays back, instead of parsing the metadata of every chunk.
+    """
+
+    chunk_ids: np.ndarray  # int64, (n_chunks,)
+    text: np.ndarray  # uint8, (total utf-8 bytes,)
+    text_offsets: np.ndarray  # int64, (n_chunks + 1,)
+    box_offsets: np.ndarray  # int64, (n_chunks + 1,)
+    pages: np.ndarray  # int32, (n_boxes,)
+    boxes: np.ndarray  # float64, (n_boxes, 4)
+
+    @staticmethod
+    def from_chunk_boxes(chunks: List[Chunk]) -> "ChunkBoxIndex":
+        return ChunkBoxIndex.from_boxes(
+            chunks, [ast.literal_eval(c.metadata["chunk_boxes"]) for c in chunks]
+        )
+
+    @staticmethod
+    def from_highlights(chunks: List[Chunk], source: str) -> "ChunkBoxIndex":
+        # Older PDFs store the ids of the text blocks of each chunk, so the boxes
+        # have to be recovered from the blocks of the pages in the PDF.
+        with fitz.open(source) as doc:
+            page_blocks = [page.get_text("blocks") for page in doc]
+        return ChunkBoxIndex.from_boxes(
+            chunks,
+            [
+                [
+                    (page_idx, page_blocks[page_idx][i][:4])
+                    for page_idx, block_ids in ast.literal_eval(
+                        c.metadata["highlight"]
+                    ).items()
+                    for i in block_ids
+                ]
+                for c in chunks
+            ],
+        )
+
+    @staticmethod
+    def from_boxes(
+        chunks: List[Chunk], chunk_boxes: List[List[Any]]
+    ) -> "ChunkBoxIndex":
+        texts = [c.text.encode("utf-8") for c in chunks]
+        return ChunkBoxIndex(
+            chunk_ids=np.array([c.chunk_id for c in chunks], dtype=np.int64),
+            text=np.frombuffer(b"".join(texts), dtype=np.uint8),
+            text_offsets=offsets([len(text) for text in texts]),
+            box_offsets=offsets([len(boxes) for boxes in chunk_boxes]),
+            pages=np.array(
+                [page for boxes in chunk_boxes for page, _ in boxes], dtype=np.int32
+            ),
+            boxes=np.array(
+                [box for boxes in chunk_boxes for _, box in boxes], dtype=np.float64
+            ).reshape(-1, 4),
+        )
+
+    def save(self, path: str) -> None:
+        # Written to a temporary file and then renamed so that concurrent readers
+        # never see a partially written index.
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                np.savez(
+                    file,
+                    chunk_ids=self.chunk_ids,
+                    text=self.text,
+                    text_offsets=self.text_offsets,
+                    box_offsets=self.box_offsets,
+                    pages=self.pages,
+                    boxes=self.boxes,
+                )
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @staticmethod
+    def load(path: str) -> "ChunkBoxIndex":
+        with np.load(path, allow_pickle=False) as arrays:
+            return ChunkBoxIndex(
+                chunk_ids=arrays["chunk_ids"],
+                text=arrays["text"],
+                text_offsets=arrays["text_offsets"],
+                box_offsets=arrays["box_offsets"],
+                pages=arrays["pages"],
+                boxes=arrays["boxes"],
+            )
+
+    def to_dict(self, filename: str) -> Dict[str, Any]:
+        text = self.text.tobytes()
+        text_offsets = self.text_offsets.tolist()
+        pages = self.pages.tolist()
+        boxes = self.boxes.tolist()
+        box_offsets = self.box_offsets.tolist()
+        return {
+            "filename": filename,
+            "id": self.chunk_ids.tolist(),
+            "text": [
+                text[start:end].decode("utf-8")
+                for start, end in zip(text_offsets[:-1], text_offsets[1:])
+            ],
+            "boxes": [
+                [(pages[j], boxes[j]) for j in range(start, end)]
+                for start, end in zip(box_offsets[:-1], box_offsets[1:])
+            ],
+        }
+
+
+def chunk_index_path(index_dir: str, doc_id: str, doc_version: int) -> str:
+    return os.path.join(index_dir, f"{quote(doc_id, safe='')}.{doc_version}.npz")
+
+
+def remove_chunk_indexes(index_dir: str, doc_ids: List[str]) -> None:
+    """
+    Removes the indexes for every version of the given documents.
+    """
+    for doc_id in doc_ids:
+        prefix = f"{quote(doc_id, safe='')}."
+        pattern = os.path.join(glob.escape(index_dir), f"{prefix}*.npz")
+        for path in glob.glob(pattern):
+            # Ids are quoted, so they can contain '.', which means the pattern can
+            # also match the indexes of other documents, e.g. "a.b" for doc "a".
+            version = os.path.basename(path)[len(prefix) : -len(".npz")]
+            if version.isdigit():
+                os.remove(path)
@@ -1,25 +1,22 @@
 import re
 from collections import defaultdict
-from typing import Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
 from urllib.parse import urljoin
 
 from deployment_job.pydantic_models.inputs import PiiEntity
 from fastapi import HTTPException, status
 from platform_common.logging import JobLogger, LogCode
 from requests import Session
+from requests.adapters import HTTPAdapter
 
+# Maximum number of concurrent requests, and pooled connections, to the guardrail
+# model when it does not support batch predictions.
+MAX_CONCURRENT_REQUESTS = 16
 
-def max_overlap(a: str, b: str) -> int:
-    def longest_prefix(i: int, j: int) -> int:
-        cnt = 0
-        for k in range(0, min(len(a) - i, len(b) - j)):
-            if a[i + k] == b[j + k]:
-                cnt += 1
-            else:
-                break
-        return cnt
-
-    return max(longest_prefix(i, j) for i in range(len(a)) for j in range(len(b)))
+# Entities of the same tag are given the same label if they are equal or share a
+# substring of at least this many characters.
+MIN_ENTITY_OVERLAP = 6
 
 
 def merge_tags(tokens: List[str], tags: List[List[str]]):
@@ -45,20 +42,56 @@ def merge_tags(tokens: List[str], tags: List[List[str]]):
     return merged_tokens, merged_tags
 
 
+class EntityIndex:
+    """
+    Index of the substrings of length MIN_ENTITY_OVERLAP of the entities of a
+    tag. Two entities share a substring of at least that length if and only if
+    they share one of exactly that length, so the first entity which matches a
+    new entity is found with one lookup per character of the new entity, instead
+    of comparing it against every entity of the tag.
+    """
+
+    def __init__(self):
+        self.labels: List[str] = []
+        self.entities: Dict[str, int] = {}
+        self.substrings: Dict[str, int] = {}
+
+    def find(self, entity: str) -> Optional[str]:
+        matches = [
+            self.substrings.get(entity[i : i + MIN_ENTITY_OVERLAP])
+            for i in range(len(entity) - MIN_ENTITY_OVERLAP + 1)
+        ]
+        matches.append(self.entities.get(entity))
+        matches = [match for match in matches if match is not None]
+        if not matches:
+            return None
+        # Entities are matched in the order they were added.
+        return self.labels[min(matches)]
+
+    def add(self, entity: str, label: str):
+        position = len(self.labels)
+        self.labels.append(label)
+        self.entities.setdefault(entity, position)
+        for i in range(len(entity) - MIN_ENTITY_OVERLAP + 1):
+            self.substrings.setdefault(entity[i : i + MIN_ENTITY_OVERLAP], position)
+
+
 class LabelMap:
     def __init__(self):
         self.tag_to_entities: Dict[str, Dict[str, str]] = defaultdict(dict)
+        self.tag_to_index: Dict[str, EntityIndex] = defaultdict(EntityIndex)
         self.next_label = 0
 
     def get_label(self, tag: str, entity: str) -> str:
-        for label, existing_entity in self.tag_to_entities[tag].items():
-            if entity == existing_entity or max_overlap(entity, existing_entity) > 5:
-                return label
+        label = self.tag_to_index[tag].find(entity)
+        if label is not None:
+            return label
 
         label = f"[{tag}#{self.next_label}]"
         self.next_label += 1
 
         self.tag_to_entities[tag][label] = entity
+        self.tag_to_index[tag].add(entity, label)
         return label
 
     def get_entities(self) -> List[PiiEntity]:
@@ -74,50 +107,129 @@ class Guardrail:
         self, guardrail_model_id: str, model_bazaar_endpoint: str, logger: JobLogger
     ):
         self.session = Session()
+        adapter = HTTPAdapter(pool_maxsize=MAX_CONCURRENT_REQUESTS)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
         self.endpoint = urljoin(model_bazaar_endpoint, f"{guardrail_model_id}/predict")
+        self.batch_endpoint = urljoin(
+            model_bazaar_endpoint, f"{guardrail_model_id}/predict-batch"
+        )
+        # Set to False if the guardrail model is served by a deployment that was
+        # started before the batch endpoint was added.
+        self.batch_supported = True
+        self.executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS)
         self.logger = logger
 
-    def query_pii_model(self, text: str, access_token: str):
-        res = self.session.post(
-            self.endpoint,
+    def post(self, endpoint: str, access_token: str, body: Dict[str, Any]):
+        return self.session.post(
+            endpoint,
             headers={
                 "User-Agent": "NDB Deployment job",
                 "Authorization": f"Bearer {access_token}",
             },
-            json={"text": text, "data_type": "unstructured"},
+            json=body,
         )
 
+    def check_results(self, res) -> Any:
         if res.status_code != status.HTTP_200_OK:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Unable to access guardrail model: error {res.status_code}",
             )
 
-        results = res.json()["data"]["prediction_results"]
+        return res.json()["data"]["prediction_results"]
 
+    def check_data_type(self, results: Dict[str, Any]):
         if results["data_type"] != "unstructured":
             message = f"Guardrail model returned non-unstructured data type: {results['data_type']}"
             self.logger.error(message, code=LogCode.GUARDRAILS)
             raise ValueError(message)
 
+    def query_pii_model(self, text: str, access_token: str):
+        res = self.post(
+            self.endpoint, access_token, {"text": text, "data_type": "unstructured"}
+        )
+
+        results = self.check_results(res)
+        self.check_data_type(results)
+
         return results
 
+    def query_pii_model_batch(self, texts: List[str], access_token: str):
+        """
+        Returns the predictions of the guardrail model for each text, in order.
+        The texts are sent in a single request to the batch endpoint of the model,
+        or in concurrent requests to its predict endpoint if the batch endpoint is
+        not available.
+        """
+        if self.batch_supported:
+            res = self.post(
+                self.batch_endpoint,
+                access_token,
+                {"texts": texts, "data_type": "unstructured"},
+            )
+            if res.status_code not in (
+                status.HTTP_404_NOT_FOUND,
+                status.HTTP_405_METHOD_NOT_ALLOWED,
+            ):
+                results = self.check_results(res)
+                for result in results:
+                    self.check_data_type(result)
+                return results
+
+            self.batch_supported = False
+            self.logger.info(
+                "Guardrail model does not support batch predictions, falling back to concurrent predictions",
+                code=LogCode.GUARDRAILS,
+            )
+
+        return list(
+            self.executor.map(
+                lambda text: self.query_pii_model(text=text, access_token=access_token),
+                texts,
+            )
+        )
+
+    def label_entities(self, data: Dict[str, Any], label_map: LabelMap) -> str:
+        entities, tags = merge_tags(tokens=data["tokens"], tags=data["predicted_tags"])
+
+        entities = [
+            label_map.get_label(tag=tag, entity=entity) if tag != "O" else entity
+            for entity, tag in zip(entities, tags)
+        ]
+
+        self.logger.debug(f"Redacted PII: {entities}", code=LogCode.GUARDRAILS)
+
+        return " ".join(entities)
+
     def redact_pii(self, text: str, access_token: str, label_map: LabelMap):
         try:
             data = self.query_pii_model(text=text, access_token=access_token)
 
-            entities, tags = merge_tags(
-                tokens=data["tokens"], tags=data["predicted_tags"]
+            return self.label_entities(data, label_map)
+        except Exception as e:
+            message = f"Error redacting PII: {e}"
+            self.logger.error(message, code=LogCode.GUARDRAILS)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=message
             )
 
-            entities = [
-                label_map.get_label(tag=tag, entity=entity) if tag != "O" else entity
-                for entity, tag in zip(entities, tags)
-            ]
+    def redact_pii_batch(
+        self, texts: List[str], access_token: str, label_map: LabelMap
+    ) -> List[str]:
+        """
+        Redacts each of the texts. Labels are assigned to the entities in the
+        order of the texts, so the result is the same as calling redact_pii for
+        each text in turn.
+        """
+        if not texts:
+            return []
 
-            self.logger.debug(f"Redacted PII: {entities}", code=LogCode.GUARDRAILS)
+        try:
+            results = self.query_pii_model_batch(texts=texts, access_token=access_token)
 
-            return " ".join(entities)
+            return [self.label_entities(data, label_map) for data in results]
         except Exception as e:
             message = f"Error redacting PII: {e}"
             self.logger.error(message, code=LogCode.GUARDRAILS)
@@ -0,0 +1,59 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Hashable, Optional, Tuple
+
+from prometheus_client import Counter, Gauge
+
+highlight_cache_hits_metric = Counter(
+    "ndb_highlight_cache_hits",
+    "Number of highlighted PDFs served from the render cache.",
+)
+highlight_cache_misses_metric = Counter(
+    "ndb_highlight_cache_misses",
+    "Number of highlighted PDFs that had to be rendered.",
+)
+highlight_cache_bytes_metric = Gauge(
+    "ndb_highlight_cache_bytes",
+    "Total size of the highlighted PDFs in the render cache.",
+)
+
+
+class HighlightCache:
+    """
+    Cache of rendered highlighted PDFs. The total size of the cached PDFs is kept
+    within max_bytes by evicting the least recently used PDFs. A PDF that is
+    larger than max_bytes on its own is not cached.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[Hashable, Tuple[str, bytes]] = OrderedDict()
+        self.total_bytes = 0
+        self.lock = Lock()
+
+    def get(self, key: Hashable) -> Optional[Tuple[str, bytes]]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                highlight_cache_hits_metric.inc()
+                return entry
+        highlight_cache_misses_metric.inc()
+        return None
+
+    def put(self, key: Hashable, source: str, pdf_bytes: bytes) -> None:
+        if len(pdf_bytes) > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= len(previous[1])
+
+            self.entries[key] = (source, pdf_bytes)
+            self.total_bytes += len(pdf_bytes)
+
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self.entries.popitem(last=False)
+                self.total_bytes -= len(evicted_bytes)
+
+            highlight_cache_bytes_metric.set(self.total_bytes)
@@ -19,6 +19,7 @@ try:
         UDTRouterTextClassification,
         UDTRouterTokenClassification,
     )
+    from deployment_job.usage_stats import metrics_registry
     from fastapi import FastAPI, Request
     from fastapi.middleware.cors import CORSMiddleware
     from fastapi.responses import JSONResponse
@@ -27,6 +28,7 @@ try:
     from platform_common.pydantic_models.deployment import DeploymentConfig, UDTSubType
     from platform_common.pydantic_models.training import ModelType
     from prometheus_client import make_asgi_app
+    from starlette.concurrency import run_in_threadpool
 except ImportError as e:
     logging.error(f"Failed to import module: {e}")
     sys.exit(f"ImportError: {e}")
@@ -100,7 +102,10 @@ async def log_requests(request: Request, call_next):
                 body = "Could not parse body as JSON"
         audit_log["body"] = body
         try:
-            permissions = Permissions._get_permissions(
+            # A cache miss requires a request to the model bazaar, so this is run
+            # in the threadpool to avoid blocking the event loop.
+            permissions = await run_in_threadpool(
+                Permissions._get_permissions,
                 token=request.headers.get("Authorization").split()[1],
             )
             audit_log["username"] = permissions[3]
@@ -194,7 +199,7 @@ for attempt in range(1, max_retries + 1):
 
 app.include_router(backend_router.router)
 
-app.mount("/metrics", make_asgi_app())
+app.mount("/metrics", make_asgi_app(registry=metrics_registry()))
 
 
 @app.exception_handler(404)
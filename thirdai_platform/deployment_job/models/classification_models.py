@@ -52,6 +52,10 @@ class ClassificationModel(Model):
     def predict(self, **kwargs):
         pass
 
+    @abstractmethod
+    def predict_batch(self, **kwargs):
+        pass
+
 
 class TextClassificationModel(ClassificationModel):
     def __init__(self, config: DeploymentConfig, logger: JobLogger):
@@ -128,6 +132,36 @@ class TextClassificationModel(ClassificationModel):
             self.logger.error(f"Error predicting: {e}", code=LogCode.MODEL_PREDICT)
             raise e
 
+    def predict_batch(self, texts: List[str], top_k: int, **kwargs):
+        """
+        Predicts the top_k classes of each text in a batch with a single call to
+        the model, in the same format as predict.
+        """
+        if not texts:
+            return []
+
+        try:
+            top_k = min(top_k, self.num_classes)
+            class_ids, activations = self.model.predict_batch(
+                [{"text": text} for text in texts], top_k=top_k
+            )
+
+            return [
+                SearchResultsTextClassification(
+                    query_text=text,
+                    predicted_classes=[
+                        (self.model.class_name(class_id), activation)
+                        for class_id, activation in zip(ids, scores)
+                    ],
+                )
+                for text, ids, scores in zip(texts, class_ids, activations)
+            ]
+        except Exception as e:
+            self.logger.error(
+                f"Error predicting batch: {e}", code=LogCode.MODEL_PREDICT
+            )
+            raise e
+
     def insert_sample(self, sample: TextClassificationData):
         text_sample = DataSample(
             name="text_classification",
@@ -215,16 +249,19 @@ class TokenClassificationModel(ClassificationModel):
             )
             raise e
 
+    @staticmethod
+    def parse_log(text: str, data_type: str) -> Union[UnstructuredText, XMLLog]:
+        if data_type == "unstructured":
+            return UnstructuredText(text)
+        if data_type == "xml":
+            return XMLLog(text)
+        raise ValueError(
+            f"Expected data type to be either 'unstructured' or 'xml'. Found: {data_type}"
+        )
+
     def predict(self, text: str, data_type: str, **kwargs):
         try:
-            if data_type == "unstructured":
-                log = UnstructuredText(text)
-            elif data_type == "xml":
-                log = XMLLog(text)
-            else:
-                raise ValueError(
-                    "Expected data type to be either 'unstructured' or 'xml'. Found: {data_type}"
-                )
+            log = self.parse_log(text, data_type)
 
             model_predictions = self.model.predict(
                 log.inference_sample, top_k=1, as_unicode=True
@@ -245,6 +282,39 @@ class TokenClassificationModel(ClassificationModel):
 
         return result
 
+    def predict_batch(self, texts: List[str], data_type: str, **kwargs):
+        """
+        Predicts the tags for a batch of texts with a single call to the model,
+        returning the same results as calling predict for each text.
+        """
+        if not texts:
+            return []
+
+        try:
+            logs = [self.parse_log(text, data_type) for text in texts]
+
+            model_predictions = self.model.predict_batch(
+                [log.inference_sample for log in logs], top_k=1, as_unicode=True
+            )
+            results = [
+                log.process_prediction(predictions)
+                for log, predictions in zip(logs, model_predictions)
+            ]
+
+        except ValueError as e:
+            message = f"Error processing batch prediction: {e}"
+            self.logger.error(message, code=LogCode.MODEL_PREDICT)
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=message,
+            )
+        except Exception as e:
+            message = f"Error processing batch prediction: {e}"
+            self.logger.error(message, code=LogCode.MODEL_PREDICT)
+            raise e
+
+        return results
+
     @property
     def tag_metadata(self) -> TagMetadata:
         # load tags and their status from the storage
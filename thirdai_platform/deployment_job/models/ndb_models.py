@@ -3,30 +3,79 @@ Defines NDB model classes for the application.
 """
 
 import ast
+import json
+import multiprocessing
 import os
 import shutil
 import tempfile
 import traceback
 import uuid
+from functools import lru_cache
+from multiprocessing.pool import Pool
 from pathlib import Path
 from threading import Lock
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import fitz
 import platform_common.ndb.ndbv2_parser as ndbv2_parser
 import thirdai.neural_db_v2.chunk_stores.constraints as ndbv2_constraints
 from deployment_job.chat import llm_providers
+from deployment_job.chunk_index import (
+    ChunkBoxIndex,
+    chunk_index_path,
+    remove_chunk_indexes,
+)
+from deployment_job.highlight_cache import HighlightCache
 from deployment_job.models.model import Model
 from deployment_job.pydantic_models import inputs
-from deployment_job.utils import acquire_file_lock, release_file_lock
+from deployment_job.search_cache import (
+    SearchResultCache,
+    search_cache_key,
+    serialize_constraints,
+)
+from deployment_job.utils import (
+    ReadWriteLock,
+    acquire_file_lock,
+    release_file_lock,
+)
 from fastapi import HTTPException, status
+from platform_common import file_ops
 from platform_common.file_handler import FileInfo, expand_cloud_buckets_and_directories
 from platform_common.logging import JobLogger, LogCode
+from platform_common.ndb.document_store import DocumentStore
 from platform_common.ndb.utils import delete_docs_and_remove_files
 from platform_common.pydantic_models.deployment import DeploymentConfig
+from prometheus_client import Histogram
 from thirdai import neural_db_v2 as ndbv2
 from thirdai.neural_db_v2.core.types import Chunk, MetadataType
 
+ndb_lock_wait_metric = Histogram(
+    "ndb_lock_wait_seconds",
+    "Time spent waiting for the NDB lock, by lock mode (read or write).",
+    ["mode"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+
+def compile_constraints(
+    constraints: Dict[str, Dict[str, Any]],
+) -> Dict[str, ndbv2_constraints.Constraint]:
+    return {
+        key: getattr(ndbv2_constraints, constraint["constraint_type"])(
+            **{k: v for k, v in constraint.items() if k != "constraint_type"}
+        )
+        for key, constraint in constraints.items()
+    }
+
+
+@lru_cache(maxsize=1024)
+def compile_serialized_constraints(
+    serialized_constraints: str,
+) -> Dict[str, ndbv2_constraints.Constraint]:
+    # Constraint objects are not modified by searches, so they can be shared by
+    # every search with the same constraints.
+    return compile_constraints(json.loads(serialized_constraints))
+
 
 class NDBModel(Model):
     def __init__(
@@ -37,9 +86,32 @@ class NDBModel(Model):
     ):
         super().__init__(config=config, logger=logger)
 
-        self.db_lock = Lock()
+        # Searches and other reads share the lock so that they can run in
+        # parallel, while insert, delete, upvote, and associate hold it exclusively.
+        self.db_lock = ReadWriteLock(wait_metric=ndb_lock_wait_metric)
         self.db = self.load(write_mode=write_mode)
 
+        self.search_cache = SearchResultCache(
+            max_entries=self.config.model_options.search_cache_size,
+            ttl_sec=self.config.model_options.search_cache_ttl_sec,
+        )
+
+        self.highlight_cache = HighlightCache(
+            max_bytes=self.config.model_options.highlight_cache_bytes
+        )
+
+        # Maps the document names stored in chunks to the full path of the document.
+        self.source_paths: Dict[str, str] = {}
+
+        # Inserts with several documents parse them in a pool of processes, which
+        # is created on first use. Indexing the parsed documents still happens in
+        # this process while holding the write lock.
+        self.parse_processes = (
+            self.config.model_options.parse_processes or os.cpu_count() or 1
+        )
+        self.parse_pool: Optional[Pool] = None
+        self.parse_pool_lock = Lock()
+
         self.chat_instances = {}
         self.chat_instance_lock = Lock()
         self.set_chat(provider=self.config.model_options.llm_provider)
@@ -59,19 +131,31 @@ class NDBModel(Model):
     def doc_save_path(self):
         return os.path.join(self.ndb_save_path(), "documents")
 
+    def chunk_index_dir(self):
+        return os.path.join(self.doc_save_path(), ".chunk_index")
+
     def full_source_path(self, document: str) -> str:
-        return os.path.join(self.doc_save_path(), document)
-
-    def chunk_to_pydantic_ref(self, chunk: Chunk, score: float) -> inputs.Reference:
-        return inputs.Reference(
-            id=chunk.chunk_id,
-            text=chunk.text,
-            source=self.full_source_path(chunk.document),
-            metadata=chunk.metadata or {},
-            context="",
-            source_id=chunk.doc_id,
-            score=score,
-        )
+        source = self.source_paths.get(document)
+        if source is None:
+            source = os.path.join(self.doc_save_path(), document)
+            self.source_paths[document] = source
+        return source
+
+    def chunk_to_reference(self, chunk: Chunk, score: float) -> Dict[str, Any]:
+        """
+        Returns the fields of an inputs.Reference for the chunk as a dict, which
+        can be serialized directly without building and then encoding a pydantic
+        model for every result.
+        """
+        return {
+            "id": int(chunk.chunk_id),
+            "text": chunk.text,
+            "context": "",
+            "source": self.full_source_path(chunk.document),
+            "metadata": chunk.metadata or {},
+            "source_id": chunk.doc_id,
+            "score": float(score),
+        }
 
     def predict(
         self,
@@ -80,75 +164,228 @@ class NDBModel(Model):
         constraints: Dict[str, Dict[str, Any]],
         rerank: bool,
         **kwargs: Any,
-    ) -> inputs.SearchResultsNDB:
-        constraints = {
-            key: getattr(ndbv2_constraints, constraint["constraint_type"])(
-                **{k: v for k, v in constraint.items() if k != "constraint_type"}
-            )
-            for key, constraint in constraints.items()
-        }
+    ) -> Dict[str, Any]:
+        """
+        Returns the fields of an inputs.SearchResultsNDB for the query as a dict.
+        """
+        return self.predict_batch(
+            queries=[query], top_k=top_k, constraints=constraints, rerank=rerank
+        )[0]
 
-        if self.config.autoscaling_enabled:
-            results = self.db.search(
-                query=query, top_k=top_k, constraints=constraints, rerank=rerank
+    def predict_batch(
+        self,
+        queries: List[str],
+        top_k: int,
+        constraints: Dict[str, Dict[str, Any]],
+        rerank: bool,
+        **kwargs: Any,
+    ) -> List[Dict[str, Any]]:
+        serialized_constraints = serialize_constraints(constraints)
+        keys = [
+            search_cache_key(
+                query=query,
+                top_k=top_k,
+                serialized_constraints=serialized_constraints,
+                rerank=rerank,
             )
-        else:
-            with self.db_lock:
-                results = self.db.search(
-                    query=query, top_k=top_k, constraints=constraints, rerank=rerank
+            for query in queries
+        ]
+        references = [self.search_cache.get(key) for key in keys]
+
+        misses = [i for i, refs in enumerate(references) if refs is None]
+        if misses:
+            miss_queries = [queries[i] for i in misses]
+            if serialized_constraints is not None:
+                constraints = compile_serialized_constraints(serialized_constraints)
+            else:
+                constraints = compile_constraints(constraints)
+
+            if self.config.autoscaling_enabled:
+                generation = self.search_cache.generation()
+                results = self.db.search_batch(
+                    queries=miss_queries,
+                    top_k=top_k,
+                    constraints=constraints,
+                    rerank=rerank,
                 )
+            else:
+                with self.db_lock.read():
+                    # Writes bump the generation while holding the write lock, so
+                    # reading it under the read lock ties it to this version of
+                    # the index.
+                    generation = self.search_cache.generation()
+                    results = self.db.search_batch(
+                        queries=miss_queries,
+                        top_k=top_k,
+                        constraints=constraints,
+                        rerank=rerank,
+                    )
 
-        results = [self.chunk_to_pydantic_ref(chunk, score) for chunk, score in results]
+            for i, query_results in zip(misses, results):
+                references[i] = [
+                    self.chunk_to_reference(chunk, score)
+                    for chunk, score in query_results
+                ]
+                self.search_cache.put(keys[i], references[i], generation)
 
-        return inputs.SearchResultsNDB(query_text=query, references=results)
+        return [
+            {"query_text": query, "references": refs}
+            for query, refs in zip(queries, references)
+        ]
 
     def insert(self, documents: List[FileInfo], **kwargs: Any) -> List[Dict[str, str]]:
         # TODO(V2 Support): add flag for upsert
 
-        documents = expand_cloud_buckets_and_directories(documents)
-        ndb_docs = [
-            ndbv2_parser.parse_doc(
-                doc, doc_save_dir=self.doc_save_path(), tmp_dir=self.data_dir
-            )
+        return self.insert_files(expand_cloud_buckets_and_directories(documents))
+
+    def get_parse_pool(self) -> Pool:
+        with self.parse_pool_lock:
+            if self.parse_pool is None:
+                # The deployment process has threads serving requests and
+                # holding locks, so the workers are started from a fork server
+                # instead of forking this process. The parser is imported by the
+                # fork server, so that it is not imported again by each worker.
+                context = multiprocessing.get_context("forkserver")
+                context.set_forkserver_preload([ndbv2_parser.__name__])
+                self.parse_pool = context.Pool(processes=self.parse_processes)
+            return self.parse_pool
+
+    def parse_documents(
+        self, documents: List[FileInfo], skip_stored: bool = True
+    ) -> List[ndbv2_parser.ParsedDoc]:
+        args = [
+            (doc, self.doc_save_path(), self.data_dir, None, False, skip_stored)
             for doc in documents
         ]
+        if len(documents) < 2 or self.parse_processes < 2:
+            return [ndbv2_parser.parse_doc_if_new(*doc_args) for doc_args in args]
+
+        # The pool is shared by concurrent inserts, so it bounds the number of
+        # documents being parsed at once. chunksize=1 spreads large documents
+        # across processes instead of assigning them in contiguous groups.
+        return self.get_parse_pool().starmap(
+            ndbv2_parser.parse_doc_if_new, args, chunksize=1
+        )
+
+    def insert_files(
+        self,
+        documents: List[FileInfo],
+        before_write: Optional[Callable[[], None]] = None,
+    ) -> List[Dict[str, str]]:
+        """
+        Inserts documents which have already been expanded so that each one is a
+        single file. Returns the source and source_id of each document, in order.
+        Documents with the same contents, name, metadata, and options as the
+        latest version of a document in the NDB are not parsed or indexed again,
+        and the source and source_id of the existing document are returned.
+        If given, before_write is called once the documents are parsed and before
+        the write lock is taken, so that callers can order concurrent inserts.
+        """
+        parsed = self.parse_documents(documents)
 
-        for i, doc in enumerate(ndb_docs):
-            if not doc:
+        for i, parsed_doc in enumerate(parsed):
+            if not parsed_doc.doc and not parsed_doc.stored:
                 msg = f"Unable to parse {documents[i].path}. Unsupported file type."
                 self.logger.error(msg, code=LogCode.FILE_VALIDATION)
                 raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=msg)
 
-        with self.db_lock:
-            self.db.insert(ndb_docs)
+        document_store = DocumentStore(self.doc_save_path())
 
-            upsert_doc_ids = [
-                doc.source_id
-                for doc in documents
-                if doc.source_id and doc.options.get("upsert", False)
+        # Stored versions which have since been deleted or replaced are parsed
+        # again, before taking the write lock.
+        with self.db_lock.read():
+            stale = [
+                i
+                for i, parsed_doc in enumerate(parsed)
+                if parsed_doc.stored
+                and not document_store.is_current(self.db, parsed_doc.stored)
             ]
-
-            delete_docs_and_remove_files(
-                db=self.db,
-                doc_ids=upsert_doc_ids,
-                full_documents_path=self.doc_save_path(),
-                keep_latest_version=True,
+        if stale:
+            reparsed = self.parse_documents(
+                [documents[i] for i in stale], skip_stored=False
             )
+            for i, parsed_doc in zip(stale, reparsed):
+                parsed[i] = parsed_doc
+
+        # The copies of local files are synced together before they are indexed.
+        file_ops.sync_barrier([self.doc_save_path()])
+
+        if before_write:
+            before_write()
+
+        with self.db_lock.write():
+            # Maps the content hash of each document to its source and source_id,
+            # which is None until a new document is inserted. Documents that are
+            # repeated in this insert are only indexed once.
+            results: Dict[str, Optional[Dict[str, str]]] = {}
+            new_docs, new_hashes, upsert_doc_ids = [], [], []
+            for file, parsed_doc in zip(documents, parsed):
+                if parsed_doc.content_hash in results:
+                    parsed_doc.discard()
+                    continue
+
+                # Checked again while holding the lock, since a concurrent insert
+                # may have indexed the same document after it was parsed.
+                stored = parsed_doc.stored or document_store.get(
+                    parsed_doc.content_hash
+                )
+                if stored and document_store.is_current(self.db, stored):
+                    parsed_doc.discard()
+                    results[parsed_doc.content_hash] = {
+                        "source": self.full_source_path(stored.document),
+                        "source_id": stored.doc_id,
+                    }
+                    continue
 
-        return [
-            {
-                "source": self.full_source_path(doc.chunks()[0].document.iloc[0]),
-                "source_id": doc.doc_id(),
-            }
-            for doc in ndb_docs
-        ]
+                if not parsed_doc.doc:
+                    # The stored version was current when it was checked, but a
+                    # concurrent request has since deleted or replaced it.
+                    parsed_doc = ndbv2_parser.parse_doc_if_new(
+                        file, self.doc_save_path(), self.data_dir, skip_stored=False
+                    )
+                    if not parsed_doc.doc:
+                        msg = f"Unable to parse {file.path}. Unsupported file type."
+                        self.logger.error(msg, code=LogCode.FILE_VALIDATION)
+                        raise HTTPException(
+                            status_code=status.HTTP_400_BAD_REQUEST, detail=msg
+                        )
+
+                results[parsed_doc.content_hash] = None
+                new_docs.append(parsed_doc.doc)
+                new_hashes.append(parsed_doc.content_hash)
+                if file.source_id and file.options.get("upsert", False):
+                    upsert_doc_ids.append(file.source_id)
+
+            if new_docs:
+                self.search_cache.invalidate()
+                inserted = self.db.insert(new_docs)
+                document_store.add_inserted(new_hashes, new_docs, inserted)
+
+                delete_docs_and_remove_files(
+                    db=self.db,
+                    doc_ids=upsert_doc_ids,
+                    full_documents_path=self.doc_save_path(),
+                    keep_latest_version=True,
+                )
+                remove_chunk_indexes(self.chunk_index_dir(), upsert_doc_ids)
+
+                for content_hash, doc in zip(new_hashes, new_docs):
+                    results[content_hash] = {
+                        "source": self.full_source_path(
+                            doc.chunks()[0].document.iloc[0]
+                        ),
+                        "source_id": doc.doc_id(),
+                    }
+
+        return [results[parsed_doc.content_hash] for parsed_doc in parsed]
 
     def upvote(
         self, text_id_pairs: List[inputs.UpvoteInputSingle], **kwargs: Any
     ) -> None:
         queries = [t.query_text for t in text_id_pairs]
         chunk_ids = [t.reference_id for t in text_id_pairs]
-        with self.db_lock:
+        with self.db_lock.write():
+            self.search_cache.invalidate()
             self.db.upvote(queries=queries, chunk_ids=chunk_ids, **kwargs)
 
     def associate(
@@ -156,20 +393,23 @@ class NDBModel(Model):
     ) -> None:
         sources = [t.source for t in text_pairs]
         targets = [t.target for t in text_pairs]
-        with self.db_lock:
+        with self.db_lock.write():
+            self.search_cache.invalidate()
             self.db.associate(sources=sources, targets=targets, **kwargs)
 
     def delete(self, source_ids: List[str], **kwargs: Any) -> None:
-        with self.db_lock:
+        with self.db_lock.write():
+            self.search_cache.invalidate()
             delete_docs_and_remove_files(
                 db=self.db,
                 doc_ids=source_ids,
                 full_documents_path=self.doc_save_path(),
                 keep_latest_version=False,
             )
+            remove_chunk_indexes(self.chunk_index_dir(), source_ids)
 
     def sources(self) -> List[Dict[str, str]]:
-        with self.db_lock:
+        with self.db_lock.read():
             docs = self.db.documents()
         return sorted(
             [
@@ -184,7 +424,7 @@ class NDBModel(Model):
         )
 
     def get_metadata(self, doc_id: str, doc_version: int):
-        with self.db_lock:
+        with self.db_lock.read():
             chunk_ids = self.db.chunk_store.get_doc_chunks(
                 doc_id=doc_id, before_version=doc_version + 1
             )
@@ -240,48 +480,88 @@ class NDBModel(Model):
         source = self.full_source_path(chunk.document)
         highlights = ast.literal_eval(chunk.metadata["highlight"])
 
-        doc = fitz.open(source)
-        for key, val in highlights.items():
-            page = doc[key]
-            blocks = page.get_text("blocks")
-            for i, b in enumerate(blocks):
-                if i in val:
-                    rect = fitz.Rect(b[:4])
-                    page.add_highlight_annot(rect)
+        with fitz.open(source) as doc:
+            for key, val in highlights.items():
+                page = doc[key]
+                blocks = page.get_text("blocks")
+                for i, b in enumerate(blocks):
+                    if i in val:
+                        rect = fitz.Rect(b[:4])
+                        page.add_highlight_annot(rect)
 
-        return source, doc.tobytes()
+            return source, doc.tobytes()
 
     def highlight_v2(self, chunk: Chunk) -> Tuple[str, Optional[bytes]]:
         source = self.full_source_path(chunk.document)
         highlights = ast.literal_eval(chunk.metadata["chunk_boxes"])
 
-        doc = fitz.open(source)
-        for page, bounding_box in highlights:
-            doc[page].add_highlight_annot(fitz.Rect(bounding_box))
+        with fitz.open(source) as doc:
+            for page, bounding_box in highlights:
+                doc[page].add_highlight_annot(fitz.Rect(bounding_box))
 
-        return source, doc.tobytes()
+            return source, doc.tobytes()
 
     def highlight_pdf(self, chunk_id: int) -> Tuple[str, Optional[bytes]]:
-        with self.db_lock:
+        with self.db_lock.read():
             chunk = self.db.chunk_store.get_chunks([chunk_id])
         if not chunk:
             raise ValueError(f"{chunk_id} is not a valid chunk_id")
         chunk = chunk[0]
 
+        if "highlight" not in chunk.metadata and "chunk_boxes" not in chunk.metadata:
+            return self.full_source_path(chunk.document), None
+
+        # Chunk ids are not reused by later versions of a document, but the
+        # version is part of the key so that a cached render can never be served
+        # for a different version of the document.
+        key = (chunk.chunk_id, chunk.doc_version)
+        if cached := self.highlight_cache.get(key):
+            return cached
+
         if "highlight" in chunk.metadata:
-            return self.highlight_v1(chunk)
-        elif "chunk_boxes" in chunk.metadata:
-            return self.highlight_v2(chunk)
+            source, pdf_bytes = self.highlight_v1(chunk)
         else:
-            return self.full_source_path(chunk.document), None
+            source, pdf_bytes = self.highlight_v2(chunk)
+
+        self.highlight_cache.put(key, source, pdf_bytes)
+        return source, pdf_bytes
 
     def chunks(self, chunk_id: int) -> Optional[Dict[str, Any]]:
-        with self.db_lock:
+        with self.db_lock.read():
             chunk = self.db.chunk_store.get_chunks([chunk_id])
-            if not chunk:
-                raise ValueError(f"{chunk_id} is not a valid chunk_id")
-            chunk = chunk[0]
+        if not chunk:
+            raise ValueError(f"{chunk_id} is not a valid chunk_id")
+        chunk = chunk[0]
+
+        if "chunk_boxes" not in chunk.metadata and "highlight" not in chunk.metadata:
+            return None
 
+        source = self.full_source_path(chunk.document)
+        index_path = chunk_index_path(
+            self.chunk_index_dir(), chunk.doc_id, chunk.doc_version
+        )
+        try:
+            index = ChunkBoxIndex.load(index_path)
+        except FileNotFoundError:
+            index = self.build_chunk_index(chunk, source)
+            # Saved under the read lock, and only if this version of the document
+            # still exists, so that an index which was removed by a concurrent
+            # delete or upsert is not saved again.
+            with self.db_lock.read():
+                if chunk.chunk_id in self.db.chunk_store.get_doc_chunks(
+                    doc_id=chunk.doc_id, before_version=chunk.doc_version + 1
+                ):
+                    try:
+                        index.save(index_path)
+                    except OSError as e:
+                        self.logger.warning(
+                            f"Unable to save chunk index {index_path}: {e}"
+                        )
+
+        return index.to_dict(filename=source)
+
+    def build_chunk_index(self, chunk: Chunk, source: str) -> ChunkBoxIndex:
+        with self.db_lock.read():
             chunk_ids = self.db.chunk_store.get_doc_chunks(
                 doc_id=chunk.doc_id, before_version=chunk.doc_version + 1
             )
@@ -290,29 +570,8 @@ class NDBModel(Model):
         chunks = list(filter(lambda c: c.doc_version == chunk.doc_version, chunks))
 
         if "chunk_boxes" in chunk.metadata:
-            bboxes = [ast.literal_eval(c.metadata["chunk_boxes"]) for c in chunks]
-        elif "highlight" in chunk.metadata:
-            doc = fitz.open(self.full_source_path(chunk.document))
-            page_blocks = [page.get_text("blocks") for page in doc]
-            bboxes = [
-                [
-                    (page_idx, page_blocks[page_idx][i][:4])
-                    for page_idx, block_ids in ast.literal_eval(
-                        c.metadata["highlight"]
-                    ).items()
-                    for i in block_ids
-                ]
-                for c in chunks
-            ]
-        else:
-            return None
-
-        return {
-            "filename": self.full_source_path(chunk.document),
-            "id": [c.chunk_id for c in chunks],
-            "text": [c.text for c in chunks],
-            "boxes": bboxes,
-        }
+            return ChunkBoxIndex.from_chunk_boxes(chunks)
+        return ChunkBoxIndex.from_highlights(chunks, source)
 
     def load(self, write_mode: bool = False, **kwargs) -> ndbv2.NeuralDB:
         try:
@@ -383,7 +642,8 @@ class NDBModel(Model):
         try:
             with tempfile.TemporaryDirectory() as temp_dir:
                 temp_model_path = Path(temp_dir) / "model.ndb"
-                self.db.save(temp_model_path)
+                with self.db_lock.read():
+                    self.db.save(temp_model_path)
                 if model_path.exists():
                     backup_id = str(uuid.uuid4())
                     backup_path = self.get_ndb_path(backup_id)
@@ -500,6 +760,11 @@ class NDBModel(Model):
             raise ValueError(f"No chat instance available for provider: {provider}")
 
     def cleanup(self):
+        with self.parse_pool_lock:
+            if self.parse_pool is not None:
+                self.parse_pool.terminate()
+                self.parse_pool = None
+
         if self.config.autoscaling_enabled:
             del self.db
             self.logger.info(f"Cleaning up model at {self.host_model_dir}")
@@ -1,5 +1,8 @@
 import datetime
+import heapq
 import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
 from threading import Lock
 from typing import Callable, Dict, List, Tuple
 from urllib.parse import urljoin
@@ -7,6 +10,7 @@ from urllib.parse import urljoin
 import fastapi
 import requests
 from fastapi import status
+from requests.adapters import HTTPAdapter
 
 CREDENTIALS_EXCEPTION = fastapi.HTTPException(
     status_code=fastapi.status.HTTP_401_UNAUTHORIZED,
@@ -45,6 +49,13 @@ def now() -> datetime.datetime:
     return datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
 
 
+@dataclass
+class CacheEntry:
+    permissions: dict
+    # expiration: time at which the cached permissions must be fetched again.
+    expiration: datetime.datetime
+
+
 class Permissions:
     model_bazaar_endpoint: str = None
     model_id: str = None
@@ -52,34 +63,69 @@ class Permissions:
     # token needs to be refreshed. We refresh in case a previously invalid
     # token becomes a valid token.
     entry_expiration_min: int = 5
+    # refresh_before_sec: entries that are accessed within this many seconds of
+    # their expiration are refreshed in the background, so that tokens which
+    # are in active use never have to wait on the model bazaar.
+    refresh_before_sec: int = 60
+    # expirations is a min-heap of (expiration, token). Entries that were
+    # refreshed leave a stale heap item behind, which is skipped when popped.
     expirations: List[Tuple[datetime.datetime, str]] = []
-    cache: Dict[str, dict] = {}
+    cache: Dict[str, CacheEntry] = {}
+    # inflight: permission fetches that are currently running, so that
+    # concurrent requests with the same token share a single fetch.
+    inflight: Dict[str, Future] = {}
+    # cache_lock only guards the dicts and heap above, it is never held while
+    # waiting on the network.
     cache_lock = Lock()
+    session: requests.Session = None
+    refresh_executor: ThreadPoolExecutor = None
 
     @classmethod
     def init(
-        cls, model_bazaar_endpoint: str, model_id: str, entry_expiration_min: int = 5
+        cls,
+        model_bazaar_endpoint: str,
+        model_id: str,
+        entry_expiration_min: int = 5,
+        refresh_before_sec: int = 60,
+        max_connections: int = 32,
+        refresh_workers: int = 4,
     ):
         cls.model_bazaar_endpoint = model_bazaar_endpoint
         cls.model_id = model_id
         cls.entry_expiration_min = entry_expiration_min
+        cls.refresh_before_sec = refresh_before_sec
+
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=max_connections, pool_maxsize=max_connections
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        cls.session = session
+
+        if cls.refresh_executor is not None:
+            cls.refresh_executor.shutdown(wait=False)
+        cls.refresh_executor = ThreadPoolExecutor(
+            max_workers=refresh_workers, thread_name_prefix="permissions-refresh"
+        )
+
+        with cls.cache_lock:
+            cls.expirations = []
+            cls.cache = {}
+            cls.inflight = {}
 
     @classmethod
-    def _clear_expired_entries(cls) -> None:
+    def _clear_expired_entries(cls, curr_time: datetime.datetime) -> None:
         """
-        Clears expired entries from the cache.
+        Clears expired entries from the cache. Must be called with cache_lock held.
         """
-        pos = 0
-        curr_time = now()
-        for expiration, token in cls.expirations:
-            if expiration > curr_time:
-                break
-            try:
+        while cls.expirations and cls.expirations[0][0] <= curr_time:
+            expiration, token = heapq.heappop(cls.expirations)
+            entry = cls.cache.get(token)
+            # If the entry was refreshed after this heap item was pushed its
+            # expiration is later, and it is still valid.
+            if entry is not None and entry.expiration <= expiration:
                 del cls.cache[token]
-            except KeyError:
-                pass
-            pos += 1
-        cls.expirations = cls.expirations[pos:]
 
     @classmethod
     def _deployment_permissions(cls, token: str):
@@ -87,7 +133,7 @@ class Permissions:
             cls.model_bazaar_endpoint,
             f"api/deploy/permissions/{cls.model_id}",
         )
-        response = requests.get(
+        response = (cls.session or requests).get(
             deployment_permissions_endpoint,
             headers={"Authorization": "Bearer " + token},
         )
@@ -111,10 +157,73 @@ class Permissions:
         permissions["exp"] = datetime.datetime.fromisoformat(permissions["exp"])
         return permissions
 
+    @classmethod
+    def _start_fetch(cls, token: str) -> Tuple[Future, bool]:
+        """
+        Returns the inflight fetch for the token, registering a new one if there
+        is none. The returned flag indicates if the caller is responsible for
+        running the fetch. Must be called with cache_lock held.
+        """
+        future = cls.inflight.get(token)
+        if future is not None:
+            return future, False
+        future = Future()
+        cls.inflight[token] = future
+        return future, True
+
+    @classmethod
+    def _fetch(cls, token: str, future: Future) -> None:
+        """
+        Fetches the permissions for the token from the model bazaar, stores them
+        in the cache, and resolves the inflight future.
+        """
+        try:
+            permissions = cls._deployment_permissions(token)
+        except Exception as e:
+            with cls.cache_lock:
+                cls.inflight.pop(token, None)
+            future.set_exception(e)
+            return
+
+        expiration = now() + datetime.timedelta(minutes=cls.entry_expiration_min)
+        with cls.cache_lock:
+            cls.cache[token] = CacheEntry(
+                permissions=permissions, expiration=expiration
+            )
+            heapq.heappush(cls.expirations, (expiration, token))
+            cls.inflight.pop(token, None)
+        future.set_result(permissions)
+
+    @classmethod
+    def _refresh_in_background(cls, token: str) -> None:
+        """
+        Schedules a refresh of the token's permissions unless one is already
+        running. Must be called with cache_lock held.
+        """
+        future, owner = cls._start_fetch(token)
+        if not owner:
+            return
+        if cls.refresh_executor is None:
+            cls.inflight.pop(token, None)
+            future.cancel()
+            return
+        cls.refresh_executor.submit(cls._fetch, token, future)
+
+    @staticmethod
+    def _unpack_permissions(permissions: dict) -> Tuple[bool, bool, bool, str]:
+        return (
+            permissions["read"],
+            permissions["write"],
+            permissions["override"],
+            permissions.get("username", "unknown"),
+        )
+
     @classmethod
     def _get_permissions(cls, token: str) -> Tuple[bool, bool, bool, str]:
         """
         Retrieves permissions for a token, updating the cache if necessary.
+        Cache hits never wait on the model bazaar. Cache misses for the same
+        token share a single request to the model bazaar.
 
         Args:
             token (str): The access token.
@@ -122,32 +231,25 @@ class Permissions:
         Returns:
             Tuple[bool, bool, bool, str]: Read, write, override permissions and username.
         """
-        cls._clear_expired_entries()
         curr_time = now()
-        if token not in cls.cache:
-            permissions = cls._deployment_permissions(token)
-            cls.expirations.append(
-                (
-                    curr_time + datetime.timedelta(minutes=cls.entry_expiration_min),
-                    token,
-                )
-            )
-            cls.cache[token] = permissions
-            return (
-                permissions["read"],
-                permissions["write"],
-                permissions["override"],
-                permissions["username"],
-            )
-        if cls.cache[token]["exp"] <= curr_time:
+        with cls.cache_lock:
+            cls._clear_expired_entries(curr_time)
+            entry = cls.cache.get(token)
+            if entry is None:
+                future, owner = cls._start_fetch(token)
+            elif entry.expiration - curr_time <= datetime.timedelta(
+                seconds=cls.refresh_before_sec
+            ):
+                cls._refresh_in_background(token)
+
+        if entry is None:
+            if owner:
+                cls._fetch(token, future)
+            return cls._unpack_permissions(future.result())
+
+        if entry.permissions["exp"] <= curr_time:
             return False, False, False, "unknown"
-        permissions = cls.cache[token]
-        return (
-            permissions["read"],
-            permissions["write"],
-            permissions["override"],
-            permissions["username"],
-        )
+        return cls._unpack_permissions(entry.permissions)
 
     @classmethod
     def verify_permission(cls, permission_type: str = "read") -> Callable[[str], str]:
@@ -162,16 +264,15 @@ class Permissions:
         """
 
         def dependency(token: str = fastapi.Depends(optional_token_bearer)) -> str:
-            with cls.cache_lock:
-                permissions = cls._get_permissions(token)
-                permission_map = {
-                    "read": permissions[0],
-                    "write": permissions[1],
-                    "override": permissions[2],
-                }
-                if not permission_map.get(permission_type):
-                    raise CREDENTIALS_EXCEPTION
-                return token
+            permissions = cls._get_permissions(token)
+            permission_map = {
+                "read": permissions[0],
+                "write": permissions[1],
+                "override": permissions[2],
+            }
+            if not permission_map.get(permission_type):
+                raise CREDENTIALS_EXCEPTION
+            return token
 
         return dependency
 
@@ -187,11 +288,10 @@ class Permissions:
         Returns:
             bool: True if the token has the required permission, False otherwise.
         """
-        with cls.cache_lock:
-            permissions = cls._get_permissions(token)
-            permission_map = {
-                "read": permissions[0],
-                "write": permissions[1],
-                "override": permissions[2],
-            }
-            return permission_map.get(permission_type, False)
+        permissions = cls._get_permissions(token)
+        permission_map = {
+            "read": permissions[0],
+            "write": permissions[1],
+            "override": permissions[2],
+        }
+        return permission_map.get(permission_type, False)
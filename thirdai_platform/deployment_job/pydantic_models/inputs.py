@@ -22,6 +22,18 @@ class NDBSearchParams(BaseModel):
     context_radius: int = 1
 
 
+class NDBSearchBatchParams(BaseModel):
+    """
+    Represents parameters for a batch of NDB search queries which share the same
+    top_k, constraints, and rerank settings.
+    """
+
+    queries: List[str] = Field(..., min_length=1)
+    top_k: int = 5
+    constraints: Constraints = Field(default_factory=Constraints)
+    rerank: bool = False
+
+
 class TextAnalysisPredictParams(BaseModel):
     """
     Represents the base query parameters.
@@ -31,6 +43,15 @@ class TextAnalysisPredictParams(BaseModel):
     top_k: int = 5
 
 
+class TextAnalysisPredictBatchParams(BaseModel):
+    """
+    Represents the query parameters for a batch of texts.
+    """
+
+    texts: List[str]
+    top_k: int = 5
+
+
 class TokenAnalysisPredictParams(BaseModel):
     """
     Represents the query parameters for token analysis.
@@ -41,6 +62,16 @@ class TokenAnalysisPredictParams(BaseModel):
     data_type: Literal["unstructured", "xml"] = "unstructured"
 
 
+class TokenAnalysisPredictBatchParams(BaseModel):
+    """
+    Represents the query parameters for token analysis of a batch of texts.
+    """
+
+    texts: List[str]
+    top_k: int = 5
+    data_type: Literal["unstructured", "xml"] = "unstructured"
+
+
 class AssociateInputSingle(BaseModel):
     """
     Represents a single source-target pair for association.
@@ -79,14 +79,17 @@ class EnterpriseSearchRouter:
         if self.guardrail:
             label_map = LabelMap()
 
-            results.query_text = self.guardrail.redact_pii(
-                text=results.query_text, access_token=token, label_map=label_map
+            # The query and references are redacted in one batch, which assigns
+            # labels in the same order as redacting them one at a time.
+            redacted = self.guardrail.redact_pii_batch(
+                texts=[results.query_text] + [ref.text for ref in results.references],
+                access_token=token,
+                label_map=label_map,
             )
 
-            for ref in results.references:
-                ref.text = self.guardrail.redact_pii(
-                    text=ref.text, access_token=token, label_map=label_map
-                )
+            results.query_text = redacted[0]
+            for ref, text in zip(results.references, redacted[1:]):
+                ref.text = text
             results.pii_entities = label_map.get_entities()
             self.logger.debug("Redacted PII from search results")
 
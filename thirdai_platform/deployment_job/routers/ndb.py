@@ -1,12 +1,12 @@
-import io
+import asyncio
 import threading
+import time
 import traceback
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from queue import Queue
-from typing import AsyncGenerator, List, Optional
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
 
-import fitz
 import jwt
 import thirdai
 from deployment_job.models.ndb_models import NDBModel
@@ -19,18 +19,28 @@ from deployment_job.pydantic_models.inputs import (
     DeleteInput,
     DocumentList,
     ImplicitFeedbackInput,
+    NDBSearchBatchParams,
     NDBSearchParams,
     SaveModel,
     UpvoteInput,
 )
 from deployment_job.reporter import Reporter
+from deployment_job.search_batcher import SearchBatcher
+from deployment_job.task_queue import TaskQueue
 from deployment_job.update_logger import UpdateLogger
-from deployment_job.utils import Task, TaskAction, TaskStatus, now, validate_name
+from deployment_job.utils import (
+    Task,
+    TaskAction,
+    TaskStatus,
+    file_response,
+    validate_name,
+)
 from fastapi import (
     APIRouter,
     BackgroundTasks,
     Depends,
     Form,
+    Header,
     Response,
     UploadFile,
     status,
@@ -38,7 +48,12 @@ from fastapi import (
 from fastapi.encoders import jsonable_encoder
 from fastapi.responses import StreamingResponse
 from platform_common.dependencies import is_on_low_disk
-from platform_common.file_handler import download_local_files, get_cloud_client
+from platform_common.file_handler import (
+    FileInfo,
+    download_local_files,
+    expand_cloud_buckets_and_directories,
+    generate_signed_url_from_source,
+)
 from platform_common.logging import LogCode
 from platform_common.logging.job_loggers import JobLogger
 from platform_common.pydantic_models.deployment import DeploymentConfig
@@ -50,11 +65,12 @@ from platform_common.pydantic_models.feedback_logs import (
     InsertLog,
     UpvoteLog,
 )
-from platform_common.utils import response
+from platform_common.utils import orjson_response, response
 from prometheus_client import Counter, Summary
 from pydantic import ValidationError
 
 ndb_query_metric = Summary("ndb_query", "NDB Queries")
+ndb_batch_query_metric = Summary("ndb_batch_query", "NDB batch queries")
 ndb_upvote_metric = Summary("ndb_upvote", "NDB upvotes")
 ndb_associate_metric = Summary("ndb_associate", "NDB associations")
 ndb_implicit_feedback_metric = Summary("ndb_implicit_feedback", "NDB implicit feedback")
@@ -78,12 +94,30 @@ class NDBRouter:
 
         self.model: NDBModel = NDBRouter.get_model(config, logger)
 
+        # Searches run on a dedicated pool instead of the shared starlette
+        # threadpool, so that slow inserts or other blocking endpoints cannot use
+        # up the threads available to searches.
+        self.search_executor = ThreadPoolExecutor(
+            max_workers=config.model_options.search_threads,
+            thread_name_prefix="ndb-search",
+        )
+        if config.model_options.search_batching:
+            self.search_batcher = SearchBatcher(
+                search_batch=self._search_batch,
+                executor=self.search_executor,
+                max_batch_size=config.model_options.search_batch_max_size,
+                max_wait_ms=config.model_options.search_batch_max_wait_ms,
+            )
+        else:
+            self.search_batcher = None
+
         self.feedback_logger = UpdateLogger.get_feedback_logger(self.model.data_dir)
         self.insertion_logger = UpdateLogger.get_insertion_logger(self.model.data_dir)
         self.deletion_logger = UpdateLogger.get_deletion_logger(self.model.data_dir)
 
         self.router = APIRouter()
         self.router.add_api_route("/search", self.search, methods=["POST"])
+        self.router.add_api_route("/search-batch", self.search_batch, methods=["POST"])
         self.router.add_api_route(
             "/insert",
             self.insert,
@@ -123,12 +157,12 @@ class NDBRouter:
 
         # Only enable task queue in dev mode
         if not self.config.autoscaling_enabled:
-            self.task_queue = Queue()
-            # TODO(kartik): make tasks an on-disk data structure
-            self.tasks = {}
-            self.task_lock = threading.Lock()
-
-            threading.Thread(target=self.process_tasks, daemon=True).start()
+            self.task_queue = TaskQueue(
+                db_path=str(self.model.data_dir / "tasks.db"),
+                retention_sec=self.config.model_options.task_retention_hours * 3600,
+            )
+            for _ in range(self.config.model_options.task_workers):
+                threading.Thread(target=self.process_tasks, daemon=True).start()
 
     @staticmethod
     def get_model(config: DeploymentConfig, logger: JobLogger) -> NDBModel:
@@ -136,8 +170,7 @@ class NDBRouter:
             config=config, logger=logger, write_mode=not config.autoscaling_enabled
         )
 
-    @ndb_query_metric.time()
-    def search(
+    async def search(
         self,
         params: NDBSearchParams,
         token: str = Depends(Permissions.verify_permission("read")),
@@ -181,12 +214,85 @@ class NDBRouter:
         }
         ```
         """
-        results = self.model.predict(**params.model_dump())
+        with ndb_query_metric.time():
+            if self.search_batcher:
+                results = await self.search_batcher.search(
+                    query=params.query,
+                    top_k=params.top_k,
+                    constraints=params.constraints.model_dump(mode="json"),
+                    rerank=params.rerank,
+                )
+            else:
+                results = await asyncio.get_running_loop().run_in_executor(
+                    self.search_executor, self._search, params
+                )
 
-        return response(
+        return orjson_response(
             status_code=status.HTTP_200_OK,
             message="Successful",
-            data=jsonable_encoder(results),
+            data=results,
+        )
+
+    def _search(self, params: NDBSearchParams):
+        return self.model.predict(**params.model_dump(mode="json"))
+
+    def _search_batch(
+        self,
+        queries: List[str],
+        top_k: int,
+        constraints: Dict[str, Dict[str, Any]],
+        rerank: bool,
+    ):
+        return self.model.predict_batch(
+            queries=queries, top_k=top_k, constraints=constraints, rerank=rerank
+        )
+
+    async def search_batch(
+        self,
+        params: NDBSearchBatchParams,
+        token: str = Depends(Permissions.verify_permission("read")),
+    ):
+        """
+        Query the NDB model with a batch of queries which share the same parameters.
+
+        Parameters:
+        - queries: List[str] - The query texts.
+        - top_k: int - The number of top results to return for each query (default: 5).
+        - constraints: Constraints - Additional constraints applied to every query.
+        - rerank: bool - Whether to rerank the results (default: False).
+        - token: str - Authorization token.
+
+        Returns:
+        - JSONResponse: The results for each query, in the same order as the queries.
+
+        Example Request Body:
+        ```
+        {
+            "queries": ["What is the capital of France?", "Who wrote Hamlet?"],
+            "top_k": 5,
+            "constraints": {
+                "field1": {
+                    "constraint_type": "EqualTo",
+                    "value": "value1"
+                }
+            }
+        }
+        ```
+        """
+        with ndb_batch_query_metric.time():
+            results = await asyncio.get_running_loop().run_in_executor(
+                self.search_executor,
+                self._search_batch,
+                params.queries,
+                params.top_k,
+                params.constraints.model_dump(mode="json"),
+                params.rerank,
+            )
+
+        return orjson_response(
+            status_code=status.HTTP_200_OK,
+            message="Successful",
+            data=results,
         )
 
     @ndb_insert_metric.time()
@@ -277,15 +383,10 @@ class NDBRouter:
                 message="Insert logged successfully.",
             )
         elif not sync:
-            task_id = str(uuid.uuid4())
-            with self.task_lock:
-                self.task_queue.put(task_id)
-                self.tasks[task_id] = Task(
-                    status=TaskStatus.NOT_STARTED,
-                    action=TaskAction.INSERT,
-                    last_modified=now(),
-                    data={"documents": documents},
-                )
+            task_id = self.task_queue.add(
+                action=TaskAction.INSERT,
+                data={"documents": [doc.model_dump(mode="json") for doc in documents]},
+            )
 
             self.logger.info("Document insertion queued")
             return response(
@@ -349,15 +450,9 @@ class NDBRouter:
                 message="Delete logged successfully.",
             )
         elif not sync:
-            task_id = str(uuid.uuid4())
-            with self.task_lock:
-                self.task_queue.put(task_id)
-                self.tasks[task_id] = Task(
-                    status=TaskStatus.NOT_STARTED,
-                    action=TaskAction.DELETE,
-                    last_modified=now(),
-                    data={"source_ids": input.source_ids},
-                )
+            task_id = self.task_queue.add(
+                action=TaskAction.DELETE, data={"source_ids": input.source_ids}
+            )
             self.logger.info("Deletion queued")
             return response(
                 status_code=status.HTTP_202_ACCEPTED,
@@ -764,20 +859,22 @@ class NDBRouter:
         ```
         """
         source, pdf_bytes = self.model.highlight_pdf(reference_id)
-        buffer = io.BytesIO(pdf_bytes)
         headers = {"Content-Disposition": f'inline; filename="{Path(source).name}"'}
-        return Response(
-            buffer.getvalue(), headers=headers, media_type="application/pdf"
-        )
+        return Response(pdf_bytes or b"", headers=headers, media_type="application/pdf")
 
     def pdf_blob(
-        self, source: str, token=Depends(Permissions.verify_permission("read"))
+        self,
+        source: str,
+        range_header: Optional[str] = Header(None, alias="Range"),
+        token=Depends(Permissions.verify_permission("read")),
     ):
         """
         Get the PDF blob from the source.
 
         Parameters:
-        - source: str - The source path of the PDF.
+        - source: str - The source path of the PDF, as returned in search results.
+        - Range: Optional header to request a single byte range of the PDF, e.g.
+            "bytes=0-65535". The response is then a 206 with only those bytes.
 
         Returns:
         - Response: The PDF as a stream.
@@ -787,10 +884,22 @@ class NDBRouter:
         /pdf-blob?source=/path/to/pdf
         ```
         """
-        buffer = io.BytesIO(fitz.open(source).tobytes())
-        headers = {"Content-Disposition": f'inline; filename="{Path(source).name}"'}
-        return Response(
-            buffer.getvalue(), headers=headers, media_type="application/pdf"
+        # The file is streamed as is, so only documents stored by the model can be
+        # requested, rather than any file on the deployment's disk.
+        doc_dir = Path(self.model.doc_save_path()).resolve()
+        path = Path(source).resolve()
+        if not path.is_relative_to(doc_dir) or not path.is_file():
+            return response(
+                status_code=status.HTTP_404_NOT_FOUND,
+                message=f"PDF {source} not found.",
+            )
+
+        headers = {"Content-Disposition": f'inline; filename="{path.name}"'}
+        return file_response(
+            str(path),
+            media_type="application/pdf",
+            range_header=range_header,
+            headers=headers,
         )
 
     def get_signed_url(
@@ -799,9 +908,7 @@ class NDBRouter:
         provider: str,
         token=Depends(Permissions.verify_permission("read")),
     ):
-        cloud_client = get_cloud_client(provider=provider)
-
-        signed_url = cloud_client.generate_url_from_source(source=source)
+        signed_url = generate_signed_url_from_source(provider=provider, source=source)
 
         return response(
             status_code=status.HTTP_200_OK,
@@ -871,56 +978,120 @@ class NDBRouter:
         }
         ```
         """
-        with self.task_lock:
-            if task_id:
-                return response(
-                    status_code=status.HTTP_200_OK,
-                    message=f"Returned task info",
-                    data={"task": self.tasks.get(task_id)},
+        if task_id:
+            return response(
+                status_code=status.HTTP_200_OK,
+                message=f"Returned task info",
+                data={"task": self.task_queue.get(task_id)},
+            )
+        else:
+            return response(
+                status_code=status.HTTP_200_OK,
+                message=f"Returned all tasks.",
+                data={"tasks": self.task_queue.all()},
+            )
+
+    def process_tasks(self):
+        while True:
+            tasks = []
+            try:
+                tasks = self.task_queue.claim(
+                    max_inserts=self.config.model_options.task_batch_size
+                )
+                if tasks[0][1].action == TaskAction.DELETE:
+                    self.process_delete_task(*tasks[0])
+                else:
+                    self.process_insert_tasks(tasks)
+            except Exception:
+                # An unexpected error would otherwise end this thread, leaving
+                # the claimed tasks in progress and all later tasks queued.
+                self.logger.error(
+                    f"Error processing tasks: {traceback.format_exc()}",
+                    code=LogCode.MODEL_INSERT,
+                )
+                self.fail_unfinished_tasks(tasks)
+                time.sleep(1)
+
+    def process_delete_task(self, task_id: str, task: Task):
+        try:
+            self.model.delete(task.data["source_ids"])
+            self.task_queue.complete(task_id)
+        except Exception:
+            self.fail_task(task_id, task)
+
+    def process_insert_tasks(self, tasks: List[Tuple[str, Task]]):
+        """
+        Applies a batch of insert tasks with a single insert into the model. If
+        the batch fails, the tasks are retried one at a time so that only the
+        tasks with invalid documents fail.
+        """
+        expanded_tasks = []
+        for task_id, task in tasks:
+            try:
+                documents = expand_cloud_buckets_and_directories(
+                    [FileInfo(**doc) for doc in task.data["documents"]]
+                )
+                expanded_tasks.append((task_id, task, documents))
+            except Exception:
+                self.fail_task(task_id, task)
+
+        if len(expanded_tasks) > 1:
+            try:
+                inserted_docs = self.model.insert_files(
+                    [doc for _, _, documents in expanded_tasks for doc in documents],
+                    before_write=lambda: self.task_queue.wait_for_earlier_tasks(
+                        [task_id for task_id, _, _ in expanded_tasks]
+                    ),
+                )
+            except Exception:
+                self.logger.error(
+                    f"Batched insertion of {len(expanded_tasks)} tasks failed, retrying them individually: {traceback.format_exc()}"
                 )
             else:
-                return response(
-                    status_code=status.HTTP_200_OK,
-                    message=f"Returned all tasks.",
-                    data={"tasks": self.tasks},
+                offset = 0
+                for task_id, task, documents in expanded_tasks:
+                    task.data["sources"] = inserted_docs[
+                        offset : offset + len(documents)
+                    ]
+                    offset += len(documents)
+                    self.task_queue.complete(task_id, data=task.data)
+                self.logger.info(
+                    f"Applied {len(expanded_tasks)} insertion tasks in a single insert",
+                    code=LogCode.MODEL_INSERT,
                 )
+                return
 
-    def process_tasks(self):
-        while True:
-            task_id = self.task_queue.get()
+        for task_id, task, documents in expanded_tasks:
             try:
-                with self.task_lock:
-                    action = self.tasks[task_id].action
-                    data = self.tasks[task_id].data
-                    self.tasks[task_id].status = TaskStatus.IN_PROGRESS
-                    self.tasks[task_id].last_modified = now()
-                if action == TaskAction.INSERT:
-                    documents = data["documents"]
-                    inserted_docs = self.model.insert(documents=documents)
-                    with self.task_lock:
-                        self.tasks[task_id].status = TaskStatus.COMPLETE
-                        self.tasks[task_id].last_modified = now()
-                        self.tasks[task_id].data["sources"] = inserted_docs
-                elif action == TaskAction.DELETE:
-                    doc_ids = data["source_ids"]
-                    self.model.delete(doc_ids)
-                    with self.task_lock:
-                        self.tasks[task_id].status = TaskStatus.COMPLETE
-                        self.tasks[task_id].last_modified = now()
+                task.data["sources"] = self.model.insert_files(
+                    documents,
+                    before_write=lambda: self.task_queue.wait_for_earlier_tasks(
+                        [task_id]
+                    ),
+                )
+                self.task_queue.complete(task_id, data=task.data)
+            except Exception:
+                self.fail_task(task_id, task)
 
-            except Exception as e:
-                with self.task_lock:
-                    self.tasks[task_id].status = TaskStatus.FAILED
-                    self.tasks[task_id].message = str(traceback.format_exc())
-                    self.tasks[task_id].last_modified = now()
-                    self.logger.error(
-                        f"Task {task_id} with data {self.tasks[task_id]} failed: {str(traceback.format_exc())}"
-                    )
-
-            finally:
-                with self.task_lock:
-                    self.task_queue.task_done()
+    def fail_unfinished_tasks(self, tasks: List[Tuple[str, Task]]):
+        for task_id, task in tasks:
+            try:
+                current = self.task_queue.get(task_id)
+                if current and current.status == TaskStatus.IN_PROGRESS:
+                    self.fail_task(task_id, task)
+            except Exception:
+                self.logger.error(
+                    f"Unable to mark task {task_id} as failed: {traceback.format_exc()}"
+                )
+
+    def fail_task(self, task_id: str, task: Task):
+        message = str(traceback.format_exc())
+        self.task_queue.fail(task_id, message=message)
+        self.logger.error(f"Task {task_id} with data {task} failed: {message}")
 
     def shutdown(self):
         self.logger.info(f"Shutting down NeuralDB deployment")
+        self.search_executor.shutdown(wait=False)
+        if not self.config.autoscaling_enabled:
+            self.task_queue.close()
         self.model.cleanup()
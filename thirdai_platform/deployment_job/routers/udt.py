@@ -1,7 +1,10 @@
+import asyncio
 import os
 import time
-from typing import Union
+from collections import deque
+from typing import List, Literal, Optional, Union
 
+import orjson
 from deployment_job.models.classification_models import (
     ClassificationModel,
     TextClassificationModel,
@@ -9,14 +12,26 @@ from deployment_job.models.classification_models import (
 )
 from deployment_job.permissions import Permissions
 from deployment_job.pydantic_models.inputs import (
+    TextAnalysisPredictBatchParams,
     TextAnalysisPredictParams,
+    TokenAnalysisPredictBatchParams,
     TokenAnalysisPredictParams,
 )
 from deployment_job.reporter import Reporter
-from deployment_job.throughput import Throughput
-from fastapi import APIRouter, Depends, Query, UploadFile, status
+from deployment_job.usage_stats import UsageStats
+from deployment_job.utils import DuplexStreamingResponse, iter_line_batches
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    UploadFile,
+    status,
+)
 from fastapi.encoders import jsonable_encoder
 from platform_common.dependencies import is_on_low_disk
+from platform_common.file_handler import save_upload_file
 from platform_common.logging import JobLogger, LogCode
 from platform_common.ndb.ndbv1_parser import convert_to_ndb_file
 from platform_common.pii.data_types import (
@@ -33,23 +48,31 @@ from platform_common.thirdai_storage.data_types import (
 )
 from platform_common.utils import response
 from prometheus_client import Summary
+from starlette.concurrency import run_in_threadpool
 from thirdai import neural_db as ndb
 
 udt_predict_metric = Summary("udt_predict", "UDT predictions")
 
 udt_query_length = Summary("udt_query_length", "Distribution of query lengths")
 
+# /predict-stream predicts lines in batches of this size, with at most this many
+# batches being predicted at once, and lines longer than this many bytes get an
+# error, so the memory used by a stream is bounded however long it is.
+STREAM_BATCH_SIZE = 256
+STREAM_MAX_IN_FLIGHT_BATCHES = 4
+STREAM_MAX_LINE_BYTES = 1024 * 1024
+
 
 class UDTBaseRouter:
     def __init__(self, config: DeploymentConfig, reporter: Reporter, logger: JobLogger):
         self.model: ClassificationModel = self.get_model(config, logger)
         self.logger = logger
 
-        # TODO(Nicholas): move these metrics to prometheus
-        self.start_time = time.time()
-        self.tokens_identified = Throughput()
-        self.queries_ingested = Throughput()
-        self.queries_ingested_bytes = Throughput()
+        self.usage = UsageStats(
+            model_id=config.model_id,
+            model_bazaar_endpoint=config.model_bazaar_endpoint,
+            logger=logger,
+        )
 
         self.router = APIRouter()
         self.router.add_api_route("/stats", self.stats, methods=["GET"])
@@ -79,8 +102,7 @@ class UDTBaseRouter:
             destination_path = self.model.data_dir / file.filename
 
             # Save the uploaded file to the temporary location
-            with open(destination_path, "wb") as f:
-                f.write(file.file.read())
+            save_upload_file(file, destination_path)
 
             # Convert the file to an ndb Document object
             # This likely involves parsing and processing the file content
@@ -113,6 +135,58 @@ class UDTBaseRouter:
             )
             raise e
 
+    def predict_texts(
+        self,
+        params: Union[TextAnalysisPredictBatchParams, TokenAnalysisPredictBatchParams],
+        data_type: str,
+    ):
+        start_time = time.perf_counter()
+
+        for text in params.texts:
+            udt_query_length.observe(len(text.split()))
+
+        results = self.model.predict_batch(**params.model_dump())
+        for text, result in zip(params.texts, results):
+            self.log_prediction(text, result)
+
+        time_taken = time.perf_counter() - start_time
+        self.usage.record_latency(data_type, time_taken)
+
+        self.logger.debug(
+            f"Batch prediction of {len(params.texts)} texts complete with time taken: {time_taken} seconds"
+        )
+
+        return response(
+            status_code=status.HTTP_200_OK,
+            message="Successful",
+            data={
+                "prediction_results": jsonable_encoder(results),
+                "time_taken": time_taken,
+            },
+        )
+
+    def log_prediction(self, text: str, results):
+        # TODO(pratik/geordie/yash): Add logging for search results text classification
+        if isinstance(results, UnstructuredTokenClassificationResults):
+            identified_count = len(
+                [tags[0] for tags in results.predicted_tags if tags[0] != "O"]
+            )
+            self.usage.record(results.data_type, text, identified_count)
+            self.logger.debug(
+                f"Prediction complete with {identified_count} tokens identified",
+                text_length=len(text),
+            )
+
+        elif isinstance(results, XMLTokenClassificationResults):
+            self.usage.record(results.data_type, text, len(results.predictions))
+            self.logger.debug(
+                f"Prediction complete with {len(results.predictions)} predictions",
+                text_length=len(text),
+            )
+
+        else:
+            self.usage.record("text", text)
+
     def stats(self, token=Depends(Permissions.verify_permission("read"))):
         """
         Returns statistics about the deployment such as the number of tokens identified, number of
@@ -136,24 +210,14 @@ class UDTBaseRouter:
             },
             "uptime": 35991
         }
-        uptime is given in seconds.
+        uptime is given in seconds. The stats are aggregated over all of the
+        allocations of the deployment if the platform's metrics store is
+        available, and are for the allocation which handles the request if not.
         """
         return response(
             status_code=status.HTTP_200_OK,
             message="Successful",
-            data={
-                "past_hour": {
-                    "tokens_identified": self.tokens_identified.past_hour(),
-                    "queries_ingested": self.queries_ingested.past_hour(),
-                    "queries_ingested_bytes": self.queries_ingested_bytes.past_hour(),
-                },
-                "total": {
-                    "tokens_identified": self.tokens_identified.past_hour(),
-                    "queries_ingested": self.queries_ingested.past_hour(),
-                    "queries_ingested_bytes": self.queries_ingested_bytes.past_hour(),
-                },
-                "uptime": int(time.time() - self.start_time),
-            },
+            data=self.usage.stats(),
         )
 
 
@@ -171,6 +235,9 @@ class UDTRouterTextClassification(UDTBaseRouter):
             "/get_recent_samples", self.get_recent_samples, methods=["GET"]
         )
         self.router.add_api_route("/predict", self.predict, methods=["POST"])
+        self.router.add_api_route(
+            "/predict-batch", self.predict_batch, methods=["POST"]
+        )
 
     @udt_predict_metric.time()
     def predict(
@@ -203,11 +270,11 @@ class UDTRouterTextClassification(UDTBaseRouter):
         udt_query_length.observe(text_length)
 
         results = self.model.predict(**params.model_dump())
-        self.queries_ingested.log(1)
-        self.queries_ingested_bytes.log(len(params.text))
+        self.log_prediction(params.text, results)
 
         end_time = time.perf_counter()
         time_taken = end_time - start_time
+        self.usage.record_latency("text", time_taken)
 
         # Add time_taken to the response data
         response_data = {
@@ -223,6 +290,34 @@ class UDTRouterTextClassification(UDTBaseRouter):
             data=response_data,
         )
 
+    @udt_predict_metric.time()
+    def predict_batch(
+        self,
+        params: TextAnalysisPredictBatchParams,
+        token=Depends(Permissions.verify_permission("read")),
+    ):
+        """
+        Predicts the classes of a batch of texts with a single call to the model.
+
+        Parameters:
+        - texts: List[str] - The texts to perform inference on.
+        - top_k: int - The number of results to return for each text.
+        - token: str - Authorization token (inferred from permissions dependency).
+
+        Returns:
+        - JSONResponse: Prediction results for each text, in the same order as
+          the texts.
+
+        Example Request Body:
+        ```
+        {
+            "texts": ["What is artificial intelligence?", "What is a neural network?"],
+            "top_k": 5
+        }
+        ```
+        """
+        return self.predict_texts(params, data_type="text")
+
     @staticmethod
     def get_model(config: DeploymentConfig, logger: JobLogger) -> ClassificationModel:
         subtype = config.model_options.udt_sub_type
@@ -279,6 +374,12 @@ class UDTRouterTokenClassification(UDTBaseRouter):
             "/get_recent_samples", self.get_recent_samples, methods=["GET"]
         )
         self.router.add_api_route("/predict", self.predict, methods=["POST"])
+        self.router.add_api_route(
+            "/predict-batch", self.predict_batch, methods=["POST"]
+        )
+        self.router.add_api_route(
+            "/predict-stream", self.predict_stream, methods=["POST"]
+        )
 
     @staticmethod
     def get_model(config: DeploymentConfig, logger: JobLogger) -> ClassificationModel:
@@ -427,29 +528,11 @@ class UDTRouterTokenClassification(UDTBaseRouter):
         udt_query_length.observe(text_length)
 
         results = self.model.predict(**params.model_dump())
-        self.queries_ingested.log(1)
-        self.queries_ingested_bytes.log(len(params.text))
-
-        # TODO(pratik/geordie/yash): Add logging for search results text classification
-        if isinstance(results, UnstructuredTokenClassificationResults):
-            identified_count = len(
-                [tags[0] for tags in results.predicted_tags if tags[0] != "O"]
-            )
-            self.tokens_identified.log(identified_count)
-            self.logger.debug(
-                f"Prediction complete with {identified_count} tokens identified",
-                text_length=len(params.text),
-            )
-
-        elif isinstance(results, XMLTokenClassificationResults):
-            self.tokens_identified.log(len(results.predictions))
-            self.logger.debug(
-                f"Prediction complete with {len(results.predictions)} predictions",
-                text_length=len(params.text),
-            )
+        self.log_prediction(params.text, results)
 
         end_time = time.perf_counter()
         time_taken = end_time - start_time
+        self.usage.record_latency(params.data_type, time_taken)
 
         # Add time_taken to the response data
         response_data = {
@@ -464,3 +547,150 @@ class UDTRouterTokenClassification(UDTBaseRouter):
             message="Successful",
             data=response_data,
         )
+
+    @udt_predict_metric.time()
+    def predict_batch(
+        self,
+        params: TokenAnalysisPredictBatchParams,
+        token=Depends(Permissions.verify_permission("read")),
+    ):
+        """
+        Predicts the tags for a batch of texts with a single call to the model.
+
+        Parameters:
+        - texts: List[str] - The texts to perform inference on
+        - top_k: int - The number of results to return
+        - data_type: str - The data type of the texts. (unstructured or xml)
+        - token: str - Authorization token (inferred from permissions dependency).
+
+        Returns:
+        - JSONResponse: Prediction results for each text, in the same order as
+          the texts.
+
+        Example Request Body:
+        ```
+        {
+            "texts": ["My name is John", "I live on Main Street"],
+            "top_k": 5,
+            "data_type": "unstructured"
+        }
+        ```
+        """
+        return self.predict_texts(params, data_type=params.data_type)
+
+    def predict_lines(self, lines: List[Optional[str]], data_type: str) -> bytes:
+        """
+        Predicts the tags for a batch of lines from /predict-stream, and returns
+        an NDJSON line with the results for each. If the batch cannot be
+        predicted, the lines are predicted one at a time, so that only the lines
+        which cannot be predicted get an error. Lines which were too long to be
+        read are None, and get an error.
+        """
+        start_time = time.perf_counter()
+
+        texts = [line for line in lines if line is not None]
+        for text in texts:
+            udt_query_length.observe(len(text.split()))
+
+        try:
+            predictions = self.model.predict_batch(texts=texts, data_type=data_type)
+        except Exception:
+            predictions = []
+            for text in texts:
+                try:
+                    predictions.append(
+                        self.model.predict(text=text, data_type=data_type)
+                    )
+                except Exception as e:
+                    predictions.append(e)
+
+        predictions = iter(predictions)
+        results = [
+            (
+                ValueError(
+                    f"Line is longer than the maximum of {STREAM_MAX_LINE_BYTES} bytes."
+                )
+                if line is None
+                else next(predictions)
+            )
+            for line in lines
+        ]
+
+        outputs = []
+        for line, result in zip(lines, results):
+            if isinstance(result, Exception):
+                error = (
+                    result.detail if isinstance(result, HTTPException) else str(result)
+                )
+                outputs.append(orjson.dumps({"error": error}))
+            else:
+                self.log_prediction(line, result)
+                outputs.append(
+                    orjson.dumps(
+                        {"prediction_results": result}, default=jsonable_encoder
+                    )
+                )
+        self.usage.record_latency(data_type, time.perf_counter() - start_time)
+        return b"\n".join(outputs) + b"\n"
+
+    async def predict_stream(
+        self,
+        request: Request,
+        data_type: Literal["unstructured", "xml"] = "unstructured",
+        token=Depends(Permissions.verify_permission("read")),
+    ):
+        """
+        Predicts the tags for each line of the request body, and streams the
+        results back as NDJSON while the body is still being uploaded. The
+        response has one line for each line of the body, in the same order,
+        which is either {"prediction_results": ...} with the same results as
+        /predict, or {"error": ...} if the line could not be predicted or is
+        longer than STREAM_MAX_LINE_BYTES.
+
+        Parameters:
+        - data_type: str - The data type of each line. (unstructured or xml)
+        - token: str - Authorization token (inferred from permissions dependency).
+
+        Returns:
+        - DuplexStreamingResponse: NDJSON prediction results.
+
+        Example Request:
+        ```
+        curl -X POST --data-binary @logs.txt \\
+            "<deployment url>/predict-stream?data_type=unstructured"
+        ```
+        """
+
+        async def generate():
+            start_time = time.perf_counter()
+            n_lines = 0
+
+            in_flight = deque()
+            try:
+                async for lines in iter_line_batches(
+                    request.stream(), STREAM_BATCH_SIZE, STREAM_MAX_LINE_BYTES
+                ):
+                    # Waiting for the oldest batch before reading more of the
+                    # body applies backpressure to the client.
+                    if len(in_flight) == STREAM_MAX_IN_FLIGHT_BATCHES:
+                        yield await in_flight.popleft()
+                    in_flight.append(
+                        asyncio.ensure_future(
+                            run_in_threadpool(self.predict_lines, lines, data_type)
+                        )
+                    )
+                    n_lines += len(lines)
+
+                while in_flight:
+                    yield await in_flight.popleft()
+            finally:
+                # The batches are not waited for if the body stream fails or the
+                # client disconnects.
+                for future in in_flight:
+                    future.cancel()
+
+            self.logger.debug(
+                f"Stream prediction of {n_lines} lines complete with time taken: {time.perf_counter() - start_time} seconds"
+            )
+
+        return DuplexStreamingResponse(generate(), media_type="application/x-ndjson")
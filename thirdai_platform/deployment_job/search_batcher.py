@@ -0,0 +1,110 @@
+import asyncio
+import json
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from prometheus_client import Histogram
+
+search_batch_size_metric = Histogram(
+    "ndb_search_batch_size",
+    "Number of queries in each micro-batch of searches.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+
+BatchKey = Tuple[int, bool, str]
+
+
+@dataclass
+class PendingBatch:
+    top_k: int
+    constraints: Dict[str, Dict[str, Any]]
+    rerank: bool
+    queries: List[str] = field(default_factory=list)
+    futures: List[asyncio.Future] = field(default_factory=list)
+    timer: Optional[asyncio.TimerHandle] = None
+
+
+class SearchBatcher:
+    """
+    Collects concurrent searches into micro-batches so that they are answered by a
+    single batched search instead of one search per request. Searches are grouped
+    by top_k, constraints, and rerank, since a batched search applies the same
+    settings to every query. A batch is run once it has max_batch_size queries, or
+    max_wait_ms after its first query arrived, whichever is first.
+
+    search_batch is called on the executor with (queries, top_k, constraints,
+    rerank) and must return one result per query.
+    """
+
+    def __init__(
+        self,
+        search_batch: Callable[..., List[Any]],
+        executor: Executor,
+        max_batch_size: int,
+        max_wait_ms: float,
+    ):
+        self.search_batch = search_batch
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.pending: Dict[BatchKey, PendingBatch] = {}
+        # The event loop only keeps weak references to tasks, so the tasks
+        # running batches are kept here until they finish.
+        self.running: Set[asyncio.Task] = set()
+
+    async def search(
+        self,
+        query: str,
+        top_k: int,
+        constraints: Dict[str, Dict[str, Any]],
+        rerank: bool,
+    ) -> Any:
+        loop = asyncio.get_running_loop()
+
+        key = (top_k, rerank, json.dumps(constraints, sort_keys=True, default=str))
+        batch = self.pending.get(key)
+        if batch is None:
+            batch = PendingBatch(top_k=top_k, constraints=constraints, rerank=rerank)
+            batch.timer = loop.call_later(self.max_wait, self._flush, key)
+            self.pending[key] = batch
+
+        future = loop.create_future()
+        batch.queries.append(query)
+        batch.futures.append(future)
+
+        if len(batch.queries) >= self.max_batch_size:
+            self._flush(key)
+
+        return await future
+
+    def _flush(self, key: BatchKey) -> None:
+        batch = self.pending.pop(key, None)
+        if batch is None:
+            return
+        batch.timer.cancel()
+        task = asyncio.ensure_future(self._run(batch))
+        self.running.add(task)
+        task.add_done_callback(self.running.discard)
+
+    async def _run(self, batch: PendingBatch) -> None:
+        search_batch_size_metric.observe(len(batch.queries))
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self.executor,
+                self.search_batch,
+                batch.queries,
+                batch.top_k,
+                batch.constraints,
+                batch.rerank,
+            )
+        except Exception as e:
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for future, result in zip(batch.futures, results):
+            # The future is cancelled if the client disconnected while waiting.
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,93 @@
+import json
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from prometheus_client import Counter
+
+search_cache_hits_metric = Counter(
+    "ndb_search_cache_hits", "Number of NDB searches answered by the result cache."
+)
+search_cache_misses_metric = Counter(
+    "ndb_search_cache_misses", "Number of NDB searches not found in the result cache."
+)
+
+
+def serialize_constraints(constraints: Dict[str, Dict[str, Any]]) -> Optional[str]:
+    """
+    Serializes constraints with sorted keys, so that the same constraints given in
+    a different order have the same serialization. Returns None if the constraints
+    are not json serializable.
+    """
+    try:
+        return json.dumps(constraints, sort_keys=True)
+    except TypeError:
+        return None
+
+
+def search_cache_key(
+    query: str, top_k: int, serialized_constraints: Optional[str], rerank: bool
+) -> Optional[Tuple[str, int, str, bool]]:
+    """
+    Returns the key for a search in the result cache, with whitespace in the query
+    normalized. Returns None if the constraints could not be serialized, in which
+    case the search is not cached.
+    """
+    if serialized_constraints is None:
+        return None
+    return (" ".join(query.split()), top_k, serialized_constraints, rerank)
+
+
+class SearchResultCache:
+    """
+    Bounded cache of search results, evicted in LRU order and expired after
+    ttl_sec. Results are only valid for the version of the index they were
+    computed with, so writes to the index bump the generation, which clears the
+    cache and drops any results from searches that started before the write.
+    """
+
+    def __init__(self, max_entries: int, ttl_sec: float):
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self.entries: OrderedDict[Hashable, Tuple[float, Any]] = OrderedDict()
+        self.current_generation = 0
+        self.lock = Lock()
+
+    def generation(self) -> int:
+        with self.lock:
+            return self.current_generation
+
+    def get(self, key: Optional[Hashable]) -> Optional[Any]:
+        if self.max_entries <= 0:
+            return None
+        if key is None:
+            search_cache_misses_metric.inc()
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expiration, result = entry
+                if expiration > time.monotonic():
+                    self.entries.move_to_end(key)
+                    search_cache_hits_metric.inc()
+                    return result
+                del self.entries[key]
+        search_cache_misses_metric.inc()
+        return None
+
+    def put(self, key: Optional[Hashable], result: Any, generation: int) -> None:
+        if self.max_entries <= 0 or key is None:
+            return
+        with self.lock:
+            if self.current_generation != generation:
+                return
+            self.entries[key] = (time.monotonic() + self.ttl_sec, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.current_generation += 1
@@ -0,0 +1,231 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from deployment_job.utils import Task, TaskAction, TaskStatus, now
+
+
+class TaskQueue:
+    """
+    Durable queue of the async insert and delete tasks of a deployment, stored in
+    a SQLite database in WAL mode so that queued tasks survive a restart. Tasks
+    that were in progress when the process stopped are queued again on startup.
+
+    Workers claim tasks in the order they were added. Consecutive insert tasks
+    are claimed together so that they can be applied with a single insert into
+    the index. Several batches of inserts can be processed at once, but a delete
+    only starts once all earlier tasks have finished, and no insert starts while
+    a delete is in progress, so that deletes are applied in order with inserts.
+    Workers use wait_for_earlier_tasks so that batches of inserts which are
+    processed at once are still applied to the index in order.
+
+    Finished tasks are kept for retention_sec, and at most max_finished_tasks of
+    them are kept, so the database does not grow without bound.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        retention_sec: float = 7 * 24 * 60 * 60,
+        max_finished_tasks: int = 10000,
+    ):
+        self.retention_sec = retention_sec
+        self.max_finished_tasks = max_finished_tasks
+
+        # The connection is shared by the request threads and the workers, and
+        # is only used while holding the lock of the condition.
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                task_id TEXT UNIQUE NOT NULL,
+                action TEXT NOT NULL,
+                status TEXT NOT NULL,
+                data TEXT NOT NULL,
+                message TEXT NOT NULL DEFAULT '',
+                last_modified TEXT NOT NULL,
+                finished_at REAL
+            )
+            """)
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS tasks_by_status ON tasks (status, seq)"
+        )
+        self.conn.execute(
+            "UPDATE tasks SET status = ?, last_modified = ? WHERE status = ?",
+            (TaskStatus.NOT_STARTED, now(), TaskStatus.IN_PROGRESS),
+        )
+        self.conn.commit()
+
+        self.condition = threading.Condition()
+
+    @staticmethod
+    def _to_task(row: Tuple) -> Task:
+        action, status, data, message, last_modified = row
+        return Task(
+            status=TaskStatus(status),
+            action=TaskAction(action),
+            last_modified=last_modified,
+            data=json.loads(data),
+            message=message,
+        )
+
+    def add(self, action: TaskAction, data: Dict[str, Any]) -> str:
+        task_id = str(uuid.uuid4())
+        with self.condition:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT INTO tasks (task_id, action, status, data, last_modified) VALUES (?, ?, ?, ?, ?)",
+                    (
+                        task_id,
+                        action,
+                        TaskStatus.NOT_STARTED,
+                        json.dumps(data),
+                        now(),
+                    ),
+                )
+            self.condition.notify_all()
+        return task_id
+
+    def get(self, task_id: str) -> Optional[Task]:
+        with self.condition:
+            row = self.conn.execute(
+                "SELECT action, status, data, message, last_modified FROM tasks WHERE task_id = ?",
+                (task_id,),
+            ).fetchone()
+        return self._to_task(row) if row else None
+
+    def all(self) -> Dict[str, Task]:
+        with self.condition:
+            rows = self.conn.execute(
+                "SELECT task_id, action, status, data, message, last_modified FROM tasks ORDER BY seq"
+            ).fetchall()
+        return {row[0]: self._to_task(row[1:]) for row in rows}
+
+    def _next_claimable(self, max_inserts: int) -> List[Tuple[str, str, str]]:
+        rows = self.conn.execute(
+            "SELECT task_id, action, data FROM tasks WHERE status = ? ORDER BY seq LIMIT ?",
+            (TaskStatus.NOT_STARTED, max(max_inserts, 1)),
+        ).fetchall()
+        if not rows:
+            return []
+
+        in_progress = {
+            action
+            for (action,) in self.conn.execute(
+                "SELECT DISTINCT action FROM tasks WHERE status = ?",
+                (TaskStatus.IN_PROGRESS,),
+            )
+        }
+
+        if rows[0][1] == TaskAction.DELETE:
+            return [] if in_progress else rows[:1]
+
+        if TaskAction.DELETE in in_progress:
+            return []
+
+        batch = []
+        for row in rows:
+            if row[1] != TaskAction.INSERT:
+                break
+            batch.append(row)
+        return batch
+
+    def claim(self, max_inserts: int) -> List[Tuple[str, Task]]:
+        """
+        Blocks until tasks can be started, and returns either a single delete
+        task, or up to max_inserts consecutive insert tasks.
+        """
+        with self.condition:
+            while not (rows := self._next_claimable(max_inserts)):
+                self.condition.wait()
+
+            last_modified = now()
+            with self.conn:
+                self.conn.executemany(
+                    "UPDATE tasks SET status = ?, last_modified = ? WHERE task_id = ?",
+                    [
+                        (TaskStatus.IN_PROGRESS, last_modified, task_id)
+                        for task_id, _, _ in rows
+                    ],
+                )
+
+        return [
+            (
+                task_id,
+                Task(
+                    status=TaskStatus.IN_PROGRESS,
+                    action=TaskAction(action),
+                    last_modified=last_modified,
+                    data=json.loads(data),
+                ),
+            )
+            for task_id, action, data in rows
+        ]
+
+    def wait_for_earlier_tasks(self, task_ids: List[str]) -> None:
+        """
+        Blocks until every task that was added before the given tasks has
+        finished.
+        """
+        placeholders = ", ".join("?" * len(task_ids))
+        with self.condition:
+            while self.conn.execute(
+                f"""
+                SELECT 1 FROM tasks WHERE status = ? AND seq < (
+                    SELECT MIN(seq) FROM tasks WHERE task_id IN ({placeholders})
+                ) LIMIT 1
+                """,
+                (TaskStatus.IN_PROGRESS, *task_ids),
+            ).fetchone():
+                self.condition.wait()
+
+    def _finish(
+        self,
+        task_id: str,
+        status: TaskStatus,
+        data: Optional[Dict[str, Any]] = None,
+        message: str = "",
+    ) -> None:
+        with self.condition:
+            with self.conn:
+                if data is not None:
+                    self.conn.execute(
+                        "UPDATE tasks SET data = ? WHERE task_id = ?",
+                        (json.dumps(data), task_id),
+                    )
+                self.conn.execute(
+                    "UPDATE tasks SET status = ?, message = ?, last_modified = ?, finished_at = ? WHERE task_id = ?",
+                    (status, message, now(), time.time(), task_id),
+                )
+                self._apply_retention()
+            self.condition.notify_all()
+
+    def complete(self, task_id: str, data: Optional[Dict[str, Any]] = None) -> None:
+        self._finish(task_id, TaskStatus.COMPLETE, data=data)
+
+    def fail(self, task_id: str, message: str) -> None:
+        self._finish(task_id, TaskStatus.FAILED, message=message)
+
+    def _apply_retention(self) -> None:
+        self.conn.execute(
+            "DELETE FROM tasks WHERE finished_at IS NOT NULL AND finished_at < ?",
+            (time.time() - self.retention_sec,),
+        )
+        self.conn.execute(
+            """
+            DELETE FROM tasks WHERE seq IN (
+                SELECT seq FROM tasks WHERE finished_at IS NOT NULL
+                ORDER BY finished_at DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_finished_tasks,),
+        )
+
+    def close(self) -> None:
+        with self.condition:
+            self.conn.close()
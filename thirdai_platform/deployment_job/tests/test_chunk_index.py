@@ -0,0 +1,60 @@
+import json
+import os
+
+import pytest
+from deployment_job.chunk_index import (
+    ChunkBoxIndex,
+    chunk_index_path,
+    remove_chunk_indexes,
+)
+from thirdai.neural_db_v2.core.types import Chunk
+
+
+def make_chunk(chunk_id: int, text: str, boxes) -> Chunk:
+    return Chunk(
+        text=text,
+        keywords="",
+        metadata={"chunk_boxes": str(boxes)},
+        document="doc.pdf",
+        doc_id="doc",
+        doc_version=1,
+        chunk_id=chunk_id,
+    )
+
+
+@pytest.mark.unit
+def test_chunk_index_round_trip(tmp_path):
+    boxes = [
+        [(0, (10.5, 20.25, 100.0, 40.75))],
+        [],
+        [(0, (10.0, 50.0, 100.0, 60.0)), (1, (12.0, 5.0, 95.5, 30.0))],
+    ]
+    chunks = [
+        make_chunk(7, "first chunk", boxes[0]),
+        make_chunk(8, "", boxes[1]),
+        make_chunk(9, "ünïcödé chunk 😀", boxes[2]),
+    ]
+
+    index = ChunkBoxIndex.from_chunk_boxes(chunks)
+    path = chunk_index_path(str(tmp_path / "index"), "doc", 1)
+    index.save(path)
+
+    loaded = ChunkBoxIndex.load(path).to_dict(filename="doc.pdf")
+    expected = {
+        "filename": "doc.pdf",
+        "id": [7, 8, 9],
+        "text": ["first chunk", "", "ünïcödé chunk 😀"],
+        "boxes": boxes,
+    }
+    # The response is json encoded, so tuples and lists are equivalent.
+    assert json.loads(json.dumps(loaded)) == json.loads(json.dumps(expected))
+
+
+@pytest.mark.unit
+def test_remove_chunk_indexes(tmp_path):
+    index = ChunkBoxIndex.from_chunk_boxes([make_chunk(0, "text", [(0, (0, 0, 1, 1))])])
+    for doc_id, version in [("a", 1), ("a", 2), ("a.b", 1), ("c/d", 1)]:
+        index.save(chunk_index_path(str(tmp_path), doc_id, version))
+
+    remove_chunk_indexes(str(tmp_path), ["a", "c/d"])
+    assert os.listdir(tmp_path) == [os.path.basename(chunk_index_path("", "a.b", 1))]
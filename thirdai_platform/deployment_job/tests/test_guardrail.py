@@ -3,6 +3,7 @@ from pathlib import Path
 
 import pytest
 from deployment_job.guardrail import Guardrail, LabelMap
+from fastapi import status
 from platform_common.logging import JobLogger
 
 
@@ -78,3 +79,90 @@ def test_guardrail(test_logger):
         guardrail.unredact_pii("[NAME#4]", label_map.get_entities())
         == "[UNKNOWN ENTITY]"
     )
+
+
+class FakeResponse:
+    def __init__(self, status_code, prediction_results=None):
+        self.status_code = status_code
+        self.prediction_results = prediction_results
+
+    def json(self):
+        return {"data": {"prediction_results": self.prediction_results}}
+
+
+class FakeSession:
+    def __init__(self, batch_status_code):
+        self.batch_status_code = batch_status_code
+        self.requests = []
+
+    @staticmethod
+    def prediction(text):
+        return {**fake_ner_output(text, ""), "data_type": "unstructured"}
+
+    def post(self, endpoint, headers, json):
+        self.requests.append(endpoint)
+        if endpoint.endswith("/predict-batch"):
+            return FakeResponse(
+                self.batch_status_code,
+                [self.prediction(text) for text in json["texts"]],
+            )
+        return FakeResponse(status.HTTP_200_OK, self.prediction(json["text"]))
+
+
+@pytest.mark.parametrize(
+    "batch_status_code", [status.HTTP_200_OK, status.HTTP_404_NOT_FOUND]
+)
+def test_guardrail_redact_batch(test_logger, batch_status_code):
+    guardrail = Guardrail("guardrail-id", "http://model-bazaar/", test_logger)
+    session = FakeSession(batch_status_code)
+    guardrail.session = session
+
+    label_map = LabelMap()
+    redacted = guardrail.redact_pii_batch(["a", "b", "c"], "", label_map)
+
+    expected_redacted_pii = "my neighbor is [NAME#0] on [ADDRESS#1] he has a cat named [NAME#2] we call him [NAME#2]"
+    assert redacted == [expected_redacted_pii] * 3
+    assert len(label_map.get_entities()) == 3
+
+    if batch_status_code == status.HTTP_200_OK:
+        assert session.requests == ["http://model-bazaar/guardrail-id/predict-batch"]
+    else:
+        # Falls back to a request per text, and does not retry the batch endpoint.
+        assert (
+            session.requests
+            == ["http://model-bazaar/guardrail-id/predict-batch"]
+            + ["http://model-bazaar/guardrail-id/predict"] * 3
+        )
+        assert not guardrail.batch_supported
+
+    assert guardrail.redact_pii_batch([], "", label_map) == []
+
+
+def test_label_map_matches_overlapping_entities():
+    label_map = LabelMap()
+
+    assert label_map.get_label("NAME", "Bob") == "[NAME#0]"
+    assert label_map.get_label("NAME", "Bob") == "[NAME#0]"
+    # Short entities are only matched if they are equal.
+    assert label_map.get_label("NAME", "Bobby") == "[NAME#1]"
+    assert label_map.get_label("NAME", "Robert Smith") == "[NAME#2]"
+    # Entities share the label of the first entity they overlap by at least 6
+    # characters with.
+    assert label_map.get_label("NAME", "Dr. Robert Smith") == "[NAME#2]"
+    assert label_map.get_label("NAME", "Alice Jones") == "[NAME#3]"
+    assert label_map.get_label("NAME", "Alice Jonesy") == "[NAME#3]"
+    assert label_map.get_label("NAME", "Mr. Rober") == "[NAME#4]"
+    # Entities which overlap several earlier entities share the label of the
+    # entity which was added first.
+    assert label_map.get_label("NAME", "e Jones Smith") == "[NAME#2]"
+    # Entities of different tags are never matched.
+    assert label_map.get_label("ADDRESS", "Robert Smith") == "[ADDRESS#5]"
+
+    assert [entity.token for entity in label_map.get_entities()] == [
+        "Bob",
+        "Bobby",
+        "Robert Smith",
+        "Alice Jones",
+        "Mr. Rober",
+        "Robert Smith",
+    ]
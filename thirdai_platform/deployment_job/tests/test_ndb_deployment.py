@@ -615,3 +615,258 @@ def test_deployment_constrained_search(tmp_dir, on_disk):
             "bool_col": {"constraint_type": "EqualTo", "value": True},
         },
     )
+
+
+@pytest.mark.unit
+@patch.object(Permissions, "verify_permission", mock_verify_permission)
+@patch.object(Permissions, "check_permission", mock_check_permission)
+def test_deployment_search_batching(tmp_dir):
+    from concurrent.futures import ThreadPoolExecutor
+
+    from deployment_job.routers.ndb import NDBRouter
+    from prometheus_client import REGISTRY
+
+    config = create_config(
+        tmp_dir=tmp_dir,
+        autoscaling=True,
+        on_disk=True,
+        doc_path=os.path.join(doc_dir(), "articles.csv"),
+        text_columns=["text"],
+    )
+    config.model_options.search_batching = True
+    config.model_options.search_batch_max_size = 4
+    config.model_options.search_batch_max_wait_ms = 100
+
+    router = NDBRouter(config, None, logger)
+
+    queries = [
+        "manufacturing faster chips",
+        "stock market",
+        "football match",
+        "election results",
+    ]
+
+    with TestClient(router.router) as client:
+        res = client.post("/search-batch", json={"queries": queries, "top_k": 3})
+        assert res.status_code == 200
+        expected = res.json()["data"]
+        assert [result["query_text"] for result in expected] == queries
+
+        batches_before = REGISTRY.get_sample_value("ndb_search_batch_size_count") or 0
+        with ThreadPoolExecutor(max_workers=len(queries)) as pool:
+            results = list(
+                pool.map(lambda query: get_query_result(client, query, 3), queries)
+            )
+        assert results == expected
+
+        # The concurrent searches should have been answered by fewer batched
+        # searches than there were queries.
+        batches = REGISTRY.get_sample_value("ndb_search_batch_size_count")
+        assert batches - batches_before < len(queries)
+        # The tasks running the batches are released once they finish.
+        assert not router.search_batcher.running
+
+    router.search_executor.shutdown()
+
+
+@pytest.mark.unit
+@patch.object(Permissions, "verify_permission", mock_verify_permission)
+@patch.object(Permissions, "check_permission", mock_check_permission)
+def test_insert_skips_unchanged_documents(tmp_dir):
+    from deployment_job.routers.ndb import NDBRouter
+    from platform_common.ndb.document_store import DocumentStore, document_hash
+    from platform_common.pydantic_models.training import FileInfo
+
+    config = create_config(
+        tmp_dir=tmp_dir,
+        autoscaling=False,
+        on_disk=True,
+        doc_path=os.path.join(doc_dir(), "articles.csv"),
+        text_columns=["text"],
+    )
+
+    model = NDBRouter(config, None, logger).model
+
+    def csv_file(**kwargs):
+        return FileInfo(
+            path=os.path.join(doc_dir(), "supervised.csv"), location="local", **kwargs
+        )
+
+    def n_chunks():
+        return model.db.retriever.retriever.size()
+
+    # Documents repeated in an insert are only indexed once.
+    first, repeated = model.insert_files([csv_file(), csv_file()])
+    assert first == repeated
+    chunks_after_insert = n_chunks()
+    n_documents = len(model.db.documents())
+
+    # Reinserting the unchanged document does not parse or index it again.
+    with patch(
+        "platform_common.ndb.ndbv2_parser.parse_doc", side_effect=AssertionError
+    ):
+        assert model.insert_files([csv_file()]) == [first]
+    assert n_chunks() == chunks_after_insert
+    assert len(model.db.documents()) == n_documents
+
+    # Changing the metadata inserts a new document.
+    [with_metadata] = model.insert_files([csv_file(metadata={"year": 2024})])
+    assert with_metadata["source_id"] != first["source_id"]
+    assert len(model.db.documents()) == n_documents + 1
+
+    # Unchanged upserts are no-ops, and do not create new versions.
+    upsert = csv_file(source_id="doc", options={"upsert": True})
+    [inserted] = model.insert_files([upsert])
+    assert model.insert_files([upsert]) == [inserted]
+    assert model.db.chunk_store.max_version_for_doc("doc") == 1
+
+    # Deleting a document removes its entries from the document store, since its
+    # version and chunk ids can be reused by the next insert.
+    document_store = DocumentStore(model.doc_save_path())
+    content_hash = document_hash(upsert, upsert.path)
+    assert document_store.get(content_hash).doc_id == "doc"
+    model.delete(["doc"])
+    assert document_store.get(content_hash) is None
+
+    # Deleted documents are inserted again.
+    [reinserted] = model.insert_files([upsert])
+    assert reinserted["source_id"] == "doc"
+    assert model.db.chunk_store.max_version_for_doc("doc") == 1
+    assert os.path.exists(reinserted["source"])
+
+    # Upserting an earlier version of a document does not remove the file of the
+    # new version when the old versions are removed.
+    model.insert_files([csv_file(source_id="versions")])
+    model.insert_files(
+        [
+            FileInfo(
+                path=os.path.join(doc_dir(), "articles.csv"),
+                location="local",
+                source_id="versions",
+            )
+        ]
+    )
+    [upserted] = model.insert_files(
+        [csv_file(source_id="versions", options={"upsert": True})]
+    )
+    assert model.db.chunk_store.max_version_for_doc("versions") == 3
+    assert os.path.exists(upserted["source"])
+
+    # If the stored version is deleted by a concurrent request after it is
+    # checked, the document is parsed and inserted again.
+    model.delete(["doc"])
+    [inserted] = model.insert_files([upsert])
+    with patch(
+        "deployment_job.models.ndb_models.DocumentStore.is_current",
+        side_effect=[True, False],
+    ):
+        [reinserted] = model.insert_files([upsert])
+    assert reinserted["source"] != inserted["source"]
+    assert os.path.exists(reinserted["source"])
+    assert model.db.chunk_store.max_version_for_doc("doc") == 2
+
+
+@pytest.mark.unit
+@patch.object(Permissions, "verify_permission", mock_verify_permission)
+@patch.object(Permissions, "check_permission", mock_check_permission)
+def test_queued_upserts_are_applied_in_order(tmp_dir):
+    from deployment_job.routers.ndb import NDBRouter
+    from deployment_job.utils import TaskAction, TaskStatus
+    from platform_common.pydantic_models.training import FileInfo
+
+    # The model is saved in its own directory, since the models loaded by earlier
+    # tests still hold the locks on their files.
+    config = create_config(
+        tmp_dir=os.path.join(tmp_dir, "queued_upserts"),
+        autoscaling=False,
+        on_disk=True,
+        doc_path=os.path.join(doc_dir(), "articles.csv"),
+        text_columns=["text"],
+    )
+    config.model_options.task_batch_size = 1
+
+    router = NDBRouter(config, None, logger)
+    model = router.model
+
+    # The first upsert is parsed slowly, so that the second upsert is parsed by
+    # the other worker while the first one is still in progress.
+    parse_documents = model.parse_documents
+
+    def slow_parse_documents(documents, **kwargs):
+        if documents[0].path.endswith("articles.csv"):
+            time.sleep(2)
+        return parse_documents(documents, **kwargs)
+
+    def upsert(filename):
+        doc = FileInfo(
+            path=os.path.join(doc_dir(), filename),
+            location="local",
+            source_id="doc",
+            options={"upsert": True},
+        )
+        return router.task_queue.add(
+            TaskAction.INSERT, {"documents": [doc.model_dump(mode="json")]}
+        )
+
+    with patch.object(model, "parse_documents", slow_parse_documents):
+        task_ids = [upsert("articles.csv"), upsert("supervised.csv")]
+        for _ in range(60):
+            tasks = [router.task_queue.get(task_id) for task_id in task_ids]
+            if all(task.status == TaskStatus.COMPLETE for task in tasks):
+                break
+            time.sleep(0.5)
+
+    assert [task.status for task in tasks] == [TaskStatus.COMPLETE] * 2
+
+    # The later upsert is the latest version of the document.
+    [doc] = [doc for doc in model.db.documents() if doc["doc_id"] == "doc"]
+    assert doc["document"].endswith("supervised.csv")
+    assert doc["doc_version"] == 2
+
+
+@pytest.mark.unit
+@patch.object(Permissions, "verify_permission", mock_verify_permission)
+@patch.object(Permissions, "check_permission", mock_check_permission)
+def test_chunk_index_not_saved_after_delete(tmp_dir):
+    from deployment_job.chunk_index import chunk_index_path
+    from deployment_job.routers.ndb import NDBRouter
+    from platform_common.pydantic_models.training import FileInfo
+
+    config = create_config(
+        tmp_dir=os.path.join(tmp_dir, "chunk_index"),
+        autoscaling=False,
+        on_disk=True,
+        doc_path=os.path.join(doc_dir(), "articles.csv"),
+        text_columns=["text"],
+    )
+    model = NDBRouter(config, None, logger).model
+
+    # The chunks of PDFs store their bounding boxes as metadata.
+    doc = FileInfo(
+        path=os.path.join(doc_dir(), "supervised.csv"),
+        location="local",
+        source_id="doc",
+        metadata={"chunk_boxes": "[(0, (0.0, 0.0, 1.0, 1.0))]"},
+    )
+    model.insert_files([doc])
+    chunk_id = model.db.chunk_store.get_doc_chunks(doc_id="doc", before_version=2)[0]
+    index_path = chunk_index_path(model.chunk_index_dir(), "doc", 1)
+
+    # The index is saved when it is first built.
+    assert model.chunks(chunk_id)["id"]
+    assert os.path.exists(index_path)
+
+    # If the document is deleted while the index is built, the index is not saved.
+    model.insert_files([doc])
+    chunk_id = model.db.chunk_store.get_doc_chunks(doc_id="doc", before_version=2)[0]
+    os.remove(index_path)
+    build_chunk_index = model.build_chunk_index
+
+    def build_and_delete(chunk, source):
+        index = build_chunk_index(chunk, source)
+        model.delete(["doc"])
+        return index
+
+    with patch.object(model, "build_chunk_index", build_and_delete):
+        assert model.chunks(chunk_id)["id"]
+    assert not os.path.exists(index_path)
@@ -0,0 +1,75 @@
+import os
+
+import pytest
+from deployment_job.highlight_cache import HighlightCache
+from deployment_job.utils import file_response, parse_range_header
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.testclient import TestClient
+
+
+@pytest.mark.unit
+def test_parse_range_header():
+    assert parse_range_header("bytes=0-99", 1000) == (0, 99)
+    assert parse_range_header("bytes=900-", 1000) == (900, 999)
+    assert parse_range_header("bytes=-100", 1000) == (900, 999)
+    assert parse_range_header("bytes=990-2000", 1000) == (990, 999)
+
+    # Ranges that are not supported are ignored, and the whole file is returned.
+    assert parse_range_header("bytes=0-9,20-29", 1000) is None
+    assert parse_range_header("pages=1-2", 1000) is None
+    assert parse_range_header("bytes=abc-", 1000) is None
+
+    with pytest.raises(HTTPException) as error:
+        parse_range_header("bytes=1000-", 1000)
+    assert error.value.status_code == 416
+
+
+@pytest.mark.unit
+def test_file_response_ranges(tmp_path):
+    content = os.urandom(200 * 1024)
+    path = tmp_path / "doc.pdf"
+    path.write_bytes(content)
+
+    app = FastAPI()
+
+    @app.get("/file")
+    def get_file(range_header: str = Header(None, alias="Range")):
+        return file_response(
+            str(path), media_type="application/pdf", range_header=range_header
+        )
+
+    client = TestClient(app)
+
+    res = client.get("/file")
+    assert res.status_code == 200
+    assert res.headers["accept-ranges"] == "bytes"
+    assert res.content == content
+
+    res = client.get("/file", headers={"Range": "bytes=70000-139999"})
+    assert res.status_code == 206
+    assert res.headers["content-range"] == f"bytes 70000-139999/{len(content)}"
+    assert res.content == content[70000:140000]
+
+    res = client.get("/file", headers={"Range": f"bytes={len(content)}-"})
+    assert res.status_code == 416
+
+
+@pytest.mark.unit
+def test_highlight_cache_byte_budget():
+    cache = HighlightCache(max_bytes=10)
+
+    cache.put((1, 0), "a.pdf", b"1234")
+    cache.put((2, 0), "b.pdf", b"1234")
+    assert cache.get((1, 0)) == ("a.pdf", b"1234")
+
+    # (2, 0) is the least recently used entry, so it is evicted to make room.
+    cache.put((3, 0), "c.pdf", b"1234")
+    assert cache.get((2, 0)) is None
+    assert cache.get((1, 0)) is not None
+    assert cache.get((3, 0)) is not None
+    assert cache.total_bytes == 8
+
+    # PDFs larger than the whole budget are not cached.
+    cache.put((4, 0), "d.pdf", b"x" * 11)
+    assert cache.get((4, 0)) is None
+    assert cache.total_bytes == 8
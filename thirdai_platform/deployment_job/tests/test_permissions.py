@@ -0,0 +1,110 @@
+import datetime
+import heapq
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pytest
+from deployment_job.permissions import Permissions, now
+
+
+def make_mock_deployment_permissions(delay: float = 0):
+    calls = []
+    calls_lock = threading.Lock()
+
+    def mock_deployment_permissions(token: str):
+        with calls_lock:
+            calls.append(token)
+        time.sleep(delay)
+        return {
+            "read": token != "bad",
+            "write": False,
+            "override": False,
+            "username": f"user-{token}",
+            "exp": now() + datetime.timedelta(minutes=30),
+        }
+
+    return mock_deployment_permissions, calls
+
+
+@pytest.fixture(scope="function")
+def permissions():
+    Permissions.init(model_bazaar_endpoint="", model_id="xyz")
+    yield Permissions
+    Permissions.init(model_bazaar_endpoint="", model_id="xyz")
+
+
+@pytest.mark.unit
+def test_permission_cache_single_flight(permissions):
+    mock, calls = make_mock_deployment_permissions(delay=0.5)
+    with patch.object(Permissions, "_deployment_permissions", mock):
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            results = list(
+                pool.map(lambda _: Permissions._get_permissions("abc"), range(16))
+            )
+
+        assert calls == ["abc"]
+        assert all(res == (True, False, False, "user-abc") for res in results)
+
+        assert not Permissions.check_permission("bad", "read")
+        assert calls == ["abc", "bad"]
+
+
+@pytest.mark.unit
+def test_permission_cache_hit_does_not_block_on_fetch(permissions):
+    mock, calls = make_mock_deployment_permissions()
+    with patch.object(Permissions, "_deployment_permissions", mock):
+        assert Permissions.check_permission("abc", "read")
+
+    slow_mock, slow_calls = make_mock_deployment_permissions(delay=1)
+    with patch.object(Permissions, "_deployment_permissions", slow_mock):
+        # A slow fetch for a new token should not delay hits for other tokens.
+        thread = threading.Thread(target=Permissions._get_permissions, args=("def",))
+        thread.start()
+        time.sleep(0.1)
+
+        start = time.perf_counter()
+        assert Permissions.check_permission("abc", "read")
+        assert time.perf_counter() - start < 0.5
+        thread.join()
+
+        assert slow_calls == ["def"]
+
+
+@pytest.mark.unit
+def test_permission_cache_background_refresh(permissions):
+    Permissions.refresh_before_sec = Permissions.entry_expiration_min * 60
+
+    mock, calls = make_mock_deployment_permissions(delay=0.5)
+    with patch.object(Permissions, "_deployment_permissions", mock):
+        assert Permissions.check_permission("abc", "read")
+
+        # The entry is within the refresh window, so the hit returns immediately
+        # and the refresh happens in the background.
+        start = time.perf_counter()
+        assert Permissions.check_permission("abc", "read")
+        assert time.perf_counter() - start < 0.25
+
+        Permissions.refresh_executor.shutdown(wait=True)
+        assert calls == ["abc", "abc"]
+
+
+@pytest.mark.unit
+def test_permission_cache_expiration(permissions):
+    mock, calls = make_mock_deployment_permissions()
+    with patch.object(Permissions, "_deployment_permissions", mock):
+        Permissions.check_permission("abc", "read")
+        Permissions.check_permission("def", "read")
+
+        past = now() - datetime.timedelta(seconds=1)
+        with Permissions.cache_lock:
+            Permissions.cache["abc"].expiration = past
+            heapq.heappush(Permissions.expirations, (past, "abc"))
+
+        Permissions.check_permission("def", "read")
+        assert "abc" not in Permissions.cache
+        assert calls == ["abc", "def"]
+
+        Permissions.check_permission("abc", "read")
+        assert calls == ["abc", "def", "abc"]
@@ -0,0 +1,62 @@
+import threading
+import time
+
+import pytest
+from deployment_job.utils import ReadWriteLock
+from prometheus_client import CollectorRegistry, Histogram
+
+
+@pytest.mark.unit
+def test_readers_run_concurrently():
+    lock = ReadWriteLock()
+    barrier = threading.Barrier(4, timeout=5)
+
+    def reader():
+        with lock.read():
+            # All readers must hold the lock at the same time to pass the barrier.
+            barrier.wait()
+
+    threads = [threading.Thread(target=reader) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not barrier.broken
+
+
+@pytest.mark.unit
+def test_writer_is_exclusive():
+    registry = CollectorRegistry()
+    wait_metric = Histogram("lock_wait", "lock wait", ["mode"], registry=registry)
+    lock = ReadWriteLock(wait_metric=wait_metric)
+
+    events = []
+
+    def writer():
+        with lock.write():
+            events.append("write")
+
+    def reader():
+        with lock.read():
+            events.append("read")
+
+    lock.acquire_read()
+    writer_thread = threading.Thread(target=writer)
+    writer_thread.start()
+    time.sleep(0.1)
+    # The writer waits for the active reader, and new readers wait behind the
+    # writer so that it is not starved.
+    reader_thread = threading.Thread(target=reader)
+    reader_thread.start()
+    time.sleep(0.1)
+    assert events == []
+
+    lock.release_read()
+    writer_thread.join()
+    reader_thread.join()
+    assert events == ["write", "read"]
+
+    assert registry.get_sample_value("lock_wait_count", {"mode": "write"}) == 1
+    assert registry.get_sample_value("lock_wait_count", {"mode": "read"}) == 2
+    assert registry.get_sample_value("lock_wait_sum", {"mode": "write"}) >= 0.1
@@ -0,0 +1,65 @@
+import time
+
+import pytest
+from deployment_job.search_cache import (
+    SearchResultCache,
+    search_cache_key,
+    serialize_constraints,
+)
+
+
+@pytest.mark.unit
+def test_search_cache_key_normalization():
+    constraints_a = {
+        "a": {"constraint_type": "EqualTo", "value": 1},
+        "b": {"constraint_type": "AnyOf", "values": ["x", "y"]},
+    }
+    constraints_b = {
+        "b": {"values": ["x", "y"], "constraint_type": "AnyOf"},
+        "a": {"value": 1, "constraint_type": "EqualTo"},
+    }
+    assert serialize_constraints(constraints_a) == serialize_constraints(constraints_b)
+    assert search_cache_key(
+        " what is  AI ", 5, serialize_constraints(constraints_a), False
+    ) == search_cache_key("what is AI", 5, serialize_constraints(constraints_b), False)
+    assert search_cache_key("what is AI", 5, "{}", False) != (
+        search_cache_key("what is AI", 10, "{}", False)
+    )
+    assert serialize_constraints({"a": {"value": object()}}) is None
+    assert search_cache_key("what is AI", 5, None, False) is None
+
+
+@pytest.mark.unit
+def test_search_cache_lru_and_ttl():
+    cache = SearchResultCache(max_entries=2, ttl_sec=0.2)
+    generation = cache.generation()
+
+    cache.put("a", [1], generation)
+    cache.put("b", [2], generation)
+    assert cache.get("a") == [1]
+
+    # "b" is the least recently used entry, so it is evicted.
+    cache.put("c", [3], generation)
+    assert cache.get("b") is None
+    assert cache.get("a") == [1]
+    assert cache.get("c") == [3]
+
+    time.sleep(0.3)
+    assert cache.get("a") is None
+
+
+@pytest.mark.unit
+def test_search_cache_invalidation():
+    cache = SearchResultCache(max_entries=10, ttl_sec=60)
+    generation = cache.generation()
+    cache.put("a", [1], generation)
+
+    cache.invalidate()
+    assert cache.get("a") is None
+
+    # Results from a search that started before the invalidation are dropped.
+    cache.put("a", [1], generation)
+    assert cache.get("a") is None
+
+    cache.put("a", [2], cache.generation())
+    assert cache.get("a") == [2]
@@ -0,0 +1,106 @@
+import threading
+import time
+
+import pytest
+from deployment_job.task_queue import TaskQueue
+from deployment_job.utils import TaskAction, TaskStatus
+
+
+def claim_ids(queue: TaskQueue, max_inserts: int = 10):
+    return [task_id for task_id, _ in queue.claim(max_inserts=max_inserts)]
+
+
+@pytest.mark.unit
+def test_task_queue_coalesces_inserts_in_order(tmp_path):
+    queue = TaskQueue(str(tmp_path / "tasks.db"))
+
+    inserts_1 = [queue.add(TaskAction.INSERT, {"documents": [i]}) for i in range(3)]
+    delete = queue.add(TaskAction.DELETE, {"source_ids": ["a"]})
+    inserts_2 = [queue.add(TaskAction.INSERT, {"documents": [i]}) for i in range(3)]
+
+    assert claim_ids(queue, max_inserts=2) == inserts_1[:2]
+    assert claim_ids(queue) == inserts_1[2:]
+
+    # The delete can only start once the earlier inserts are finished.
+    claimed = []
+    worker = threading.Thread(target=lambda: claimed.extend(claim_ids(queue)))
+    worker.start()
+    for task_id in inserts_1:
+        time.sleep(0.05)
+        assert not claimed
+        queue.complete(task_id, data={"sources": [task_id]})
+    worker.join(timeout=5)
+    assert claimed == [delete]
+
+    # No insert starts while the delete is in progress.
+    claimed = []
+    worker = threading.Thread(target=lambda: claimed.extend(claim_ids(queue)))
+    worker.start()
+    time.sleep(0.05)
+    assert not claimed
+    queue.fail(delete, message="error")
+    worker.join(timeout=5)
+    assert claimed == inserts_2
+
+    assert queue.get(inserts_1[0]).status == TaskStatus.COMPLETE
+    assert queue.get(inserts_1[0]).data == {"sources": [inserts_1[0]]}
+    assert queue.get(delete).status == TaskStatus.FAILED
+    assert queue.get(delete).message == "error"
+    assert list(queue.all().keys()) == inserts_1 + [delete] + inserts_2
+
+
+@pytest.mark.unit
+def test_task_queue_waits_for_earlier_tasks(tmp_path):
+    queue = TaskQueue(str(tmp_path / "tasks.db"))
+    first = queue.add(TaskAction.INSERT, {"documents": [1]})
+    second = queue.add(TaskAction.INSERT, {"documents": [2]})
+    assert claim_ids(queue, max_inserts=1) == [first]
+    assert claim_ids(queue, max_inserts=1) == [second]
+
+    # The first task does not wait for later tasks.
+    queue.wait_for_earlier_tasks([first])
+
+    # The second task can only be applied once the first task is finished.
+    waiting = threading.Thread(target=queue.wait_for_earlier_tasks, args=([second],))
+    waiting.start()
+    time.sleep(0.05)
+    assert waiting.is_alive()
+    queue.fail(first, message="error")
+    waiting.join(timeout=5)
+    assert not waiting.is_alive()
+
+
+@pytest.mark.unit
+def test_task_queue_recovers_after_restart(tmp_path):
+    queue = TaskQueue(str(tmp_path / "tasks.db"))
+    first = queue.add(TaskAction.INSERT, {"documents": [1]})
+    second = queue.add(TaskAction.INSERT, {"documents": [2]})
+    assert claim_ids(queue, max_inserts=1) == [first]
+    queue.close()
+
+    # Tasks that were in progress when the process stopped are run again.
+    queue = TaskQueue(str(tmp_path / "tasks.db"))
+    assert queue.get(first).status == TaskStatus.NOT_STARTED
+    tasks = queue.claim(max_inserts=10)
+    assert [task_id for task_id, _ in tasks] == [first, second]
+    assert [task.data for _, task in tasks] == [{"documents": [1]}, {"documents": [2]}]
+
+
+@pytest.mark.unit
+def test_task_queue_retention(tmp_path):
+    queue = TaskQueue(str(tmp_path / "tasks.db"), max_finished_tasks=2)
+    task_ids = [queue.add(TaskAction.INSERT, {}) for _ in range(4)]
+    for task_id in claim_ids(queue):
+        queue.complete(task_id)
+
+    # Only the most recently finished tasks are kept.
+    assert list(queue.all().keys()) == task_ids[2:]
+
+    # Finished tasks older than the retention period are removed, pending tasks
+    # are always kept.
+    queue.retention_sec = -1
+    finished = queue.add(TaskAction.INSERT, {})
+    pending = queue.add(TaskAction.DELETE, {"source_ids": []})
+    claim_ids(queue)
+    queue.complete(finished)
+    assert list(queue.all().keys()) == [pending]
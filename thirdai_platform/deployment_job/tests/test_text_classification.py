@@ -0,0 +1,146 @@
+import datetime
+import os
+import shutil
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from deployment_job.permissions import Permissions
+from deployment_job.routers.udt import UDTRouterTextClassification
+from fastapi.testclient import TestClient
+from licensing.verify import verify_license
+from platform_common.logging import JobLogger
+from platform_common.pydantic_models.deployment import (
+    DeploymentConfig,
+    UDTDeploymentOptions,
+    UDTSubType,
+)
+from thirdai import bolt
+
+DEPLOYMENT_ID = "123"
+USER_ID = "abc"
+MODEL_ID = "xyz"
+
+THIRDAI_LICENSE = os.path.join(
+    os.path.dirname(__file__), "../../tests/ndb_enterprise_license.json"
+)
+
+N_CLASSES = 4
+
+QUERIES = [
+    "What is artificial intelligence?",
+    "How do I reset my password",
+    "",
+    "What is artificial intelligence?",
+]
+
+logger = JobLogger(
+    log_dir=Path("./tmp"),
+    log_prefix="deployment",
+    service_type="deployment",
+    model_id="model-123",
+    model_type="udt",
+    user_id="user-123",
+)
+
+
+@pytest.fixture(scope="function")
+def tmp_dir():
+    path = "./tmp"
+    os.environ["SHARE_DIR"] = path
+    os.makedirs(path, exist_ok=True)
+    yield path
+    shutil.rmtree(path)
+
+
+def create_text_classification_model(tmp_dir: str):
+    verify_license.verify_and_activate(THIRDAI_LICENSE)
+
+    model = bolt.UniversalDeepTransformer(
+        data_types={
+            "text": bolt.types.text(),
+            "label": bolt.types.categorical(n_classes=N_CLASSES),
+        },
+        target="label",
+        embedding_dimension=10,
+    )
+
+    model_dir = os.path.join(tmp_dir, "models", MODEL_ID)
+    os.makedirs(model_dir, exist_ok=True)
+
+    model_save_path = os.path.join(model_dir, "model.udt")
+    model.save(model_save_path)
+
+    return model_save_path
+
+
+def mock_verify_permission(permission_type: str = "read"):
+    return lambda: ""
+
+
+def mock_check_permission(token: str, permission_type: str = "read"):
+    return True
+
+
+def mock_deployment_permissions(token):
+    return {
+        "read": True,
+        "write": True,
+        "override": True,
+        "username": "test",
+        "exp": datetime.datetime.now(datetime.timezone.utc)
+        + datetime.timedelta(minutes=5),
+    }
+
+
+def create_config(tmp_dir: str):
+    create_text_classification_model(tmp_dir)
+
+    license_info = verify_license.verify_license(THIRDAI_LICENSE)
+
+    return DeploymentConfig(
+        deployment_id=DEPLOYMENT_ID,
+        user_id=USER_ID,
+        model_id=MODEL_ID,
+        model_bazaar_endpoint="",
+        model_bazaar_dir=tmp_dir,
+        host_dir=os.path.join(tmp_dir, "host_dir"),
+        license_key=license_info["boltLicenseKey"],
+        model_options=UDTDeploymentOptions(udt_sub_type=UDTSubType.text),
+    )
+
+
+@pytest.mark.unit
+@patch.object(Permissions, "verify_permission", mock_verify_permission)
+@patch.object(Permissions, "check_permission", mock_check_permission)
+@patch.object(Permissions, "_deployment_permissions", mock_deployment_permissions)
+def test_deployment_text_classification_predict_batch(tmp_dir):
+    config = create_config(tmp_dir)
+
+    router = UDTRouterTextClassification(config, None, logger)
+    client = TestClient(router.router)
+
+    res = client.post("/predict-batch", json={"texts": QUERIES, "top_k": 2})
+    assert res.status_code == 200
+    results = res.json()["data"]["prediction_results"]
+
+    # The results are checked against the full distribution over the classes,
+    # rather than against /predict, since single sample predictions with top_k
+    # can repeat classes in some versions of thirdai.
+    udt = router.model.model
+    activations = udt.predict_batch([{"text": query} for query in QUERIES])
+
+    assert [result["query_text"] for result in results] == QUERIES
+    for result, query_activations in zip(results, activations):
+        expected_ids = np.argsort(-query_activations)[:2]
+        assert [name for name, _ in result["predicted_classes"]] == [
+            udt.class_name(class_id) for class_id in expected_ids
+        ]
+        assert [score for _, score in result["predicted_classes"]] == pytest.approx(
+            query_activations[expected_ids].tolist(), rel=1e-4
+        )
+
+    res = client.post("/predict-batch", json={"texts": []})
+    assert res.status_code == 200
+    assert res.json()["data"]["prediction_results"] == []
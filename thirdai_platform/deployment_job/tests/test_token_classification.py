@@ -1,4 +1,5 @@
 import datetime
+import json
 import os
 import shutil
 from pathlib import Path
@@ -6,6 +7,7 @@ from unittest.mock import patch
 
 import pytest
 from deployment_job.permissions import Permissions
+from deployment_job.routers import udt
 from deployment_job.routers.udt import UDTRouterTokenClassification
 from fastapi.testclient import TestClient
 from licensing.verify import verify_license
@@ -162,3 +164,109 @@ def test_deployment_token_classification_xml(tmp_dir):
             },
         }
     ]
+
+
+@pytest.mark.unit
+@patch.object(Permissions, "verify_permission", mock_verify_permission)
+@patch.object(Permissions, "check_permission", mock_check_permission)
+@patch.object(Permissions, "_deployment_permissions", mock_deployment_permissions)
+def test_deployment_token_classification_predict_batch(tmp_dir):
+    config = create_config(tmp_dir)
+
+    router = UDTRouterTokenClassification(config, None, logger)
+    client = TestClient(router.router)
+
+    for queries, data_type in [
+        (
+            [UNSTRUCTURED_QUERY, "Nothing to see here", UNSTRUCTURED_QUERY],
+            "unstructured",
+        ),
+        ([XML_QUERY, XML_QUERY], "xml"),
+    ]:
+        res = client.post(
+            "/predict-batch", json={"texts": queries, "data_type": data_type}
+        )
+        assert res.status_code == 200
+        results = res.json()["data"]["prediction_results"]
+
+        assert results == [
+            get_query_result(client, query, data_type)["prediction_results"]
+            for query in queries
+        ]
+
+    res = client.post("/predict-batch", json={"texts": []})
+    assert res.status_code == 200
+    assert res.json()["data"]["prediction_results"] == []
+
+
+@pytest.mark.unit
+@patch.object(Permissions, "verify_permission", mock_verify_permission)
+@patch.object(Permissions, "check_permission", mock_check_permission)
+@patch.object(Permissions, "_deployment_permissions", mock_deployment_permissions)
+@patch.object(udt, "STREAM_BATCH_SIZE", 3)
+@patch.object(udt, "STREAM_MAX_IN_FLIGHT_BATCHES", 2)
+def test_deployment_token_classification_predict_stream(tmp_dir):
+    config = create_config(tmp_dir)
+
+    router = UDTRouterTokenClassification(config, None, logger)
+    client = TestClient(router.router)
+
+    lines = [f"{UNSTRUCTURED_QUERY} {i}" for i in range(10)] + [""]
+    lines[4] = "Nothing to see here"
+
+    def body():
+        # Splits lines across chunks, and uses both line endings.
+        data = "\r\n".join(lines[:5]).encode() + b"\n" + "\n".join(lines[5:]).encode()
+        for start in range(0, len(data), 7):
+            yield data[start : start + 7]
+
+    res = client.post("/predict-stream", content=body())
+    assert res.status_code == 200
+    assert res.headers["content-type"] == "application/x-ndjson"
+
+    results = [json.loads(line) for line in res.text.splitlines()]
+    # The empty last line is not followed by a line ending, so it is dropped.
+    assert [result["prediction_results"] for result in results] == [
+        get_query_result(client, line, "unstructured")["prediction_results"]
+        for line in lines[:-1]
+    ]
+
+    # Lines which cannot be predicted get an error, without failing the rest of
+    # their batch.
+    xml_query = " ".join(XML_QUERY.split())
+    res = client.post(
+        "/predict-stream",
+        params={"data_type": "xml"},
+        content="\n".join([xml_query, "<Employee>", xml_query]),
+    )
+    assert res.status_code == 200
+    results = [json.loads(line) for line in res.text.splitlines()]
+    assert len(results) == 3
+    assert "error" in results[1]
+    assert results[0] == results[2]
+    assert (
+        results[0]["prediction_results"]
+        == get_query_result(client, xml_query, "xml")["prediction_results"]
+    )
+
+    # Lines which are too long get an error, whether they are split across
+    # chunks or not, and are not kept in memory while they are read.
+    long_line = "x" * 100
+    lines = [UNSTRUCTURED_QUERY, long_line, UNSTRUCTURED_QUERY, long_line]
+    data = "\n".join(lines).encode()
+    with patch.object(udt, "STREAM_MAX_LINE_BYTES", 64):
+        for chunk_size in [7, len(data)]:
+            res = client.post(
+                "/predict-stream",
+                content=(
+                    data[start : start + chunk_size]
+                    for start in range(0, len(data), chunk_size)
+                ),
+            )
+            assert res.status_code == 200
+            results = [json.loads(line) for line in res.text.splitlines()]
+            assert len(results) == 4
+            assert "64 bytes" in results[1]["error"]
+            assert "64 bytes" in results[3]["error"]
+            assert results[0] == results[2]
+            assert "prediction_results" in results[0]
@@ -0,0 +1,118 @@
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from deployment_job import usage_stats
+from deployment_job.usage_stats import UsageStats
+from platform_common.logging import JobLogger
+
+logger = JobLogger(
+    log_dir=Path("./tmp"),
+    log_prefix="deployment",
+    service_type="deployment",
+    model_id="model-123",
+    model_type="udt",
+    user_id="user-123",
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class FakeResponse:
+    def __init__(self, value):
+        self.value = value
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        result = [] if self.value is None else [{"value": [0, str(self.value)]}]
+        return {"data": {"result": result}}
+
+
+class FakeMetricsSession:
+    def __init__(self):
+        self.queries = []
+
+    def get(self, url, params, timeout):
+        self.queries.append(params["query"])
+        if "udt_tokens_identified" in params["query"]:
+            return FakeResponse(None)
+        return FakeResponse(10.4 if "increase" in params["query"] else 20.6)
+
+
+@pytest.mark.unit
+def test_usage_stats_from_local_metrics():
+    clock = FakeClock()
+    with patch.object(usage_stats.time, "monotonic", clock.monotonic):
+        stats = UsageStats(model_id="xyz", model_bazaar_endpoint="", logger=logger)
+        before = stats.stats()
+
+        stats.record("unstructured", "my name is bob", tokens_identified=1)
+        stats.record("xml", "<name>bob</name>", tokens_identified=2)
+        stats.record_latency("xml", 0.5)
+
+        after = stats.stats()
+        for window in ["past_hour", "total"]:
+            delta = {
+                field: after[window][field] - before[window][field]
+                for field in after[window]
+            }
+            assert delta == {
+                "tokens_identified": 3,
+                "queries_ingested": 2,
+                "queries_ingested_bytes": len("my name is bob")
+                + len("<name>bob</name>"),
+            }
+
+        # Queries leave the past hour once it has passed, but are still in the
+        # total.
+        clock.now += 30 * 60
+        stats.record("text", "what is ai")
+        clock.now += 31 * 60
+        later = stats.stats()
+        assert later["past_hour"]["queries_ingested"] == 1
+        assert later["total"]["queries_ingested"] == (
+            after["total"]["queries_ingested"] + 1
+        )
+
+
+@pytest.mark.unit
+def test_usage_stats_from_metrics_store():
+    stats = UsageStats(
+        model_id="xyz", model_bazaar_endpoint="http://model-bazaar/", logger=logger
+    )
+    assert stats.query_endpoint == "http://model-bazaar/victoriametrics/api/v1/query"
+
+    session = FakeMetricsSession()
+    stats.session = session
+    result = stats.stats()
+
+    assert result["past_hour"] == {
+        "tokens_identified": 0,
+        "queries_ingested": 10,
+        "queries_ingested_bytes": 10,
+    }
+    assert result["total"] == {
+        "tokens_identified": 0,
+        "queries_ingested": 21,
+        "queries_ingested_bytes": 21,
+    }
+    assert (
+        'sum(increase(udt_queries_ingested_total{model_id="xyz"}[3600s]))'
+        in session.queries
+    )
+
+    # Falls back to the metrics of this allocation if the store is unavailable.
+    def unavailable(*args, **kwargs):
+        raise ConnectionError("unavailable")
+
+    session.get = unavailable
+    result = stats.stats()
+    assert result["total"] == stats.local_stats()["total"]
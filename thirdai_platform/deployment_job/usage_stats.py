@@ -0,0 +1,194 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+from urllib.parse import urljoin
+
+import requests
+from platform_common.logging import JobLogger, LogCode
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    multiprocess,
+)
+
+udt_tokens_identified_metric = Counter(
+    "udt_tokens_identified",
+    "Number of tokens tagged with an entity by UDT predictions, by data type.",
+    ["data_type"],
+)
+udt_queries_ingested_metric = Counter(
+    "udt_queries_ingested",
+    "Number of texts predicted by UDT predictions, by data type.",
+    ["data_type"],
+)
+udt_queries_ingested_bytes_metric = Counter(
+    "udt_queries_ingested_bytes",
+    "Number of characters of the texts predicted by UDT predictions, by data type.",
+    ["data_type"],
+)
+udt_predict_latency_metric = Histogram(
+    "udt_predict_latency_seconds",
+    "Time taken by UDT prediction requests, or by each batch of a prediction "
+    "stream, by data type.",
+    ["data_type"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+# The names of the counters reported by /stats, by their field in the response.
+STATS_METRICS = {
+    "tokens_identified": "udt_tokens_identified",
+    "queries_ingested": "udt_queries_ingested",
+    "queries_ingested_bytes": "udt_queries_ingested_bytes",
+}
+
+# How often the local totals are saved to compute the past hour of stats when
+# the metrics store is unavailable.
+SNAPSHOT_INTERVAL = 60
+STATS_WINDOW = 3600
+
+METRICS_QUERY_TIMEOUT = 2
+
+
+def metrics_registry() -> CollectorRegistry:
+    """
+    Returns the registry to export metrics from. If the deployment is served by
+    several worker processes, which prometheus_client expects to share a
+    PROMETHEUS_MULTIPROC_DIR, this is a registry which aggregates the metrics of
+    all of them, so that /metrics and /stats are the same whichever worker
+    handles the request.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def local_totals(registry: CollectorRegistry) -> Dict[str, float]:
+    # Sums each counter over all of its labels.
+    sample_to_field = {f"{name}_total": field for field, name in STATS_METRICS.items()}
+    totals = {field: 0.0 for field in STATS_METRICS}
+    for metric in registry.collect():
+        for sample in metric.samples:
+            if sample.name in sample_to_field:
+                totals[sample_to_field[sample.name]] += sample.value
+    return totals
+
+
+class UsageStats:
+    """
+    Records the usage metrics of a UDT deployment, and computes the /stats view
+    of them.
+
+    The stats are queried from the metrics store which scrapes every allocation
+    of the deployment, so that they are aggregated over all of the allocations
+    the deployment is scaled to. If the metrics store is unavailable, such as
+    when the platform is run without telemetry, the stats are computed from the
+    metrics of this allocation instead.
+    """
+
+    def __init__(self, model_id: str, model_bazaar_endpoint: str, logger: JobLogger):
+        self.model_id = model_id
+        self.query_endpoint = (
+            urljoin(model_bazaar_endpoint, "victoriametrics/api/v1/query")
+            if model_bazaar_endpoint
+            else None
+        )
+        self.session = requests.Session()
+        self.registry = metrics_registry()
+        self.logger = logger
+
+        self.start_time = time.time()
+
+        # Totals of this allocation, saved every SNAPSHOT_INTERVAL seconds over
+        # the past STATS_WINDOW seconds.
+        self.snapshots = deque(maxlen=STATS_WINDOW // SNAPSHOT_INTERVAL + 1)
+        self.snapshot_lock = threading.Lock()
+        self.next_snapshot = 0.0
+        self.maybe_snapshot()
+
+    def record(self, data_type: str, text: str, tokens_identified: int = 0):
+        # The snapshot is taken before the query is counted, so that the query is
+        # counted in the past hour.
+        self.maybe_snapshot()
+        udt_queries_ingested_metric.labels(data_type).inc()
+        udt_queries_ingested_bytes_metric.labels(data_type).inc(len(text))
+        if tokens_identified:
+            udt_tokens_identified_metric.labels(data_type).inc(tokens_identified)
+
+    def record_latency(self, data_type: str, seconds: float):
+        udt_predict_latency_metric.labels(data_type).observe(seconds)
+
+    def maybe_snapshot(self):
+        now = time.monotonic()
+        if now < self.next_snapshot:
+            return
+        with self.snapshot_lock:
+            if now < self.next_snapshot:
+                return
+            self.snapshots.append((now, local_totals(self.registry)))
+            self.next_snapshot = now + SNAPSHOT_INTERVAL
+
+    def query_metric(self, query: str) -> float:
+        res = self.session.get(
+            self.query_endpoint,
+            params={"query": query},
+            timeout=METRICS_QUERY_TIMEOUT,
+        )
+        res.raise_for_status()
+        result = res.json()["data"]["result"]
+        # sum() returns no series if there are no samples for the deployment yet.
+        return float(result[0]["value"][1]) if result else 0.0
+
+    def cluster_stats(self) -> Optional[Dict[str, Dict[str, int]]]:
+        if not self.query_endpoint:
+            return None
+
+        stats = {"past_hour": {}, "total": {}}
+        try:
+            for field, name in STATS_METRICS.items():
+                series = f'{name}_total{{model_id="{self.model_id}"}}'
+                stats["past_hour"][field] = round(
+                    self.query_metric(f"sum(increase({series}[{STATS_WINDOW}s]))")
+                )
+                stats["total"][field] = round(self.query_metric(f"sum({series})"))
+        except Exception as e:
+            self.logger.debug(
+                f"Unable to query deployment stats from the metrics store, using the stats of this allocation: {e}",
+                code=LogCode.MODEL_INFO,
+            )
+            return None
+        return stats
+
+    def local_stats(self) -> Dict[str, Dict[str, int]]:
+        self.maybe_snapshot()
+        totals = local_totals(self.registry)
+
+        now = time.monotonic()
+        with self.snapshot_lock:
+            # The oldest snapshot from within the window, or the snapshot taken
+            # when the deployment started if it has been up for less than that.
+            hour_ago = next(
+                (
+                    snapshot
+                    for timestamp, snapshot in self.snapshots
+                    if timestamp >= now - STATS_WINDOW
+                ),
+                self.snapshots[-1][1],
+            )
+
+        return {
+            "past_hour": {
+                field: round(totals[field] - hour_ago[field]) for field in totals
+            },
+            "total": {field: round(value) for field, value in totals.items()},
+        }
+
+    def stats(self) -> Dict:
+        stats = self.cluster_stats() or self.local_stats()
+        stats["uptime"] = int(time.time() - self.start_time)
+        return stats
@@ -2,12 +2,19 @@ import ast
 import datetime
 import enum
 import fcntl
+import os
 import re
+import threading
+import time
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import Dict, Tuple
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
 
 import fitz
 import requests
+from fastapi import HTTPException, status
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from prometheus_client import Histogram
 from thirdai import neural_db as ndb
 
 
@@ -152,6 +159,181 @@ def old_pdf_chunks(db: ndb.NeuralDB, reference: ndb.Reference):
     }
 
 
+def parse_range_header(range_header: str, file_size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parses an HTTP Range header for a single byte range.
+
+    Args:
+        range_header (str): The value of the Range header, e.g. "bytes=0-1023".
+        file_size (int): The size of the file the range is for.
+
+    Returns:
+        Optional[Tuple[int, int]]: The first and last byte of the range (inclusive),
+            or None if the header should be ignored and the whole file returned.
+
+    Raises:
+        HTTPException: If the range can't be satisfied for the file.
+    """
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in ranges:
+        # Multiple ranges are valid, but not needed by the PDF viewer, so the
+        # whole file is returned instead.
+        return None
+
+    start, _, end = ranges.strip().partition("-")
+    try:
+        if start:
+            first = int(start)
+            last = int(end) if end else file_size - 1
+        else:
+            # A suffix range, e.g. bytes=-500 requests the last 500 bytes.
+            first = max(file_size - int(end), 0)
+            last = file_size - 1
+    except ValueError:
+        return None
+
+    if first > last or first >= file_size:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            headers={"Content-Range": f"bytes */{file_size}"},
+        )
+
+    return first, min(last, file_size - 1)
+
+
+def iter_file_range(
+    path: str, first: int, last: int, chunk_size: int = 64 * 1024
+) -> Iterator[bytes]:
+    with open(path, "rb") as file:
+        file.seek(first)
+        remaining = last - first + 1
+        while remaining > 0:
+            chunk = file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def file_response(
+    path: str,
+    media_type: str,
+    range_header: Optional[str] = None,
+    headers: Optional[Dict[str, str]] = None,
+) -> Response:
+    """
+    Streams a file from disk, without reading the whole file into memory. If a
+    Range header is given, only the requested bytes are returned, which allows
+    clients such as PDF viewers to fetch the parts of a file they need lazily.
+
+    Args:
+        path (str): Path of the file.
+        media_type (str): Media type of the file.
+        range_header (Optional[str]): The Range header of the request, if any.
+        headers (Optional[Dict[str, str]]): Additional headers for the response.
+
+    Returns:
+        Response: A 200 response with the whole file, or a 206 response with the
+            requested range.
+    """
+    headers = {**(headers or {}), "Accept-Ranges": "bytes"}
+
+    file_size = os.path.getsize(path)
+    byte_range = parse_range_header(range_header, file_size) if range_header else None
+    if byte_range is None:
+        return FileResponse(path, headers=headers, media_type=media_type)
+
+    first, last = byte_range
+    headers["Content-Range"] = f"bytes {first}-{last}/{file_size}"
+    headers["Content-Length"] = str(last - first + 1)
+    return StreamingResponse(
+        iter_file_range(path, first, last),
+        status_code=status.HTTP_206_PARTIAL_CONTENT,
+        headers=headers,
+        media_type=media_type,
+    )
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    A StreamingResponse for endpoints which stream their response while they are
+    still reading the request body. StreamingResponse watches for the client to
+    disconnect by reading messages from the request, which takes chunks of the
+    body away from the endpoint. This response instead relies on the endpoint
+    reading the body, or on sending the response failing, to stop when the
+    client disconnects.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+
+        if self.background is not None:
+            await self.background()
+
+
+def decode_line(line: bytearray) -> str:
+    text = line.decode("utf-8", errors="replace")
+    return text[:-1] if text.endswith("\r") else text
+
+
+async def iter_line_batches(
+    chunks: AsyncIterator[bytes], batch_size: int, max_line_bytes: int
+) -> AsyncIterator[List[Optional[str]]]:
+    """
+    Splits a stream of bytes into lines, and yields them in batches of up to
+    batch_size lines, so that only the current batch and a partial line are held
+    in memory, however long the stream is. Lines longer than max_line_bytes are
+    discarded as they are read, and are None in their batch.
+
+    Args:
+        chunks (AsyncIterator[bytes]): The stream, such as Request.stream().
+        batch_size (int): The maximum number of lines in each batch.
+        max_line_bytes (int): The maximum length of a line, without its line
+            ending.
+
+    Yields:
+        List[Optional[str]]: The next batch of lines, decoded as UTF-8 and
+            without line endings, or None for lines that are too long.
+    """
+    buffer = bytearray()
+    batch = []
+    # Whether the rest of the current line is being discarded because it is too
+    # long.
+    discarding = False
+    async for chunk in chunks:
+        # Only the new chunk is searched for line endings, since the rest of the
+        # buffer is a partial line.
+        search_from = len(buffer)
+        buffer += chunk
+        start = 0
+        while (end := buffer.find(b"\n", max(start, search_from))) != -1:
+            if discarding:
+                discarding = False
+            elif end - start > max_line_bytes:
+                batch.append(None)
+            else:
+                batch.append(decode_line(buffer[start:end]))
+            start = end + 1
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        del buffer[:start]
+
+        if len(buffer) > max_line_bytes:
+            if not discarding:
+                discarding = True
+                batch.append(None)
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+            buffer.clear()
+
+    if buffer and not discarding:
+        batch.append(decode_line(buffer))
+    if batch:
+        yield batch
+
+
 def acquire_file_lock(lockfile):
     lock = open(lockfile, "w")
     fcntl.flock(lock, fcntl.LOCK_EX)
@@ -182,3 +364,75 @@ class Task:
     last_modified: str
     data: Dict
     message: str = ""
+
+
+class ReadWriteLock:
+    """
+    Lock that allows any number of concurrent readers, or a single writer. Once a
+    writer is waiting, new readers block until it has finished so that a steady
+    stream of reads cannot starve writes. If a histogram is given, the time
+    spent waiting for the lock is recorded with the mode ("read" or "write") as
+    its label.
+    """
+
+    def __init__(self, wait_metric: Optional[Histogram] = None):
+        self.condition = threading.Condition(threading.Lock())
+        self.active_readers = 0
+        self.waiting_writers = 0
+        self.writer_active = False
+
+        if wait_metric is not None:
+            self.read_wait_metric = wait_metric.labels("read")
+            self.write_wait_metric = wait_metric.labels("write")
+        else:
+            self.read_wait_metric = None
+            self.write_wait_metric = None
+
+    def acquire_read(self) -> None:
+        start = time.perf_counter()
+        with self.condition:
+            while self.writer_active or self.waiting_writers > 0:
+                self.condition.wait()
+            self.active_readers += 1
+        if self.read_wait_metric is not None:
+            self.read_wait_metric.observe(time.perf_counter() - start)
+
+    def release_read(self) -> None:
+        with self.condition:
+            self.active_readers -= 1
+            if self.active_readers == 0:
+                self.condition.notify_all()
+
+    def acquire_write(self) -> None:
+        start = time.perf_counter()
+        with self.condition:
+            self.waiting_writers += 1
+            try:
+                while self.writer_active or self.active_readers > 0:
+                    self.condition.wait()
+            finally:
+                self.waiting_writers -= 1
+            self.writer_active = True
+        if self.write_wait_metric is not None:
+            self.write_wait_metric.observe(time.perf_counter() - start)
+
+    def release_write(self) -> None:
+        with self.condition:
+            self.writer_active = False
+            self.condition.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
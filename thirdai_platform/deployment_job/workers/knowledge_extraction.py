@@ -10,11 +10,14 @@ import requests
 import thirdai
 import torch
 from licensing.verify import verify_license
+from platform_common import file_ops
+from platform_common.download_prefetcher import DownloadPrefetcher
 from platform_common.file_handler import expand_cloud_buckets_and_directories
 from platform_common.logging import setup_logger
+from platform_common.ndb.document_store import document_hash
 from platform_common.ndb.ndbv2_parser import parse_doc
 from platform_common.pydantic_models.deployment import DeploymentConfig
-from platform_common.pydantic_models.training import FileInfo
+from platform_common.pydantic_models.training import FileInfo, FileLocation
 from thirdai import neural_db_v2 as ndb
 
 
@@ -121,22 +124,50 @@ class ReportProcessorWorker:
 
         self.logger.info("starting document parsing")
         s = time.perf_counter()
+        doc_save_dir = str(self.reports_base_path / report_id / "documents")
+        tmp_dir = str(self.reports_base_path / report_id / "documents/tmp")
+        # Cloud documents are downloaded in the background while earlier
+        # documents are parsed.
+        prefetcher = DownloadPrefetcher(documents, tmp_dir=tmp_dir, max_outstanding=1)
         docs = []
-        for doc in documents:
-            self.logger.info(f"parsing document: {doc.path}")
-            ndb_doc = parse_doc(
-                doc=doc,
-                doc_save_dir=str(self.reports_base_path / report_id / "documents"),
-                tmp_dir=str(self.reports_base_path / report_id / "documents/tmp"),
-            )
-            if ndb_doc is None:
-                self.logger.error(f"unable to parse document {doc.path}")
-                raise ValueError(
-                    f"Unable to process document '{os.path.basename(doc.path)}'. Please ensure that document is a supported type (pdf, docx, csv, html) and has correct extension."
+        # Content hashes of the parsed documents, so that documents which are
+        # repeated in the report are only parsed and indexed once.
+        parsed_hashes = set()
+        try:
+            for doc, downloaded_path in prefetcher:
+                local_path = (
+                    doc.path if doc.location == FileLocation.local else downloaded_path
                 )
-            else:
-                docs.append(ndb_doc)
-                self.logger.info(f"parsed document: {doc.path}")
+                content_hash = document_hash(doc, local_path) if local_path else None
+                if content_hash and content_hash in parsed_hashes:
+                    prefetcher.release()
+                    self.logger.info(f"skipping duplicate document: {doc.path}")
+                    continue
+                parsed_hashes.add(content_hash)
+
+                self.logger.info(f"parsing document: {doc.path}")
+                try:
+                    ndb_doc = parse_doc(
+                        doc=doc,
+                        doc_save_dir=doc_save_dir,
+                        tmp_dir=tmp_dir,
+                        downloaded_path=downloaded_path,
+                        sync=False,
+                    )
+                finally:
+                    prefetcher.release()
+                if ndb_doc is None:
+                    self.logger.error(f"unable to parse document {doc.path}")
+                    raise ValueError(
+                        f"Unable to process document '{os.path.basename(doc.path)}'. Please ensure that document is a supported type (pdf, docx, csv, html) and has correct extension."
+                    )
+                else:
+                    docs.append(ndb_doc)
+                    self.logger.info(f"parsed document: {doc.path}")
+        finally:
+            prefetcher.close()
+
+        file_ops.sync_barrier([doc_save_dir])
 
         total_chunks = 0
         for doc in docs:
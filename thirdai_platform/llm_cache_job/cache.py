@@ -1,8 +1,11 @@
 import os
 from abc import ABC, abstractmethod
+from collections import OrderedDict, defaultdict
 from logging import Logger
-from typing import Any, Dict, List, Optional, Set
+from threading import Condition, Lock, Thread
+from typing import Any, Dict, List, Optional, Set, Tuple
 
+import numpy as np
 from thirdai import neural_db_v2 as ndb
 from thirdai.neural_db_v2.chunk_stores import constraints
 
@@ -24,10 +27,87 @@ class Cache(ABC):
     def invalidate(self, model_id: str) -> None:
         raise NotImplemented
 
+    def flush(self) -> None:
+        pass
 
-def token_similarity(query_tokens: Set[str], cached_query: str) -> float:
-    overlap = len(query_tokens.intersection(cached_query.split()))
-    return overlap / len(query_tokens)
+    def shutdown(self) -> None:
+        pass
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def token_similarities(query_tokens: Set[str], cached_queries: List[str]) -> np.ndarray:
+    """
+    Returns the fraction of the query tokens that appear in each cached query.
+    The tokens of all cached queries are checked against the query tokens with a
+    single np.isin and the overlaps are summed per cached query with np.bincount.
+    """
+    if len(query_tokens) == 0 or len(cached_queries) == 0:
+        return np.zeros(len(cached_queries), dtype=np.float32)
+
+    cached_tokens = [set(cached_query.split()) for cached_query in cached_queries]
+    lengths = np.fromiter(map(len, cached_tokens), dtype=np.int64)
+    flat_tokens = np.fromiter(
+        (token for tokens in cached_tokens for token in tokens),
+        dtype=object,
+        count=int(lengths.sum()),
+    )
+    segment_ids = np.repeat(np.arange(len(cached_queries)), lengths)
+
+    matches = np.isin(flat_tokens, list(query_tokens))
+    overlaps = np.bincount(segment_ids, weights=matches, minlength=len(cached_queries))
+    return overlaps / len(query_tokens)
+
+
+class ExactMatchCache:
+    """
+    First tier of the semantic cache. Maps normalized queries to cached responses
+    for each model, so that repeated queries do not need a NeuralDB search. Each
+    model's entries are bounded in size and evicted in LRU order.
+    """
+
+    def __init__(self, max_entries_per_model: int):
+        self.max_entries_per_model = max_entries_per_model
+        self.entries: Dict[str, OrderedDict[str, Dict[str, Any]]] = {}
+        # generations are bumped when a model's cache is invalidated, so that
+        # results from searches which started before the invalidation are dropped.
+        self.generations: Dict[str, int] = {}
+        self.lock = Lock()
+
+    def generation(self, model_id: str) -> int:
+        with self.lock:
+            return self.generations.get(model_id, 0)
+
+    def get(self, model_id: str, query: str) -> Optional[Dict[str, Any]]:
+        key = normalize_query(query)
+        with self.lock:
+            model_entries = self.entries.get(model_id)
+            if model_entries is None or key not in model_entries:
+                return None
+            model_entries.move_to_end(key)
+            return model_entries[key]
+
+    def put(
+        self, model_id: str, query: str, result: Dict[str, Any], generation: int
+    ) -> None:
+        if self.max_entries_per_model <= 0:
+            return
+        key = normalize_query(query)
+        with self.lock:
+            if self.generations.get(model_id, 0) != generation:
+                return
+            model_entries = self.entries.setdefault(model_id, OrderedDict())
+            model_entries[key] = result
+            model_entries.move_to_end(key)
+            while len(model_entries) > self.max_entries_per_model:
+                model_entries.popitem(last=False)
+
+    def invalidate(self, model_id: str) -> None:
+        with self.lock:
+            self.entries.pop(model_id, None)
+            self.generations[model_id] = self.generations.get(model_id, 0) + 1
 
 
 class NDBSemanticCache(Cache):
@@ -53,6 +133,28 @@ class NDBSemanticCache(Cache):
                 raise e
         self.threshold = float(os.getenv("LLM_CACHE_THRESHOLD", "0.95"))
         self.logger.info(f"Cache threshold set to {self.threshold}")
+        self.exact_match_cache = ExactMatchCache(
+            max_entries_per_model=int(os.getenv("LLM_CACHE_EXACT_MATCH_SIZE", "10000"))
+        )
+
+        # Inserts are acknowledged immediately and written to the ndb in batches
+        # by a background thread, so that each cached answer doesn't cost an index
+        # update on the request path. db_lock serializes the batched inserts with
+        # deletes from invalidate. Each queued insert is stamped with the number
+        # of times its model has been invalidated, so that inserts queued before
+        # an invalidation are dropped even if they were already taken off the
+        # queue when it happened.
+        self.insert_flush_interval = float(
+            os.getenv("LLM_CACHE_INSERT_FLUSH_INTERVAL", "1.0")
+        )
+        self.insert_batch_size = int(os.getenv("LLM_CACHE_INSERT_BATCH_SIZE", "256"))
+        self.pending_inserts: List[Tuple[str, str, str, int]] = []
+        self.invalidations: Dict[str, int] = defaultdict(int)
+        self.pending_inserts_cv = Condition()
+        self.db_lock = Lock()
+        self.stopped = False
+        self.insert_thread = Thread(target=self._process_inserts, daemon=True)
+        self.insert_thread.start()
 
     def suggestions(self, model_id: str, query: str) -> List[Dict[str, Any]]:
         self.logger.info(
@@ -82,6 +184,13 @@ class NDBSemanticCache(Cache):
         self.logger.info(
             f"Executing cache query for model_id={model_id}, query='{query}'"
         )
+        result = self.exact_match_cache.get(model_id=model_id, query=query)
+        if result is not None:
+            self.logger.info(f"Exact match cache hit for query '{query}'")
+            return result
+
+        generation = self.exact_match_cache.generation(model_id=model_id)
+
         if self.db.retriever.retriever.size() == 0:
             self.logger.info("Cache is empty;")
             return None
@@ -92,42 +201,118 @@ class NDBSemanticCache(Cache):
             constraints={"model_id": constraints.EqualTo(model_id)},
         )
 
-        query_tokens = set(query.split())
-        reranked = sorted(
-            [(res[0], token_similarity(query_tokens, res[0].text)) for res in results],
-            key=lambda x: x[1],
-            reverse=True,
+        similarities = token_similarities(
+            query_tokens=set(query.split()),
+            cached_queries=[chunk.text for chunk, _ in results],
         )
 
-        if len(reranked) > 0 and reranked[0][1] > self.threshold:
-            self.logger.info(
-                f"Cache hit with similarity {reranked[0][1]} for query '{query}'"
-            )
-            return {
-                "query": reranked[0][0].text,
-                "query_id": reranked[0][0].chunk_id,
-                "llm_res": reranked[0][0].metadata["llm_res"],
-            }
+        if len(results) > 0:
+            best = int(np.argmax(similarities))
+            if similarities[best] > self.threshold:
+                self.logger.info(
+                    f"Cache hit with similarity {similarities[best]} for query '{query}'"
+                )
+                chunk = results[best][0]
+                result = {
+                    "query": chunk.text,
+                    "query_id": chunk.chunk_id,
+                    "llm_res": chunk.metadata["llm_res"],
+                }
+                self.exact_match_cache.put(
+                    model_id=model_id,
+                    query=query,
+                    result=result,
+                    generation=generation,
+                )
+                return result
 
         self.logger.info("Cache miss or similarity below threshold.")
         return None
 
     def insert(self, model_id: str, query: str, llm_res: str) -> None:
-        self.logger.info(f"Inserting query into cache for model_id={model_id}")
-        self.db.insert(
-            [
-                ndb.InMemoryText(
-                    document_name="",
-                    text=[query],
-                    doc_metadata={"model_id": model_id, "llm_res": llm_res},
+        self.logger.info(f"Queueing query for cache insertion for model_id={model_id}")
+        with self.pending_inserts_cv:
+            self.pending_inserts.append(
+                (model_id, query, llm_res, self.invalidations[model_id])
+            )
+            self.pending_inserts_cv.notify()
+
+    def _insert_batch(self, batch: List[Tuple[str, str, str, int]]) -> None:
+        with self.db_lock:
+            with self.pending_inserts_cv:
+                batch = [
+                    pending
+                    for pending in batch
+                    if pending[3] == self.invalidations[pending[0]]
+                ]
+            if not batch:
+                return
+            self.logger.info(f"Inserting {len(batch)} queries into cache")
+            self.db.insert(
+                [
+                    ndb.InMemoryText(
+                        document_name="",
+                        text=[query for _, query, _, _ in batch],
+                        chunk_metadata=[
+                            {"model_id": model_id, "llm_res": llm_res}
+                            for model_id, _, llm_res, _ in batch
+                        ],
+                    )
+                ]
+            )
+
+    def _process_inserts(self) -> None:
+        while True:
+            with self.pending_inserts_cv:
+                self.pending_inserts_cv.wait_for(
+                    lambda: self.pending_inserts or self.stopped
                 )
-            ]
-        )
+                if self.stopped:
+                    return
+                # Wait for more inserts to arrive so they can be coalesced into a
+                # single ndb insert.
+                self.pending_inserts_cv.wait_for(
+                    lambda: len(self.pending_inserts) >= self.insert_batch_size
+                    or self.stopped,
+                    timeout=self.insert_flush_interval,
+                )
+                batch = self.pending_inserts[: self.insert_batch_size]
+                self.pending_inserts = self.pending_inserts[self.insert_batch_size :]
+
+            try:
+                self._insert_batch(batch)
+            except Exception:
+                self.logger.error("Failed to insert batch into cache", exc_info=True)
+
+    def flush(self) -> None:
+        """
+        Writes all queued inserts to the ndb before returning.
+        """
+        with self.pending_inserts_cv:
+            batch = self.pending_inserts
+            self.pending_inserts = []
+        # A batch that the background thread is inserting holds db_lock, so once
+        # this insert completes all previously queued inserts are in the ndb.
+        self._insert_batch(batch)
+
+    def shutdown(self) -> None:
+        with self.pending_inserts_cv:
+            self.stopped = True
+            self.pending_inserts_cv.notify_all()
+        self.insert_thread.join()
+        self.flush()
 
     def invalidate(self, model_id: str) -> None:
         self.logger.info(f"Invalidating cache entries for model_id={model_id}")
-        ids = self.db.chunk_store.filter_chunk_ids(
-            constraints={"model_id": constraints.EqualTo(model_id)}
-        )
+        with self.pending_inserts_cv:
+            self.invalidations[model_id] += 1
+            self.pending_inserts = [
+                pending for pending in self.pending_inserts if pending[0] != model_id
+            ]
+        self.exact_match_cache.invalidate(model_id=model_id)
+        with self.db_lock:
+            ids = self.db.chunk_store.filter_chunk_ids(
+                constraints={"model_id": constraints.EqualTo(model_id)}
+            )
 
-        self.db.delete(list(ids))
+            self.db.delete(list(ids))
@@ -133,6 +133,12 @@ def temporary_cache_token(model_id: str):
 app.include_router(router, prefix="/cache")
 
 
+@app.on_event("shutdown")
+def shutdown_event():
+    # Write any queued inserts to the cache before exiting.
+    cache.shutdown()
+
+
 if __name__ == "__main__":
     import uvicorn
 
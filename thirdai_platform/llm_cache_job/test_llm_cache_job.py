@@ -104,6 +104,9 @@ def test_llm_cache(temp_share):
         get_token(client, "xyz"),
     )
 
+    # Inserts are written to the ndb in the background.
+    llm_cache_job.main.cache.flush()
+
     results = suggestions(client, "abc", "wht is the capital of fran")
     assert len(results) == 2
     assert results[0]["query"] == "what is the capital of france"
@@ -118,3 +121,85 @@ def test_llm_cache(temp_share):
     assert res.status_code == 200
 
     assert query(client, "abc", "what is the capital of franc") == None
+
+
+@pytest.mark.unit
+def test_token_similarities():
+    from llm_cache_job.cache import token_similarities
+
+    query_tokens = set("what is the capital of france".split())
+    similarities = token_similarities(
+        query_tokens,
+        [
+            "what is the capital of norway",
+            "what is the capital of france",
+            "",
+            "capital capital france",
+        ],
+    )
+    assert similarities.tolist() == [5 / 6, 1.0, 0.0, 2 / 6]
+
+    assert len(token_similarities(set(), ["a b c"])) == 1
+    assert len(token_similarities(query_tokens, [])) == 0
+
+
+@pytest.mark.unit
+def test_exact_match_cache():
+    from llm_cache_job.cache import ExactMatchCache
+
+    cache = ExactMatchCache(max_entries_per_model=2)
+
+    generation = cache.generation("abc")
+    cache.put("abc", "What is  the capital of France", {"llm_res": "paris"}, generation)
+    cache.put("abc", "capital of norway", {"llm_res": "oslo"}, generation)
+
+    assert cache.get("abc", "what is the capital of france ") == {"llm_res": "paris"}
+    assert cache.get("xyz", "what is the capital of france") == None
+
+    # Norway is the least recently used entry, so it is evicted.
+    cache.put("abc", "capital of denmark", {"llm_res": "copenhagen"}, generation)
+    assert cache.get("abc", "capital of norway") == None
+    assert cache.get("abc", "capital of france") == None
+    assert cache.get("abc", "what is the capital of france")["llm_res"] == "paris"
+
+    cache.invalidate("abc")
+    assert cache.get("abc", "what is the capital of france") == None
+
+    # Results from searches that started before the invalidation are dropped.
+    cache.put("abc", "capital of norway", {"llm_res": "oslo"}, generation)
+    assert cache.get("abc", "capital of norway") == None
+
+
+@pytest.mark.unit
+def test_invalidate_drops_dequeued_inserts(temp_share, monkeypatch):
+    import logging
+
+    from licensing.verify import verify_license
+    from llm_cache_job.cache import NDBSemanticCache
+
+    verify_license.verify_and_activate(
+        os.path.join(os.path.dirname(__file__), "../tests/ndb_enterprise_license.json")
+    )
+    monkeypatch.setenv("MODEL_BAZAAR_DIR", temp_share)
+    # The background thread does not flush the queue while the test runs.
+    monkeypatch.setenv("LLM_CACHE_INSERT_FLUSH_INTERVAL", "60")
+    cache = NDBSemanticCache(logging.getLogger("llm_cache"))
+    cache.insert("xyz", "what is the capital of norway", "oslo")
+    cache.flush()
+
+    # The background thread takes the insert off the queue, and the model is
+    # invalidated before the insert is written to the ndb.
+    cache.insert("abc", "what is the capital of france", "paris")
+    with cache.pending_inserts_cv:
+        batch, cache.pending_inserts = cache.pending_inserts, []
+    cache.invalidate("abc")
+    cache._insert_batch(batch)
+    assert cache.query("abc", "what is the capital of france") == None
+    assert cache.query("xyz", "what is the capital of norway")["llm_res"] == "oslo"
+
+    # Inserts queued after the invalidation are written.
+    cache.insert("abc", "what is the capital of france", "paris")
+    cache.flush()
+    assert cache.query("abc", "what is the capital of france")["llm_res"] == "paris"
+
+    cache.shutdown()
@@ -0,0 +1,169 @@
+import asyncio
+import os
+import time
+from typing import Dict
+
+from fastapi import HTTPException, status
+from fastapi.responses import StreamingResponse
+from prometheus_client import Counter, Gauge, Histogram
+
+inflight_streams_metric = Gauge(
+    "llm_dispatch_inflight_streams",
+    "Number of generation streams currently running.",
+    ["provider"],
+)
+queued_streams_metric = Gauge(
+    "llm_dispatch_queued_streams",
+    "Number of generation requests waiting for a stream slot.",
+    ["provider"],
+)
+queue_wait_metric = Histogram(
+    "llm_dispatch_queue_wait_seconds",
+    "Time generation requests spent waiting for a stream slot.",
+    ["provider"],
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+rejected_streams_metric = Counter(
+    "llm_dispatch_rejected_streams",
+    "Number of generation requests rejected because the provider was at capacity.",
+    ["provider", "reason"],
+)
+
+# llama.cpp serves a fixed number of parallel slots, so on-prem generation gets a
+# much lower default limit than the hosted providers.
+DEFAULT_MAX_CONCURRENT_STREAMS = {"on-prem": 8}
+
+
+def provider_env(provider: str, name: str, default: str) -> str:
+    """
+    Reads a per provider setting, e.g. LLM_DISPATCH_ON_PREM_MAX_CONCURRENT_STREAMS,
+    and falls back to the setting for all providers, e.g.
+    LLM_DISPATCH_MAX_CONCURRENT_STREAMS.
+    """
+    provider_key = provider.upper().replace("-", "_")
+    return os.getenv(
+        f"LLM_DISPATCH_{provider_key}_{name}",
+        os.getenv(f"LLM_DISPATCH_{name}", default),
+    )
+
+
+class StreamSlot:
+    def __init__(self, limiter: "ProviderLimiter"):
+        self.limiter = limiter
+        self.released = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.limiter.release()
+
+
+class ProviderLimiter:
+    """
+    Limits the number of concurrent generation streams for a provider. Requests
+    beyond the limit wait in a bounded queue, and are rejected immediately once
+    the queue is full, or after waiting for queue_timeout seconds. Failing fast
+    keeps latency bounded for the requests that are admitted instead of letting
+    every request slow down when the provider is overloaded.
+    """
+
+    def __init__(
+        self,
+        provider: str,
+        max_concurrent: int,
+        max_queued: int,
+        queue_timeout: float,
+    ):
+        self.provider = provider
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.queued = 0
+
+        self.inflight_metric = inflight_streams_metric.labels(provider)
+        self.queued_metric = queued_streams_metric.labels(provider)
+        self.queue_wait_metric = queue_wait_metric.labels(provider)
+
+    def reject(self, reason: str, detail: str) -> HTTPException:
+        rejected_streams_metric.labels(self.provider, reason).inc()
+        return HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=detail,
+            headers={"Retry-After": "1"},
+        )
+
+    async def acquire(self) -> StreamSlot:
+        start = time.perf_counter()
+        if self.semaphore.locked():
+            if self.queued >= self.max_queued:
+                raise self.reject(
+                    "queue_full",
+                    f"Too many concurrent generation requests for provider '{self.provider}'.",
+                )
+
+            self.queued += 1
+            self.queued_metric.inc()
+            try:
+                await asyncio.wait_for(
+                    self.semaphore.acquire(), timeout=self.queue_timeout
+                )
+            except asyncio.TimeoutError:
+                raise self.reject(
+                    "queue_timeout",
+                    f"Timed out waiting for capacity for provider '{self.provider}'.",
+                )
+            finally:
+                self.queued -= 1
+                self.queued_metric.dec()
+        else:
+            await self.semaphore.acquire()
+
+        self.queue_wait_metric.observe(time.perf_counter() - start)
+        self.inflight_metric.inc()
+        return StreamSlot(self)
+
+    def release(self) -> None:
+        self.inflight_metric.dec()
+        self.semaphore.release()
+
+
+class AdmissionController:
+    def __init__(self):
+        self.limiters: Dict[str, ProviderLimiter] = {}
+
+    def limiter(self, provider: str) -> ProviderLimiter:
+        if provider not in self.limiters:
+            self.limiters[provider] = ProviderLimiter(
+                provider=provider,
+                max_concurrent=int(
+                    provider_env(
+                        provider,
+                        "MAX_CONCURRENT_STREAMS",
+                        str(DEFAULT_MAX_CONCURRENT_STREAMS.get(provider, 256)),
+                    )
+                ),
+                max_queued=int(provider_env(provider, "MAX_QUEUED_STREAMS", "64")),
+                queue_timeout=float(provider_env(provider, "QUEUE_TIMEOUT_SEC", "30")),
+            )
+        return self.limiters[provider]
+
+    async def acquire(self, provider: str) -> StreamSlot:
+        return await self.limiter(provider).acquire()
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """
+    Streaming response that holds a stream slot until the response is finished,
+    including when the client disconnects or the stream fails.
+    """
+
+    def __init__(self, content, slot: StreamSlot, **kwargs):
+        super().__init__(content, **kwargs)
+        self.slot = slot
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.slot.release()
@@ -1,19 +1,105 @@
+import asyncio
 import json
 import os
+import time
 from abc import ABC, abstractmethod
-from typing import AsyncGenerator, List, Optional
+from collections import OrderedDict
+from typing import AsyncGenerator, Dict, List, Optional, Tuple
 from urllib.parse import urljoin
 
 import aiohttp
-import requests
 from fastapi import HTTPException
+from llm_dispatch_job.sse import SSEDecoder
 from llm_dispatch_job.utils import Reference, make_prompt
 
 
+class ClientSessions:
+    """
+    Long lived aiohttp sessions, one per provider, so that requests reuse pooled
+    keep-alive connections instead of paying for a new TCP and TLS handshake each
+    time. Sessions are created lazily since they are bound to the running event
+    loop.
+    """
+
+    def __init__(
+        self,
+        max_connections: int,
+        max_connections_per_host: int,
+        keepalive_timeout: float,
+    ):
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.sessions: Dict[
+            str, Tuple[asyncio.AbstractEventLoop, aiohttp.ClientSession]
+        ] = {}
+
+    def get(self, name: str) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        session_loop, session = self.sessions.get(name, (None, None))
+        if session is None or session.closed or session_loop is not loop:
+            if session is not None and not session.closed:
+                self.close_replaced(session_loop, session)
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                limit_per_host=self.max_connections_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300,
+            )
+            session = aiohttp.ClientSession(connector=connector)
+            self.sessions[name] = (loop, session)
+        return session
+
+    @staticmethod
+    def close_replaced(
+        loop: asyncio.AbstractEventLoop, session: aiohttp.ClientSession
+    ) -> None:
+        # A session can only be closed on the loop it is bound to. If that loop
+        # has stopped, its connections can no longer be closed cleanly, and are
+        # closed when the session is garbage collected.
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(session.close(), loop)
+
+    async def close(self) -> None:
+        for _, session in self.sessions.values():
+            await session.close()
+        self.sessions.clear()
+
+
+# The number of concurrent streams to each provider is limited by admission
+# control, so the connection pools are unlimited by default (a limit of 0) and
+# do not add a second, lower limit.
+client_sessions = ClientSessions(
+    max_connections=int(os.getenv("LLM_DISPATCH_MAX_CONNECTIONS", "0")),
+    max_connections_per_host=int(
+        os.getenv("LLM_DISPATCH_MAX_CONNECTIONS_PER_HOST", "0")
+    ),
+    keepalive_timeout=float(os.getenv("LLM_DISPATCH_KEEPALIVE_TIMEOUT", "60")),
+)
+
+
+async def sse_events(response: aiohttp.ClientResponse) -> AsyncGenerator[str, None]:
+    """
+    Yields the data of each server-sent event in the response as it arrives.
+    """
+    decoder = SSEDecoder()
+    async for chunk in response.content.iter_any():
+        for event in decoder.feed(chunk):
+            yield event
+    for event in decoder.close():
+        yield event
+
+
 class LLMBase(ABC):
+    provider: str
+
     def __init__(self, api_key: str):
         self.api_key = api_key
 
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        return client_sessions.get(self.provider)
+
     @abstractmethod
     async def stream(
         self,
@@ -26,6 +112,8 @@ class LLMBase(ABC):
 
 
 class OpenAILLM(LLMBase):
+    provider = "openai"
+
     def __init__(self, api_key: str):
         super().__init__(api_key)
         self.url = "https://api.openai.com/v1/chat/completions"
@@ -52,30 +140,23 @@ class OpenAILLM(LLMBase):
             ],
             "stream": True,
         }
-        async with aiohttp.ClientSession() as session:
-            async with session.post(self.url, headers=headers, json=body) as response:
-                if response.status == 200:
-                    async for multi_chunk_bytes, _ in response.content.iter_chunks():
-                        for chunk_string in multi_chunk_bytes.decode("utf8").split(
-                            "\n"
-                        ):
-                            if chunk_string == "":
-                                continue
-                            offset = len(
-                                "data: "
-                            )  # The chunk responses are prefixed with "data: "
-                            try:
-                                chunk = json.loads(chunk_string[offset:])
-                            except:
-                                continue
-                            content = (
-                                chunk["choices"][0].get("delta", {}).get("content")
-                            )
-                            if content is not None:
-                                yield content
+        async with self.session.post(self.url, headers=headers, json=body) as response:
+            if response.status == 200:
+                async for event in sse_events(response):
+                    if event == "[DONE]":
+                        break
+                    chunk = json.loads(event)
+                    if not chunk.get("choices"):
+                        # The final chunk may only contain usage statistics.
+                        continue
+                    content = chunk["choices"][0].get("delta", {}).get("content")
+                    if content is not None:
+                        yield content
 
 
 class CohereLLM(LLMBase):
+    provider = "cohere"
+
     def __init__(self, api_key: str):
         super().__init__(api_key)
         self.url = "https://api.cohere.com/v1/chat"
@@ -102,29 +183,30 @@ class CohereLLM(LLMBase):
             ],
             "stream": True,
         }
-        async with aiohttp.ClientSession() as session:
-            async with session.post(self.url, headers=headers, json=body) as response:
-                if response.status == 200:
-                    async for line in response.content:
-                        line = line.decode("utf8").strip()
-                        try:
-                            chunk = json.loads(line)
-                            if chunk.get(
-                                "event_type"
-                            ) == "text-generation" and not chunk.get("is_finished"):
-                                content = chunk.get("text")
-                                if content:
-                                    yield content
-                        except json.JSONDecodeError as e:
-                            raise Exception(f"Error decoding JSON response: {e}")
-                        except Exception as e:
-                            raise Exception(f"Error processing response chunk: {e}")
-                else:
-                    error_message = await response.text()
-                    raise Exception(f"Cohere API request failed: {error_message}")
+        async with self.session.post(self.url, headers=headers, json=body) as response:
+            if response.status == 200:
+                async for line in response.content:
+                    line = line.decode("utf8").strip()
+                    try:
+                        chunk = json.loads(line)
+                        if chunk.get(
+                            "event_type"
+                        ) == "text-generation" and not chunk.get("is_finished"):
+                            content = chunk.get("text")
+                            if content:
+                                yield content
+                    except json.JSONDecodeError as e:
+                        raise Exception(f"Error decoding JSON response: {e}")
+                    except Exception as e:
+                        raise Exception(f"Error processing response chunk: {e}")
+            else:
+                error_message = await response.text()
+                raise Exception(f"Cohere API request failed: {error_message}")
 
 
 class OnPremLLM(LLMBase):
+    provider = "on-prem"
+
     def __init__(self, api_key: str = None):
         super().__init__(api_key)
         self.backend_endpoint = os.getenv("MODEL_BAZAAR_ENDPOINT")
@@ -159,42 +241,70 @@ class OnPremLLM(LLMBase):
             # llama.cpp returns gpt-3.5-turbo for this value if not specified
             "model": model,
         }
-        async with aiohttp.ClientSession() as session:
-            async with session.post(self.url, headers=headers, json=data) as response:
-                if response.status != 200:
-                    raise Exception(
-                        f"Failed to connect to On Prem LLM server: {response.status}"
-                    )
-                async for line in response.content.iter_any():
-                    line = line.decode("utf-8").strip()
-                    if line and line.startswith("data: "):
-                        line = line[len("data: ") :]
-                        if "[DONE]" in line:
-                            break
-                        data = json.loads(line)
-                        yield data["choices"][0]["delta"]["content"]
+        async with self.session.post(self.url, headers=headers, json=data) as response:
+            if response.status != 200:
+                raise Exception(
+                    f"Failed to connect to On Prem LLM server: {response.status}"
+                )
+            async for event in sse_events(response):
+                if event == "[DONE]":
+                    break
+                data = json.loads(event)
+                content = data["choices"][0]["delta"].get("content")
+                if content is not None:
+                    yield content
 
 
 class SelfHostedLLM(OpenAILLM):
-    def __init__(self, access_token: str):
+    provider = "self-host"
+
+    def __init__(self, endpoint: str, api_key: str):
+        super().__init__(api_key)
+        self.url = endpoint
+
+    # Maps access tokens to the self-hosted endpoint config that was read with
+    # them and when it was read. The config is cached per token so that each
+    # token is still checked by the backend, just not on every request.
+    config_cache: OrderedDict[str, Tuple[float, dict]] = OrderedDict()
+    config_ttl_sec: float = float(os.getenv("SELF_HOSTED_CONFIG_TTL_SEC", "60"))
+    config_cache_size: int = 1024
+
+    @classmethod
+    async def load_config(cls, access_token: str) -> dict:
+        cached = cls.config_cache.get(access_token)
+        if cached is not None and time.monotonic() - cached[0] < cls.config_ttl_sec:
+            cls.config_cache.move_to_end(access_token)
+            return cached[1]
+
         # TODO(david) figure out another way for internal service to service
         # communication that doesn't require forwarding JWT access tokens
-        self.backend_endpoint = os.getenv("MODEL_BAZAAR_ENDPOINT")
-        response = requests.get(
-            urljoin(self.backend_endpoint, "/api/integrations/self-hosted-llm"),
+        backend_endpoint = os.getenv("MODEL_BAZAAR_ENDPOINT")
+        async with client_sessions.get("model-bazaar").get(
+            urljoin(backend_endpoint, "/api/integrations/self-hosted-llm"),
             headers={"Authorization": f"Bearer {access_token}"},
-        )
-        if response.status_code != 200:
-            raise Exception("Cannot read self-hosted endpoint.")
-        data = response.json()["data"]
-        self.url = data["endpoint"]
-        super().__init__(data["api_key"])
-
-        if self.url is None or self.api_key is None:
+        ) as response:
+            if response.status != 200:
+                cls.config_cache.pop(access_token, None)
+                raise Exception("Cannot read self-hosted endpoint.")
+            data = (await response.json())["data"]
+
+        cls.config_cache[access_token] = (time.monotonic(), data)
+        cls.config_cache.move_to_end(access_token)
+        while len(cls.config_cache) > cls.config_cache_size:
+            cls.config_cache.popitem(last=False)
+        return data
+
+    @classmethod
+    async def create(cls, access_token: str) -> "SelfHostedLLM":
+        data = await cls.load_config(access_token)
+
+        if data["endpoint"] is None or data["api_key"] is None:
             raise Exception(
                 "Self-hosted LLM may have been deleted or not configured. Please check the admin dashboard to configure the self-hosted llm"
             )
 
+        return cls(endpoint=data["endpoint"], api_key=data["api_key"])
+
 
 model_classes = {
     "openai": OpenAILLM,
@@ -204,9 +314,14 @@ model_classes = {
 
 
 class LLMFactory:
-    @staticmethod
-    def create(
-        provider: str, api_key: Optional[str], access_token: Optional[str], logger
+    # Providers hold no per-request state, so instances are reused across
+    # requests with the same provider and key.
+    instances: OrderedDict[tuple, LLMBase] = OrderedDict()
+    max_instances: int = 1024
+
+    @classmethod
+    async def create(
+        cls, provider: str, api_key: Optional[str], access_token: Optional[str], logger
     ):
         if provider in model_classes:
             if provider in ["openai", "cohere"] and api_key is None:
@@ -214,7 +329,16 @@ class LLMFactory:
                 raise HTTPException(
                     status_code=400, detail="No generative AI key provided"
                 )
-            return model_classes[provider](api_key=api_key)
+            model_class = model_classes[provider]
+            key = (model_class, api_key)
+            llm = cls.instances.get(key)
+            if llm is None:
+                llm = model_class(api_key=api_key)
+                cls.instances[key] = llm
+                while len(cls.instances) > cls.max_instances:
+                    cls.instances.popitem(last=False)
+            cls.instances.move_to_end(key)
+            return llm
 
         if provider == "self-host":
             if access_token is None:
@@ -223,7 +347,7 @@ class LLMFactory:
                     detail="Unauthorized. Need access token for self-hosted LLM",
                 )
 
-            return SelfHostedLLM(access_token=access_token)
+            return await SelfHostedLLM.create(access_token=access_token)
 
         logger.error(f"Unsupported provider '{provider.lower()}'")
         raise HTTPException(status_code=400, detail=f"Unsupported provider: {provider}")
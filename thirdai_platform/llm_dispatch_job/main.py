@@ -9,15 +9,17 @@ load_dotenv()
 
 import asyncio
 import os
-from typing import Optional
+from typing import Optional, Set
 from urllib.parse import urljoin
 
-import requests
+import aiohttp
 from fastapi import Depends, FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
-from llm_dispatch_job.llms import LLMBase, LLMFactory
+from fastapi.responses import JSONResponse
+from llm_dispatch_job.admission import AdmissionController, AdmittedStreamingResponse
+from llm_dispatch_job.llms import LLMBase, LLMFactory, client_sessions
 from llm_dispatch_job.utils import GenerateArgs
+from prometheus_client import make_asgi_app
 
 app = FastAPI()
 
@@ -29,12 +31,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.mount("/llm-dispatch/metrics", make_asgi_app())
+
 model_bazaar_dir = os.getenv("MODEL_BAZAAR_DIR")
 log_dir: Path = Path(model_bazaar_dir) / "logs"
 
 setup_logger(log_dir=log_dir, log_prefix="llm_generation")
 logger = logging.getLogger("llm_generation")
 
+admission_controller = AdmissionController()
+
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
@@ -110,6 +116,9 @@ async def generate(
     - HTTP 400:
         - No API key provided and no default key found for the provider.
         - Unsupported provider.
+    - HTTP 429:
+        - The provider is at its concurrent stream limit and its wait queue is full,
+          or the request timed out waiting in the queue.
     - HTTP 500:
         - Error during the text generation process.
 
@@ -117,20 +126,24 @@ async def generate(
     - If `original_query` and `cache_access_token` are provided, the generated content will be cached after completion.
     """
 
-    llm: LLMBase = LLMFactory.create(
+    llm: LLMBase = await LLMFactory.create(
         provider=generate_args.provider.lower(),
         api_key=generate_args.key,
         access_token=token,
         logger=logger,
     )
 
+    # Wait for a stream slot for the provider, or fail fast with a 429 if the
+    # provider's queue is full.
+    slot = await admission_controller.acquire(generate_args.provider.lower())
+
     logger.info(
         f"Received request from workflow: '{generate_args.workflow_id}'. "
         f"Starting generation with provider '{generate_args.provider.lower()}':",
     )
 
     async def generate_stream():
-        generated_response = ""
+        generated_chunks = []
         try:
             async for next_word in llm.stream(
                 query=generate_args.query,
@@ -138,7 +151,7 @@ async def generate(
                 references=generate_args.references,
                 model=generate_args.model,
             ):
-                generated_response += next_word
+                generated_chunks.append(next_word)
                 yield next_word
                 await asyncio.sleep(0)
             logger.info(
@@ -151,20 +164,33 @@ async def generate(
             )
         else:
             if generate_args.cache_access_token is not None:
-                await insert_into_cache(
-                    generate_args.query,
-                    generated_response,
-                    generate_args.cache_access_token,
+                # The insertion runs in the background so that the response stream
+                # can be closed without waiting on the cache.
+                task = asyncio.create_task(
+                    insert_into_cache(
+                        generate_args.query,
+                        "".join(generated_chunks),
+                        generate_args.cache_access_token,
+                    )
                 )
+                cache_insert_tasks.add(task)
+                task.add_done_callback(cache_insert_tasks.discard)
+
+    return AdmittedStreamingResponse(
+        generate_stream(), slot=slot, media_type="text/plain"
+    )
 
-    return StreamingResponse(generate_stream(), media_type="text/plain")
+
+# The event loop only keeps weak references to tasks, so references to pending
+# cache insertions are kept here until they complete.
+cache_insert_tasks: Set[asyncio.Task] = set()
 
 
 async def insert_into_cache(
     original_query: str, generated_response: str, cache_access_token: str
 ):
     try:
-        res = requests.post(
+        async with client_sessions.get("llm-cache").post(
             urljoin(os.environ["MODEL_BAZAAR_ENDPOINT"], "/cache/insert"),
             params={
                 "query": original_query,
@@ -173,13 +199,21 @@ async def insert_into_cache(
             headers={
                 "Authorization": f"Bearer {cache_access_token}",
             },
-        )
-        if res.status_code != 200:
-            logger.error(
-                f"LLM Cache Insertion failed with status {res.status_code}: {res.text}"
-            )
+            timeout=aiohttp.ClientTimeout(total=30),
+        ) as res:
+            if res.status != 200:
+                logger.error(
+                    f"LLM Cache Insertion failed with status {res.status}: {await res.text()}"
+                )
     except Exception as e:
-        logger.error("LLM Cache Insert Error", e)
+        logger.error(f"LLM Cache Insert Error: {e}")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if cache_insert_tasks:
+        await asyncio.gather(*cache_insert_tasks, return_exceptions=True)
+    await client_sessions.close()
 
 
 @app.get("/llm-dispatch/health")
@@ -0,0 +1,92 @@
+import codecs
+from typing import List
+
+
+class SSEDecoder:
+    """
+    Incremental decoder for server-sent events. Bytes from the response are fed
+    in as they arrive, and the data of each complete event is returned once the
+    blank line terminating it has been received. Partial lines and partial utf-8
+    characters are buffered until the rest of them arrive in a later chunk, so no
+    events are lost when the network splits a line across chunks.
+
+    https://html.spec.whatwg.org/multipage/server-sent-events.html#event-stream-interpretation
+    """
+
+    def __init__(self):
+        self.utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+        # Text of the line that is still being received.
+        self.partial_line = ""
+        # Data lines of the event that is still being received.
+        self.data_lines: List[str] = []
+        # Set if the previous chunk ended with '\r', in which case a '\n' at the
+        # start of the next chunk belongs to the same line ending.
+        self.skip_newline = False
+
+    def feed(self, chunk: bytes) -> List[str]:
+        """
+        Returns the data of each event that was completed by this chunk.
+        """
+        text = self.utf8_decoder.decode(chunk)
+        if not text:
+            return []
+        if self.skip_newline and text.startswith("\n"):
+            text = text[1:]
+        self.skip_newline = text.endswith("\r")
+
+        if "\r" in text:
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+        lines = text.split("\n")
+        if len(lines) == 1:
+            self.partial_line += lines[0]
+            return []
+
+        lines[0] = self.partial_line + lines[0]
+        self.partial_line = lines.pop()
+
+        events = []
+        for line in lines:
+            event = self._process_line(line)
+            if event is not None:
+                events.append(event)
+        return events
+
+    def close(self) -> List[str]:
+        """
+        Returns the data of the last event if the stream ended without the blank
+        line that should terminate it.
+        """
+        self.partial_line += self.utf8_decoder.decode(b"", final=True)
+        events = []
+        if self.partial_line:
+            self._process_line(self.partial_line)
+            self.partial_line = ""
+        if self.data_lines:
+            events.append("\n".join(self.data_lines))
+            self.data_lines = []
+        return events
+
+    def _process_line(self, line: str):
+        if line == "":
+            if not self.data_lines:
+                return None
+            data = "\n".join(self.data_lines)
+            self.data_lines = []
+            return data
+
+        if line.startswith("data: "):
+            self.data_lines.append(line[6:])
+            return None
+
+        if line.startswith(":"):
+            # Lines starting with ':' are comments, which are used as keep-alives.
+            return None
+
+        field, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+        if field == "data":
+            self.data_lines.append(value)
+        # Other fields such as 'event', 'id', and 'retry' are not used by the
+        # providers we stream from.
+        return None
@@ -54,6 +54,40 @@ def test_generate_text_stream(references, prompt):
         assert response.text == "This is a test."
 
 
+def test_generate_inserts_into_cache():
+    from llm_dispatch_job.main import app
+
+    client = TestClient(app)
+
+    async def mock_stream(*args, **kwargs):
+        yield "This "
+        yield "is "
+        yield "a test."
+
+    mock_llm_instance = AsyncMock()
+    mock_llm_instance.stream = mock_stream
+
+    mock_insert = AsyncMock()
+
+    with patch(
+        "llm_dispatch_job.llms.model_classes",
+        {"openai": lambda api_key: mock_llm_instance},
+    ), patch("llm_dispatch_job.main.insert_into_cache", mock_insert):
+        request_data = {
+            "query": "test query",
+            "provider": "openai",
+            "key": "dummy key",
+            "cache_access_token": "cache token",
+        }
+
+        response = client.post("/llm-dispatch/generate", json=request_data)
+
+        assert response.status_code == 200
+        assert response.text == "This is a test."
+
+    mock_insert.assert_awaited_once_with("test query", "This is a test.", "cache token")
+
+
 def test_missing_api_key():
     from llm_dispatch_job.main import app
 
@@ -104,3 +138,109 @@ def test_health_check():
     response = client.get("/llm-dispatch/health")
     assert response.status_code == 200
     assert response.json() == {"status": "healthy"}
+
+
+def test_llm_factory_reuses_providers():
+    import asyncio
+    import logging
+    import threading
+
+    from llm_dispatch_job.llms import ClientSessions, LLMFactory
+
+    async def create_llms():
+        logger = logging.getLogger("test")
+        llm_a = await LLMFactory.create("openai", "key a", None, logger)
+        llm_b = await LLMFactory.create("openai", "key a", None, logger)
+        llm_c = await LLMFactory.create("openai", "key b", None, logger)
+        return llm_a, llm_b, llm_c
+
+    llm_a, llm_b, llm_c = asyncio.run(create_llms())
+    assert llm_a is llm_b
+    assert llm_a is not llm_c
+
+    async def get_sessions():
+        sessions = ClientSessions(
+            max_connections=10, max_connections_per_host=0, keepalive_timeout=60
+        )
+        session_a = sessions.get("openai")
+        session_b = sessions.get("openai")
+        session_c = sessions.get("cohere")
+        await sessions.close()
+        return session_a, session_b, session_c
+
+    session_a, session_b, session_c = asyncio.run(get_sessions())
+    assert session_a is session_b
+    assert session_a is not session_c
+    assert session_a.closed and session_c.closed
+
+    # A session that is replaced because it is bound to another loop which is
+    # still running is closed on that loop.
+    sessions = ClientSessions(
+        max_connections=10, max_connections_per_host=0, keepalive_timeout=60
+    )
+    other_loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=other_loop.run_forever, daemon=True)
+    thread.start()
+
+    async def get_session():
+        return sessions.get("openai")
+
+    async def replace_session():
+        session = sessions.get("openai")
+        await sessions.close()
+        return session
+
+    async def is_closed(session):
+        return session.closed
+
+    try:
+        old_session = asyncio.run_coroutine_threadsafe(
+            get_session(), other_loop
+        ).result()
+        assert asyncio.run(replace_session()) is not old_session
+        assert asyncio.run_coroutine_threadsafe(
+            is_closed(old_session), other_loop
+        ).result()
+    finally:
+        other_loop.call_soon_threadsafe(other_loop.stop)
+        thread.join()
+        other_loop.close()
+
+
+def test_admission_control():
+    import asyncio
+
+    from fastapi import HTTPException
+    from llm_dispatch_job.admission import ProviderLimiter
+
+    async def run():
+        limiter = ProviderLimiter(
+            provider="test", max_concurrent=1, max_queued=1, queue_timeout=0.5
+        )
+
+        slot = await limiter.acquire()
+
+        # The second request waits in the queue, the third is rejected immediately.
+        queued = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0.01)
+        assert limiter.queued == 1
+
+        with pytest.raises(HTTPException) as error:
+            await limiter.acquire()
+        assert error.value.status_code == 429
+
+        slot.release()
+        # Releasing twice should not free up a second slot.
+        slot.release()
+        queued_slot = await queued
+        assert limiter.queued == 0
+
+        # The queued request times out if the slot isn't released.
+        with pytest.raises(HTTPException) as error:
+            await limiter.acquire()
+        assert error.value.status_code == 429
+
+        queued_slot.release()
+        (await limiter.acquire()).release()
+
+    asyncio.run(run())
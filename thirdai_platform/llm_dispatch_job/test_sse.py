@@ -0,0 +1,79 @@
+import json
+import random
+
+import pytest
+from llm_dispatch_job.sse import SSEDecoder
+
+pytestmark = [pytest.mark.unit]
+
+
+def record_openai_stream(tokens):
+    events = [
+        "data: "
+        + json.dumps({"choices": [{"delta": {"content": token}, "index": 0}]})
+        + "\n\n"
+        for token in tokens
+    ]
+    events.append("data: [DONE]\n\n")
+    return "".join(events).encode("utf-8")
+
+
+def decode(chunks):
+    decoder = SSEDecoder()
+    events = []
+    for chunk in chunks:
+        events.extend(decoder.feed(chunk))
+    events.extend(decoder.close())
+    return events
+
+
+def decoded_tokens(events):
+    assert events[-1] == "[DONE]"
+    return [
+        json.loads(event)["choices"][0]["delta"]["content"] for event in events[:-1]
+    ]
+
+
+TOKENS = ["Hello", " wörld", ", ", "this", " is", " a", " tést", " 😀", "\n", "."]
+
+
+def test_sse_decoder_every_split_point():
+    stream = record_openai_stream(TOKENS)
+
+    for split in range(len(stream) + 1):
+        events = decode([stream[:split], stream[split:]])
+        assert decoded_tokens(events) == TOKENS
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_sse_decoder_random_fragments(seed):
+    stream = record_openai_stream(TOKENS * 20)
+
+    rng = random.Random(seed)
+    chunks = []
+    pos = 0
+    while pos < len(stream):
+        size = rng.randint(1, 16)
+        chunks.append(stream[pos : pos + size])
+        pos += size
+
+    assert decoded_tokens(decode(chunks)) == TOKENS * 20
+
+
+def test_sse_decoder_line_endings_and_fields():
+    stream = (
+        b": keep-alive\r\n\r\n"
+        b"event: message\r\n"
+        b"data: first\r\n"
+        b"data:second\r\n"
+        b"\r\n"
+        b"id: 1\n"
+        b"data: third\r"
+        b"\r"
+        b"data: fourth"
+    )
+
+    expected = ["first\nsecond", "third", "fourth"]
+
+    assert decode([stream]) == expected
+    assert decode([stream[i : i + 1] for i in range(len(stream))]) == expected
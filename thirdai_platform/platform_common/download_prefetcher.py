@@ -0,0 +1,214 @@
+import logging
+import os
+import shutil
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Deque, Iterable, Iterator, Optional, Set, Tuple
+
+from platform_common import file_ops
+from platform_common.file_handler import download_file, get_cloud_client
+from platform_common.pydantic_models.training import FileInfo, FileLocation
+
+CLOUD_LOCATIONS = {FileLocation.s3, FileLocation.azure, FileLocation.gcp}
+
+
+class DownloadPrefetcher:
+    """
+    Downloads cloud files ahead of the consumer which is parsing them, so that
+    ingesting many small objects is limited by bandwidth instead of the latency
+    of each download.
+
+    Iterating over the prefetcher yields (file, local_path) in the order of the
+    input files. local_path is None for files which are not in cloud storage,
+    or if the download failed. Files are downloaded up to prefetch files ahead of
+    the consumer by download_threads threads, which share the process-wide client
+    for each cloud provider.
+
+    The consumer must call release() once it is done with each yielded file, in
+    order, which deletes the downloaded copy. At most max_outstanding files are
+    yielded and not yet released, and no new downloads are started while the
+    downloaded files that have not been released take up more than staging_bytes
+    on disk, so the budget is exceeded by at most download_threads files.
+
+    close() must be called once the consumer stops iterating, including if it
+    stops early because of an error. It stops the iterator and the downloads,
+    and deletes all of the downloaded files, without waiting for the downloads
+    that are in progress.
+    """
+
+    def __init__(
+        self,
+        files: Iterable[FileInfo],
+        tmp_dir: str,
+        max_outstanding: int,
+        download_threads: int = 8,
+        prefetch: int = 32,
+        staging_bytes: int = 2 * 1024 * 1024 * 1024,
+    ):
+        self.files = files
+        self.tmp_dir = tmp_dir
+        self.max_outstanding = max(max_outstanding, 1)
+        self.download_threads = download_threads
+        self.prefetch = max(prefetch, 1)
+        self.staging_bytes = staging_bytes
+
+        self.condition = threading.Condition()
+        # Paths and sizes of the files that are yielded and not yet released.
+        self.yielded: Deque[Tuple[Optional[str], int]] = deque()
+        self.staged_bytes = 0
+        self.next_download = 0
+        # Directories of the downloads that have started and not been deleted.
+        self.staged_dirs: Set[str] = set()
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.closed = False
+
+    def download(self, file: FileInfo, seq: int) -> Tuple[Optional[str], int]:
+        # Downloads start in order, so that a file which has to be yielded before
+        # the staged files can be released is never waiting behind them.
+        with self.condition:
+            while not self.closed and (
+                seq != self.next_download or self.staged_bytes >= self.staging_bytes
+            ):
+                self.condition.wait()
+            if self.closed:
+                return None, 0
+            self.next_download += 1
+            self.condition.notify_all()
+
+            # Each file is downloaded into its own directory so that objects with
+            # the same name in different buckets or prefixes do not overwrite each
+            # other.
+            download_dir = os.path.join(self.tmp_dir, f"prefetch-{uuid.uuid4()}")
+            self.staged_dirs.add(download_dir)
+
+        local_path, size = None, 0
+        try:
+            os.makedirs(download_dir, exist_ok=True)
+            path = download_file(
+                file,
+                download_dir,
+                client=get_cloud_client(provider=file.location.value),
+            )
+            if path:
+                # The downloaded copy is deleted once it is parsed, so it is not
+                # synced.
+                file_ops.clear_cache(path, sync=False)
+                local_path, size = path, os.path.getsize(path)
+        finally:
+            with self.condition:
+                # Downloads which finish after the prefetcher is closed are not
+                # yielded, so they are deleted here.
+                if local_path and not self.closed:
+                    self.staged_bytes += size
+                else:
+                    local_path, size = None, 0
+                    self.staged_dirs.discard(download_dir)
+            if not local_path:
+                shutil.rmtree(download_dir, ignore_errors=True)
+
+        return local_path, size
+
+    def release(self) -> None:
+        """
+        Marks the oldest yielded file that has not been released as done, and
+        removes its downloaded copy if it still exists.
+        """
+        with self.condition:
+            if not self.yielded:
+                # The prefetcher was closed, which deleted the downloaded files.
+                return
+            local_path, size = self.yielded.popleft()
+            self.staged_bytes -= size
+            if local_path:
+                self.staged_dirs.discard(os.path.dirname(local_path))
+            self.condition.notify_all()
+        if local_path:
+            shutil.rmtree(os.path.dirname(local_path), ignore_errors=True)
+
+    def close(self) -> None:
+        """
+        Stops the iterator and the downloads that have not started, and deletes
+        the downloaded files. Downloads that are in progress are not waited for,
+        they delete their files once they finish.
+        """
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify_all()
+            executor = self.executor
+            staged_dirs = list(self.staged_dirs)
+            self.staged_dirs.clear()
+            self.yielded.clear()
+            self.staged_bytes = 0
+
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+        for download_dir in staged_dirs:
+            shutil.rmtree(download_dir, ignore_errors=True)
+
+    def notify(self, future: Future) -> None:
+        with self.condition:
+            self.condition.notify_all()
+
+    def __iter__(self) -> Iterator[Tuple[FileInfo, Optional[str]]]:
+        pending: Deque[Tuple[FileInfo, Optional[Future]]] = deque()
+        files = iter(self.files)
+        n_downloads = 0
+
+        executor = ThreadPoolExecutor(
+            max_workers=self.download_threads, thread_name_prefix="prefetch"
+        )
+        with self.condition:
+            self.executor = executor
+
+        try:
+            while True:
+                while len(pending) < self.prefetch:
+                    file = next(files, None)
+                    if file is None:
+                        break
+                    future = None
+                    # Submitted while holding the condition so that downloads are
+                    # never submitted after close() shuts down the executor.
+                    with self.condition:
+                        if self.closed:
+                            return
+                        if file.location in CLOUD_LOCATIONS:
+                            future = executor.submit(self.download, file, n_downloads)
+                            future.add_done_callback(self.notify)
+                            n_downloads += 1
+                    pending.append((file, future))
+
+                if not pending:
+                    return
+
+                file, future = pending.popleft()
+                local_path, size = None, 0
+                if future is not None:
+                    # Waits on the condition instead of the future so that the
+                    # iterator stops once the prefetcher is closed, even if the
+                    # download is still in progress.
+                    with self.condition:
+                        while not future.done() and not self.closed:
+                            self.condition.wait()
+                        if self.closed:
+                            return
+                    try:
+                        local_path, size = future.result()
+                    except Exception as e:
+                        logging.error(f"Error prefetching {file.path}: {e}")
+
+                with self.condition:
+                    while len(self.yielded) >= self.max_outstanding and not self.closed:
+                        self.condition.wait()
+                    if self.closed:
+                        # The downloaded file was deleted by close().
+                        return
+                    self.yielded.append((local_path, size))
+
+                yield file, local_path
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
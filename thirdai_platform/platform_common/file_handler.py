@@ -1,17 +1,46 @@
+import hashlib
+import itertools
 import logging
 import os
+import queue
+import threading
+import time
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from functools import wraps
-from typing import List
+from functools import partial, wraps
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import boto3
+import requests
 from botocore.client import Config
 from botocore.exceptions import ClientError
 from fastapi import HTTPException, UploadFile, status
 from platform_common import file_ops
 from platform_common.pydantic_models.training import FileInfo, FileLocation
 
+# Size of the chunks that uploaded files are copied to disk in.
+UPLOAD_COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def save_upload_file(
+    upload_file: UploadFile, destination_path: str, hash_algorithm: Optional[str] = None
+) -> Optional[str]:
+    """
+    Copies an uploaded file to destination_path in chunks, so that the memory used
+    does not depend on the size of the upload. If hash_algorithm is given, e.g.
+    "sha256", the contents are hashed as they are copied and the hex digest is
+    returned.
+    """
+    hasher = hashlib.new(hash_algorithm) if hash_algorithm else None
+    with open(destination_path, "wb") as f:
+        while chunk := upload_file.file.read(UPLOAD_COPY_CHUNK_SIZE):
+            f.write(chunk)
+            if hasher:
+                hasher.update(chunk)
+    return hasher.hexdigest() if hasher else None
+
 
 def download_local_file(file_info: FileInfo, upload_file: UploadFile, dest_dir: str):
     assert upload_file is not None
@@ -19,8 +48,7 @@ def download_local_file(file_info: FileInfo, upload_file: UploadFile, dest_dir:
     # Create the destination path preserving the directory structure
     destination_path = os.path.join(dest_dir, upload_file.filename)
     os.makedirs(os.path.dirname(destination_path), exist_ok=True)
-    with open(destination_path, "wb") as f:
-        f.write(upload_file.file.read())
+    save_upload_file(upload_file, destination_path)
     upload_file.file.close()
     return destination_path
 
@@ -45,7 +73,7 @@ def download_local_files(
                     ),
                     dest_dir=dest_dir,
                 )
-                file_ops.clear_cache(local_path)
+                file_ops.clear_cache(local_path, sync=False)
             except Exception as error:
                 raise ValueError(
                     f"Error processing file '{file_info.path}' from '{file_info.location}': {error}"
@@ -62,6 +90,9 @@ def download_local_files(
         else:
             all_files.append(file_info)
 
+    # The uploaded files are synced together instead of one at a time.
+    file_ops.sync_barrier([dest_dir])
+
     return all_files
 
 
@@ -78,14 +109,111 @@ def expand_file_info(paths: List[str], file_info: FileInfo):
     ]
 
 
+def iter_expanded_file_info(
+    paths: Iterable[str], file_info: FileInfo
+) -> Iterator[FileInfo]:
+    """
+    Lazy version of expand_file_info. Only the first two paths are read before
+    yielding, to check if the source_id can be kept.
+    """
+    paths = iter(paths)
+    first_paths = list(itertools.islice(paths, 2))
+    yield from expand_file_info(paths=first_paths, file_info=file_info)
+    for path in paths:
+        yield FileInfo(
+            path=path,
+            location=file_info.location,
+            source_id=None,
+            options=file_info.options,
+            metadata=file_info.metadata,
+        )
+
+
+# Number of threads used to list the prefixes of a bucket or the directories of
+# an NFS path in parallel.
+LISTING_THREADS = int(os.getenv("LISTING_THREADS", "16"))
+
+
+def walk_prefixes(
+    list_prefix: Callable[[str], Iterable[Tuple[List[str], List[str]]]],
+    root: str,
+    max_workers: int = LISTING_THREADS,
+    max_buffered_pages: int = 64,
+) -> Iterator[str]:
+    """
+    Lists all files under root. list_prefix(prefix) yields pages of
+    (files, sub_prefixes) directly under the prefix, and the sub prefixes are
+    listed concurrently on a pool of threads. Files are yielded as soon as the
+    page containing them is listed, in no particular order. At most
+    max_buffered_pages pages are listed and not yet consumed.
+    """
+    results = queue.Queue(maxsize=max_buffered_pages)
+    cancelled = threading.Event()
+
+    def put(item):
+        while not cancelled.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def list_one(prefix: str):
+        try:
+            for files, sub_prefixes in list_prefix(prefix):
+                if cancelled.is_set():
+                    return
+                for sub_prefix in sub_prefixes:
+                    put(("prefix", sub_prefix))
+                put(("files", files))
+        except Exception as e:
+            put(("error", e))
+        finally:
+            put(("done", None))
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="list")
+    try:
+        executor.submit(list_one, root)
+        outstanding = 1
+        while outstanding:
+            kind, value = results.get()
+            if kind == "files":
+                yield from value
+            elif kind == "prefix":
+                executor.submit(list_one, value)
+                outstanding += 1
+            elif kind == "done":
+                outstanding -= 1
+            else:
+                raise value
+    finally:
+        # If the consumer stops early or listing fails, the queued prefixes are
+        # not listed, and the running listings stop after their current page.
+        cancelled.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def list_nfs_dir(path: str) -> Iterator[Tuple[List[str], List[str]]]:
+    files, sub_dirs = [], []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                # Like os.walk, symlinks to directories are not followed.
+                if not entry.is_symlink():
+                    sub_dirs.append(entry.path)
+            else:
+                files.append(entry.path)
+    yield files, sub_dirs
+
+
 def list_files_in_nfs_dir(path: str):
+    return list(iter_files_in_nfs_dir(path))
+
+
+def iter_files_in_nfs_dir(path: str) -> Iterator[str]:
     if os.path.isdir(path):
-        return [
-            os.path.join(root, file)
-            for root, _, files_in_dir in os.walk(path)
-            for file in files_in_dir
-        ]
-    return [path]
+        return walk_prefixes(list_nfs_dir, path)
+    return iter([path])
 
 
 def expand_cloud_buckets_and_directories(file_infos: List[FileInfo]) -> List[FileInfo]:
@@ -98,57 +226,75 @@ def expand_cloud_buckets_and_directories(file_infos: List[FileInfo]) -> List[Fil
     is an s3 bucket with N documents in it, then this will replace it with N file infos,
     one per document in the bucket.
     """
-    expanded_files = []
+    return list(iter_expanded_cloud_buckets_and_directories(file_infos))
+
+
+def iter_expanded_cloud_buckets_and_directories(
+    file_infos: Iterable[FileInfo],
+) -> Iterator[FileInfo]:
+    """
+    Lazy version of expand_cloud_buckets_and_directories, which yields the files
+    in each bucket or directory while it is still being listed, so that they can
+    be processed without waiting for the whole listing. The files within a bucket
+    or directory are not yielded in any particular order.
+    """
     for file_info in file_infos:
         if file_info.location == FileLocation.local:
-            expanded_files.append(file_info)
+            yield file_info
         elif file_info.location == FileLocation.s3:
             s3_client = get_cloud_client(provider="s3")
             bucket_name, source_path = file_info.parse_s3_url()
-            s3_objects = s3_client.list_files(
+            s3_objects = s3_client.iter_files(
                 bucket_name=bucket_name, source_path=source_path
             )
-            expanded_files.extend(
-                expand_file_info(paths=s3_objects, file_info=file_info)
-            )
+            yield from iter_expanded_file_info(paths=s3_objects, file_info=file_info)
         elif file_info.location == FileLocation.azure:
             azure_client = get_cloud_client(provider="azure")
             container_name, blob_path = file_info.parse_azure_url()
-            azure_objects = azure_client.list_files(
+            azure_objects = azure_client.iter_files(
                 bucket_name=container_name, source_path=blob_path
             )
-            expanded_files.extend(
-                expand_file_info(
-                    paths=[
-                        azure_client.full_path(
-                            bucket_name=container_name, source_path=azure_object
-                        )
-                        for azure_object in azure_objects
-                    ],
-                    file_info=file_info,
-                )
+            yield from iter_expanded_file_info(
+                paths=(
+                    azure_client.full_path(
+                        bucket_name=container_name, source_path=azure_object
+                    )
+                    for azure_object in azure_objects
+                ),
+                file_info=file_info,
             )
         elif file_info.location == FileLocation.gcp:
             gcp_client = get_cloud_client(provider="gcp")
             bucket_name, source_path = file_info.parse_gcp_url()
-            gcp_objects = gcp_client.list_files(bucket_name, source_path)
-            expanded_files.extend(
-                expand_file_info(
-                    paths=[
-                        gcp_client.full_path(
-                            bucket_name=bucket_name, source_path=gcp_object
-                        )
-                        for gcp_object in gcp_objects
-                    ],
-                    file_info=file_info,
-                )
+            gcp_objects = gcp_client.iter_files(bucket_name, source_path)
+            yield from iter_expanded_file_info(
+                paths=(
+                    gcp_client.full_path(
+                        bucket_name=bucket_name, source_path=gcp_object
+                    )
+                    for gcp_object in gcp_objects
+                ),
+                file_info=file_info,
             )
         elif file_info.location == FileLocation.nfs:
-            directory_files = list_files_in_nfs_dir(file_info.path)
-            expanded_files.extend(
-                expand_file_info(paths=directory_files, file_info=file_info)
+            directory_files = iter_files_in_nfs_dir(file_info.path)
+            yield from iter_expanded_file_info(
+                paths=directory_files, file_info=file_info
             )
-    return expanded_files
+
+
+def raise_handled_exception(func, args, kwargs, e: Exception):
+    class_name = args[0].__class__.__name__ if args else "UnknownClass"
+    method_name = func.__name__
+    logging.error(
+        f"Error in class '{class_name}', method '{method_name}' "
+        f"with arguments {args[1:]}, and keyword arguments {kwargs}. "
+        f"Error: {str(e)}"
+    )
+    raise HTTPException(
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        detail=f"An error occurred: {str(e)}",
+    )
 
 
 def handle_exceptions(func):
@@ -157,21 +303,36 @@ def handle_exceptions(func):
         try:
             return func(*args, **kwargs)
         except Exception as e:
-            class_name = args[0].__class__.__name__ if args else "UnknownClass"
-            method_name = func.__name__
-            logging.error(
-                f"Error in class '{class_name}', method '{method_name}' "
-                f"with arguments {args[1:]}, and keyword arguments {kwargs}. "
-                f"Error: {str(e)}"
-            )
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"An error occurred: {str(e)}",
-            )
+            raise_handled_exception(func, args, kwargs, e)
+
+    return wrapper
+
+
+def handle_iterator_exceptions(func):
+    """
+    Version of handle_exceptions for methods that return iterators, which also
+    handles the errors raised while the iterator is consumed.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            yield from func(*args, **kwargs)
+        except Exception as e:
+            raise_handled_exception(func, args, kwargs, e)
 
     return wrapper
 
 
+def pooled_session(max_pool_connections: int) -> requests.Session:
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=max_pool_connections, pool_maxsize=max_pool_connections
+    )
+    session.mount("https://", adapter)
+    return session
+
+
 class CloudStorageHandler(ABC):
     """
     Interface for Cloud Storage Handlers.
@@ -202,6 +363,10 @@ class CloudStorageHandler(ABC):
     def list_files(self, bucket_name: str, source_path: str):
         pass
 
+    @abstractmethod
+    def iter_files(self, bucket_name: str, source_path: str) -> Iterator[str]:
+        pass
+
     @abstractmethod
     def delete_bucket(self, bucket_name: str):
         pass
@@ -221,17 +386,26 @@ class S3StorageHandler(CloudStorageHandler):
     """
 
     def __init__(
-        self, aws_access_key=None, aws_secret_access_key=None, region_name=None
+        self,
+        aws_access_key=None,
+        aws_secret_access_key=None,
+        region_name=None,
+        max_pool_connections=None,
     ):
         self.s3_client = self.create_s3_client(
             aws_access_key=aws_access_key,
             aws_secret_access_key=aws_secret_access_key,
             region_name=region_name,
+            max_pool_connections=max_pool_connections,
         )
 
     @handle_exceptions
     def create_s3_client(
-        self, aws_access_key=None, aws_secret_access_key=None, region_name=None
+        self,
+        aws_access_key=None,
+        aws_secret_access_key=None,
+        region_name=None,
+        max_pool_connections=None,
     ):
         # TODO(YASH): Customers will also have rotating aws session token so add that support.
         # https://docs.aws.amazon.com/sdk-for-php/v3/developer-guide/guide_credentials_environment.html
@@ -240,6 +414,7 @@ class S3StorageHandler(CloudStorageHandler):
                 retries={"max_attempts": 10, "mode": "standard"},
                 connect_timeout=5,
                 read_timeout=60,
+                max_pool_connections=max_pool_connections or 10,
             )
             s3_client = boto3.client("s3", config=config)
         else:
@@ -248,6 +423,7 @@ class S3StorageHandler(CloudStorageHandler):
                 connect_timeout=5,
                 read_timeout=60,
                 signature_version="s3v4",
+                max_pool_connections=max_pool_connections or 10,
             )
             s3_client = boto3.client(
                 "s3",
@@ -344,6 +520,28 @@ class S3StorageHandler(CloudStorageHandler):
         ]
         return file_keys
 
+    def list_prefix(
+        self, bucket_name: str, prefix: str
+    ) -> Iterator[Tuple[List[str], List[str]]]:
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        pages = paginator.paginate(Bucket=bucket_name, Prefix=prefix, Delimiter="/")
+        for page in pages:
+            files = [
+                f"s3://{bucket_name}/{obj['Key']}"
+                for obj in page.get("Contents", [])
+                if obj["Key"][-1] != "/"
+            ]
+            sub_prefixes = [p["Prefix"] for p in page.get("CommonPrefixes", [])]
+            yield files, sub_prefixes
+
+    @handle_iterator_exceptions
+    def iter_files(self, bucket_name: str, source_path: str) -> Iterator[str]:
+        """
+        Lazy version of list_files, which lists the "directories" under the path
+        in parallel. Files are not yielded in any particular order.
+        """
+        return walk_prefixes(partial(self.list_prefix, bucket_name), source_path)
+
     @handle_exceptions
     def delete_bucket(self, bucket_name: str):
         # List all objects in the bucket and delete them
@@ -404,26 +602,38 @@ class S3StorageHandler(CloudStorageHandler):
 
 
 class AzureStorageHandler(CloudStorageHandler):
-    def __init__(self, account_name=None, account_key=None):
+    def __init__(self, account_name=None, account_key=None, max_pool_connections=None):
         self._blob_service_client = self.create_azure_client(
-            account_name=account_name, account_key=account_key
+            account_name=account_name,
+            account_key=account_key,
+            max_pool_connections=max_pool_connections,
         )
         self._account_name = account_name
 
     @handle_exceptions
-    def create_azure_client(self, account_name=None, account_key=None):
+    def create_azure_client(
+        self, account_name=None, account_key=None, max_pool_connections=None
+    ):
         from azure.storage.blob import BlobServiceClient
 
+        kwargs = {}
+        if max_pool_connections:
+            from azure.core.pipeline.transport import RequestsTransport
+
+            kwargs["transport"] = RequestsTransport(
+                session=pooled_session(max_pool_connections)
+            )
+
         if account_name and account_key:
             # Authenticated access
             connection_string = f"DefaultEndpointsProtocol=https;AccountName={account_name};AccountKey={account_key};EndpointSuffix=core.windows.net"
             blob_service_client = BlobServiceClient.from_connection_string(
-                conn_str=connection_string
+                conn_str=connection_string, **kwargs
             )
         elif account_name:
             # Anonymous (public) access using account_url
             account_url = f"https://{account_name}.blob.core.windows.net"
-            blob_service_client = BlobServiceClient(account_url=account_url)
+            blob_service_client = BlobServiceClient(account_url=account_url, **kwargs)
         else:
             raise ValueError("Account name is required for Azure Blob Storage.")
 
@@ -500,6 +710,15 @@ class AzureStorageHandler(CloudStorageHandler):
         blob_names = [blob.name for blob in blobs]
         return blob_names
 
+    @handle_iterator_exceptions
+    def iter_files(self, bucket_name: str, source_path: str) -> Iterator[str]:
+        """
+        Lazy version of list_files, which yields the blobs one page at a time.
+        """
+        container_client = self.container_client(bucket_name=bucket_name)
+        for page in container_client.list_blobs(name_starts_with=source_path).by_page():
+            yield from (blob.name for blob in page)
+
     @handle_exceptions
     def delete_bucket(self, bucket_name: str):
         container_client = self.container_client(bucket_name)
@@ -559,7 +778,9 @@ class AzureStorageHandler(CloudStorageHandler):
 
 
 class GCPStorageHandler(CloudStorageHandler):
-    def __init__(self, credentials_file_path: str = None):
+    def __init__(
+        self, credentials_file_path: str = None, max_pool_connections: int = None
+    ):
         from google.cloud import storage
 
         if credentials_file_path:
@@ -578,6 +799,11 @@ class GCPStorageHandler(CloudStorageHandler):
         else:
             self._client = storage.Client.create_anonymous_client()
 
+        if max_pool_connections:
+            self._client._http.mount(
+                "https://", pooled_session(max_pool_connections).get_adapter("https://")
+            )
+
     @handle_exceptions
     def create_bucket_if_not_exists(self, bucket_name: str):
         bucket = self._client.lookup_bucket(bucket_name)
@@ -638,6 +864,22 @@ class GCPStorageHandler(CloudStorageHandler):
         blob_names = [blob.name for blob in blobs if not blob.name.endswith("/")]
         return blob_names
 
+    def list_prefix(
+        self, bucket_name: str, prefix: str
+    ) -> Iterator[Tuple[List[str], List[str]]]:
+        blobs = self._client.list_blobs(bucket_name, prefix=prefix, delimiter="/")
+        for page in blobs.pages:
+            files = [blob.name for blob in page if not blob.name.endswith("/")]
+            yield files, list(page.prefixes)
+
+    @handle_iterator_exceptions
+    def iter_files(self, bucket_name: str, source_path: str) -> Iterator[str]:
+        """
+        Lazy version of list_files, which lists the "directories" under the path
+        in parallel. Files are not yielded in any particular order.
+        """
+        return walk_prefixes(partial(self.list_prefix, bucket_name), source_path)
+
     @handle_exceptions
     def delete_bucket(self, bucket_name: str):
         bucket = self._client.bucket(bucket_name)
@@ -702,38 +944,144 @@ class GCPStorageHandler(CloudStorageHandler):
         )
 
 
-# TODO( YASH): Configure these variables through api endpoints, so that users can change through course of time.
-def get_cloud_client(provider: str):
+# Size of the connection pool of each cloud client, which is shared by all the
+# threads of the process using the client.
+CLOUD_CLIENT_MAX_CONNECTIONS = int(os.getenv("CLOUD_CLIENT_MAX_CONNECTIONS", "32"))
+
+
+def cloud_client_credentials(provider: str) -> Tuple:
+    if provider == "s3":
+        return (
+            os.getenv("AWS_ACCESS_KEY", None),
+            os.getenv("AWS_ACCESS_SECRET", None),
+            os.getenv("AWS_REGION_NAME", None) or None,
+        )
+    elif provider == "azure":
+        return (
+            os.getenv("AZURE_ACCOUNT_NAME", None),
+            os.getenv("AZURE_ACCOUNT_KEY", None),
+        )
+    elif provider == "gcp":
+        return (os.getenv("GCP_CREDENTIALS_FILE", None),)
+    else:
+        raise ValueError(
+            f"Currently supports s3,azure and gcp, but received {provider}"
+        )
+
+
+def create_cloud_client(provider: str, credentials: Tuple) -> CloudStorageHandler:
     if provider == "s3":
-        aws_access_key = os.getenv("AWS_ACCESS_KEY", None)
-        aws_secret_access_key = os.getenv("AWS_ACCESS_SECRET", None)
-        region_name = os.getenv("AWS_REGION_NAME", None) or None
+        aws_access_key, aws_secret_access_key, region_name = credentials
         return S3StorageHandler(
             aws_access_key=aws_access_key,
             aws_secret_access_key=aws_secret_access_key,
             region_name=region_name,
+            max_pool_connections=CLOUD_CLIENT_MAX_CONNECTIONS,
         )
     elif provider == "azure":
-        account_name = os.getenv("AZURE_ACCOUNT_NAME", None)
-        account_key = os.getenv("AZURE_ACCOUNT_KEY", None)
-        return AzureStorageHandler(account_name=account_name, account_key=account_key)
-    elif provider == "gcp":
-        gcp_credentials_file = os.getenv("GCP_CREDENTIALS_FILE", None)
-        return GCPStorageHandler(credentials_file_path=gcp_credentials_file)
+        account_name, account_key = credentials
+        return AzureStorageHandler(
+            account_name=account_name,
+            account_key=account_key,
+            max_pool_connections=CLOUD_CLIENT_MAX_CONNECTIONS,
+        )
     else:
-        raise ValueError(
-            f"Currently supports s3,azure and gcp, but received {provider}"
+        (gcp_credentials_file,) = credentials
+        return GCPStorageHandler(
+            credentials_file_path=gcp_credentials_file,
+            max_pool_connections=CLOUD_CLIENT_MAX_CONNECTIONS,
         )
 
 
-def download_file(doc: FileInfo, tmp_dir: str):
+_cloud_clients: Dict[Tuple, CloudStorageHandler] = {}
+_cloud_clients_lock = threading.Lock()
+
+
+def _reset_cloud_clients():
+    # Clients hold open connections, so they are not shared with forked
+    # processes, e.g. the workers of a document parsing pool.
+    global _cloud_clients_lock
+    _cloud_clients.clear()
+    _cloud_clients_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_cloud_clients)
+
+
+# TODO( YASH): Configure these variables through api endpoints, so that users can change through course of time.
+def get_cloud_client(provider: str) -> CloudStorageHandler:
+    """
+    Returns the client for the provider, which is created on first use and then
+    shared by the whole process. Clients are keyed by the credentials in the
+    environment, so a new client is created if they change.
+    """
+    key = (provider, *cloud_client_credentials(provider))
+    with _cloud_clients_lock:
+        if key not in _cloud_clients:
+            _cloud_clients[key] = create_cloud_client(provider, key[1:])
+        return _cloud_clients[key]
+
+
+class SignedUrlCache:
+    """
+    Caches the signed URLs generated for sources so that repeated requests for a
+    document reuse its URL instead of signing a new one. A URL is reused until
+    less than half of its validity remains, so returned URLs are always valid for
+    at least half of the requested expiry.
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_or_create(
+        self, key: Tuple, expiry_mins: int, create: Callable[[], str]
+    ) -> str:
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > now:
+                self.entries.move_to_end(key)
+                return entry[0]
+
+        url = create()
+
+        with self.lock:
+            self.entries[key] = (url, now + expiry_mins * 60 / 2)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return url
+
+
+_signed_urls = SignedUrlCache()
+
+
+def generate_signed_url_from_source(
+    provider: str, source: str, expiry_mins: int = 15
+) -> str:
+    key = (provider, *cloud_client_credentials(provider), source, expiry_mins)
+    return _signed_urls.get_or_create(
+        key,
+        expiry_mins=expiry_mins,
+        create=lambda: get_cloud_client(provider).generate_url_from_source(
+            source=source, expiry_mins=expiry_mins
+        ),
+    )
+
+
+def download_file(
+    doc: FileInfo, tmp_dir: str, client: Optional[CloudStorageHandler] = None
+):
     """
     General method to download a file from S3, Azure, or GCP to a temporary directory.
+    A client for the file's provider can be passed in to reuse it across downloads.
     """
     local_file_path = None
 
     if doc.location == FileLocation.s3:
-        s3_client = get_cloud_client(provider="s3")
+        s3_client = client or get_cloud_client(provider="s3")
         bucket_name, prefix = doc.parse_s3_url()
         local_file_path = os.path.join(tmp_dir, os.path.basename(prefix))
 
@@ -746,7 +1094,7 @@ def download_file(doc: FileInfo, tmp_dir: str):
             return None
 
     elif doc.location == FileLocation.azure:
-        azure_client = get_cloud_client(provider="azure")
+        azure_client = client or get_cloud_client(provider="azure")
         container_name, blob_name = doc.parse_azure_url()
         local_file_path = os.path.join(tmp_dir, os.path.basename(blob_name))
 
@@ -759,7 +1107,7 @@ def download_file(doc: FileInfo, tmp_dir: str):
             return None
 
     elif doc.location == FileLocation.gcp:
-        gcp_client = get_cloud_client(provider="gcp")
+        gcp_client = client or get_cloud_client(provider="gcp")
         bucket_name, blob_name = doc.parse_gcp_url()
         local_file_path = os.path.join(tmp_dir, os.path.basename(blob_name))
 
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from dataclasses import asdict, dataclass
+from typing import List, Optional
+from urllib.parse import quote
+
+from platform_common.pydantic_models.training import FileInfo, FileLocation
+from thirdai import neural_db_v2 as ndbv2
+from thirdai.neural_db_v2.core.types import InsertedDocMetadata
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Options which change how a document is inserted, but not how it is indexed.
+UNHASHED_OPTIONS = {"upsert"}
+
+
+def document_hash(doc: FileInfo, local_path: str) -> str:
+    """
+    SHA-256 of the bytes of a document and of everything else that determines how
+    it is indexed: its name, source_id, metadata, and options. Local files are
+    named by their basename, since uploads are saved under a different directory
+    for every request, and cloud files by their full path.
+    """
+    hasher = hashlib.sha256()
+    with open(local_path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            hasher.update(chunk)
+
+    key = {
+        "name": (
+            os.path.basename(doc.path)
+            if doc.location == FileLocation.local
+            else doc.path
+        ),
+        "source_id": doc.source_id,
+        "metadata": doc.metadata,
+        "options": {k: v for k, v in doc.options.items() if k not in UNHASHED_OPTIONS},
+    }
+    hasher.update(json.dumps(key, sort_keys=True, default=str).encode())
+    return hasher.hexdigest()
+
+
+@dataclass
+class StoredDocument:
+    """
+    A version of a document that was inserted into the NDB. chunk_id is the id of
+    its first chunk, which is also used to check that this version has not been
+    deleted.
+    """
+
+    doc_id: str
+    doc_version: int
+    document: str
+    chunk_id: int
+
+
+class DocumentStore:
+    """
+    Content addressed index of the documents inserted into an NDB, kept under its
+    documents directory. Each document is keyed by its document_hash, so that
+    reinserting an unchanged document can skip copying, parsing, and indexing
+    it.
+
+    An entry is only used if is_current confirms that the version it refers to is
+    still the latest version of its document in the NDB. Versions restart at 1
+    and chunk ids can be reused once every version of a document is deleted, so
+    remove_docs must be called when documents are deleted, to remove the entries
+    that is_current could no longer tell apart from a new insert.
+    """
+
+    def __init__(self, documents_dir: str):
+        self.index_dir = os.path.join(documents_dir, ".content_index")
+
+    def entry_path(self, content_hash: str) -> str:
+        return os.path.join(self.index_dir, content_hash[:2], f"{content_hash}.json")
+
+    def doc_entries_dir(self, doc_id: str) -> str:
+        # Lists the hashes of the entries of each document, so that they can be
+        # removed when the document is deleted.
+        return os.path.join(self.index_dir, "docs", quote(doc_id, safe=""))
+
+    def get(self, content_hash: str) -> Optional[StoredDocument]:
+        try:
+            with open(self.entry_path(content_hash)) as f:
+                return StoredDocument(**json.load(f))
+        except FileNotFoundError:
+            return None
+
+    def add(self, content_hash: str, stored: StoredDocument) -> None:
+        path = self.entry_path(content_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written to a temporary file and renamed so that readers never see a
+        # partially written entry.
+        tmp_path = f"{path}.{uuid.uuid4()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(asdict(stored), f)
+        os.replace(tmp_path, path)
+
+        doc_entries_dir = self.doc_entries_dir(stored.doc_id)
+        os.makedirs(doc_entries_dir, exist_ok=True)
+        open(os.path.join(doc_entries_dir, content_hash), "w").close()
+
+    def remove_docs(self, doc_ids: List[str]) -> None:
+        """
+        Removes the entries of every version of the given documents.
+        """
+        for doc_id in doc_ids:
+            doc_entries_dir = self.doc_entries_dir(doc_id)
+            if not os.path.isdir(doc_entries_dir):
+                continue
+            for content_hash in os.listdir(doc_entries_dir):
+                # The same contents may since have been inserted as another
+                # document, whose entry is kept.
+                stored = self.get(content_hash)
+                if stored and stored.doc_id == doc_id:
+                    os.remove(self.entry_path(content_hash))
+            shutil.rmtree(doc_entries_dir, ignore_errors=True)
+
+    def add_inserted(
+        self,
+        content_hashes: List[str],
+        docs: List[ndbv2.Document],
+        inserted: List[InsertedDocMetadata],
+    ) -> None:
+        """
+        Adds the documents that were just inserted, given the metadata returned by
+        NeuralDB.insert for them.
+        """
+        for content_hash, doc, metadata in zip(content_hashes, docs, inserted):
+            if not metadata.chunk_ids:
+                continue
+            self.add(
+                content_hash,
+                StoredDocument(
+                    doc_id=metadata.doc_id,
+                    doc_version=metadata.doc_version,
+                    document=doc.chunks()[0].document.iloc[0],
+                    chunk_id=int(min(metadata.chunk_ids)),
+                ),
+            )
+
+    @staticmethod
+    def is_current(db: ndbv2.NeuralDB, stored: StoredDocument) -> bool:
+        if db.chunk_store.max_version_for_doc(stored.doc_id) != stored.doc_version:
+            return False
+        try:
+            chunks = db.chunk_store.get_chunks([stored.chunk_id])
+        except ValueError:
+            return False
+        return (
+            len(chunks) == 1
+            and chunks[0].doc_id == stored.doc_id
+            and chunks[0].doc_version == stored.doc_version
+            and chunks[0].document == stored.document
+        )
@@ -1,12 +1,18 @@
 import logging
 import os
+import shutil
 import uuid
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, NamedTuple, Optional, Tuple
 
 import pdftitle
 from fastapi import Response
 from platform_common import file_ops
 from platform_common.file_handler import FileInfo, FileLocation, download_file
+from platform_common.ndb.document_store import (
+    DocumentStore,
+    StoredDocument,
+    document_hash,
+)
 from thirdai import neural_db_v2 as ndbv2
 
 
@@ -104,18 +110,34 @@ def preload_chunks(
 
 
 def parse_doc(
-    doc: FileInfo, doc_save_dir: str, tmp_dir: str
+    doc: FileInfo,
+    doc_save_dir: str,
+    tmp_dir: str,
+    downloaded_path: Optional[str] = None,
+    sync: bool = True,
+    artifact_name: Optional[str] = None,
 ) -> Optional[Tuple[ndbv2.Document, str]]:
     """
     Process a file, downloading it from S3, Azure, or GCP if necessary,
-    and convert it to an NDB file.
+    and convert it to an NDB file. If a cloud file has already been downloaded,
+    e.g. by a DownloadPrefetcher, downloaded_path is the local copy to parse.
+    If sync is False, local files are copied to doc_save_dir without syncing
+    them, and the caller must call file_ops.sync_barrier once they are parsed.
+    Local files are copied into the directory artifact_name in doc_save_dir,
+    which is a new uuid by default.
     """
     if doc.location in {FileLocation.s3, FileLocation.azure, FileLocation.gcp}:
-        local_file_path = download_file(doc, tmp_dir)
-        if not local_file_path:
-            raise ValueError(f"Error downloading file '{doc.path}' from {doc.location}")
+        if downloaded_path:
+            local_file_path = downloaded_path
+        else:
+            local_file_path = download_file(doc, tmp_dir)
+            if not local_file_path:
+                raise ValueError(
+                    f"Error downloading file '{doc.path}' from {doc.location}"
+                )
 
-        file_ops.clear_cache(local_file_path)
+            # The downloaded copy is deleted after parsing, so it is not synced.
+            file_ops.clear_cache(local_file_path, sync=False)
 
         # Set display_path based on the cloud provider
         if doc.location == FileLocation.s3:
@@ -132,11 +154,11 @@ def parse_doc(
             display_path = f"/storage.googleapis.com/{bucket_name}/{blob_name}"
     else:
         # Local file handling
-        save_artifact_uuid = str(uuid.uuid4())
+        save_artifact_uuid = artifact_name or str(uuid.uuid4())
         artifact_dir = os.path.join(doc_save_dir, save_artifact_uuid)
         os.makedirs(artifact_dir, exist_ok=True)
         local_file_path = os.path.join(artifact_dir, os.path.basename(doc.path))
-        file_ops.copy(src=doc.path, dst=artifact_dir)
+        file_ops.copy(src=doc.path, dst=artifact_dir, sync=sync)
         display_path = os.path.join(save_artifact_uuid, os.path.basename(doc.path))
 
     # Convert the downloaded or local file into an NDB document
@@ -148,10 +170,97 @@ def parse_doc(
         options=doc.options,
     )
 
-    # Remove the local file if it was downloaded from cloud storage
+    # Remove the local file if it was downloaded from cloud storage. It was not
+    # synced, so it is removed without file_ops.delete, which would sync it first.
     if doc.location in {FileLocation.s3, FileLocation.azure, FileLocation.gcp}:
-        file_ops.delete(local_file_path)
+        os.remove(local_file_path)
 
     # we don't delete local files because we use them to render PDFs
 
     return ndb_doc
+
+
+class ParsedDoc(NamedTuple):
+    content_hash: str
+    # None if the document could not be parsed, or if it was not parsed because
+    # it is already stored.
+    doc: Optional[ndbv2.Document]
+    # The entry in the DocumentStore of doc_save_dir for an unchanged document.
+    # The caller must check that it is current before skipping the document.
+    stored: Optional[StoredDocument]
+    # The directory in doc_save_dir that a local file was copied into.
+    artifact_dir: Optional[str] = None
+
+    def discard(self) -> None:
+        """
+        Removes the copy of a document that was parsed but is not inserted, such
+        as a document that is repeated in an insert.
+        """
+        if self.artifact_dir:
+            shutil.rmtree(self.artifact_dir, ignore_errors=True)
+
+
+def parse_doc_if_new(
+    doc: FileInfo,
+    doc_save_dir: str,
+    tmp_dir: str,
+    downloaded_path: Optional[str] = None,
+    sync: bool = True,
+    skip_stored: bool = True,
+) -> ParsedDoc:
+    """
+    parse_doc for documents in the content addressed DocumentStore of doc_save_dir.
+    The document is hashed first, and if skip_stored is True and the store has an
+    entry for the hash, the document is not copied or parsed. A downloaded_path
+    that is passed in is then kept, so that the caller can parse it if the stored
+    version turns out not to be current. Otherwise local files are copied into a
+    new directory, so that each version of a document has its own copy even if
+    their contents are the same, and removing the file of an old version never
+    removes the file of the latest version.
+    """
+    cloud_file = doc.location in {FileLocation.s3, FileLocation.azure, FileLocation.gcp}
+    download = cloud_file and not downloaded_path
+    if download:
+        downloaded_path = download_file(doc, tmp_dir)
+        if not downloaded_path:
+            raise ValueError(f"Error downloading file '{doc.path}' from {doc.location}")
+        # The downloaded copy is deleted after parsing, so it is not synced.
+        file_ops.clear_cache(downloaded_path, sync=False)
+
+    content_hash = document_hash(doc, downloaded_path if cloud_file else doc.path)
+
+    stored = DocumentStore(doc_save_dir).get(content_hash) if skip_stored else None
+    if stored:
+        if download:
+            # The downloaded copy was not synced, so it is removed without
+            # file_ops.delete, which would sync it first.
+            os.remove(downloaded_path)
+        return ParsedDoc(content_hash=content_hash, doc=None, stored=stored)
+
+    artifact_name = str(uuid.uuid4())
+    ndb_doc = parse_doc(
+        doc,
+        doc_save_dir=doc_save_dir,
+        tmp_dir=tmp_dir,
+        downloaded_path=downloaded_path,
+        sync=sync,
+        artifact_name=artifact_name,
+    )
+    parsed_doc = ParsedDoc(
+        content_hash=content_hash,
+        doc=ndb_doc,
+        stored=None,
+        artifact_dir=(
+            None if cloud_file else os.path.join(doc_save_dir, artifact_name)
+        ),
+    )
+    if not ndb_doc:
+        parsed_doc.discard()
+    return parsed_doc
+
+
+def parse_doc_if_new_from_args(args: Tuple) -> ParsedDoc:
+    """
+    parse_doc_if_new with its arguments packed into a tuple, for Pool.imap.
+    """
+    return parse_doc_if_new(*args)
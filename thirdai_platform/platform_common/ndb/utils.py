@@ -1,6 +1,7 @@
 import os
 from typing import List
 
+from platform_common.ndb.document_store import DocumentStore
 from thirdai import neural_db_v2 as ndb
 
 
@@ -17,6 +18,9 @@ def delete_docs_and_remove_files(
         )
         deleted_filenames.update([chunk.document for chunk in deleted_chunks])
 
+    if not keep_latest_version:
+        DocumentStore(full_documents_path).remove_docs(doc_ids)
+
     for deleted_filename in deleted_filenames:
         full_file_path = os.path.join(full_documents_path, deleted_filename)
         if os.path.exists(full_file_path):
@@ -12,6 +12,37 @@ class NDBDeploymentOptions(BaseModel):
     llm_provider: str = "openai"
     genai_key: Optional[str] = None
 
+    # Number of threads used to run searches, defaults to the ThreadPoolExecutor
+    # default if not specified.
+    search_threads: Optional[int] = Field(None, ge=1)
+
+    # If enabled, concurrent searches with the same top_k, constraints, and rerank
+    # settings are collected for up to search_batch_max_wait_ms, or until there are
+    # search_batch_max_size of them, and run as a single batched search.
+    search_batching: bool = False
+    search_batch_max_size: int = 32
+    search_batch_max_wait_ms: float = 2
+
+    # Results of repeated searches are cached until the index is modified, or
+    # they expire. A size of 0 disables the cache.
+    search_cache_size: int = 1024
+    search_cache_ttl_sec: float = 300
+
+    # Maximum total size of the rendered highlighted PDFs that are cached.
+    highlight_cache_bytes: int = 256 * 1024 * 1024
+
+    # Async insert and delete tasks are processed by task_workers threads, and up
+    # to task_batch_size consecutive insert tasks are applied with a single
+    # insert. Batches of inserts are parsed concurrently but indexed in the order
+    # they were queued. Finished tasks are kept for task_retention_hours.
+    task_workers: int = 2
+    task_batch_size: int = 64
+    task_retention_hours: float = 7 * 24
+
+    # Number of processes used to parse documents for inserts, defaults to the
+    # number of cores if not specified.
+    parse_processes: Optional[int] = Field(None, ge=1)
+
     class Config:
         protected_namespaces = ()
 
@@ -123,6 +123,15 @@ class NDBOptions(BaseModel):
     on_disk: bool = True
     advanced_search: bool = False
 
+    # Cloud files are downloaded by download_threads threads, up to
+    # download_prefetch files ahead of parsing, and downloads are paused while
+    # the downloaded files that are waiting to be parsed or are being parsed take
+    # up more than download_staging_bytes. Each downloaded file is removed as
+    # soon as it is parsed.
+    download_threads: int = 8
+    download_prefetch: int = 64
+    download_staging_bytes: int = 2 * 1024 * 1024 * 1024
+
     class Config:
         protected_namespaces = ()
 
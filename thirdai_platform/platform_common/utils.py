@@ -3,8 +3,9 @@ import os
 import shutil
 from typing import Dict, Optional
 
+import orjson
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 
 
 def model_bazaar_path():
@@ -36,6 +37,34 @@ def response(
     )
 
 
+def orjson_response(status_code: int, message: str, data: Dict = {}) -> Response:
+    """
+    Creates the same JSON response as response(), but serializes the data with
+    orjson directly instead of first converting it with jsonable_encoder. This is
+    much faster for large responses made of plain dicts and lists, such as search
+    results. Values that orjson can't serialize are converted with
+    jsonable_encoder.
+
+    Args:
+        status_code (int): HTTP status code.
+        message (str): Message to include in the response.
+        data (Dict, optional): Data to include in the response. Defaults to {}.
+
+    Returns:
+        Response: The JSON response.
+    """
+    status = "success" if status_code < 400 else "failed"
+    return Response(
+        content=orjson.dumps(
+            {"status": status, "message": message, "data": data},
+            default=jsonable_encoder,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+        ),
+        status_code=status_code,
+        media_type="application/json",
+    )
+
+
 def save_dict(write_to: str, **kwargs):
     with open(write_to, "w") as fp:
         json.dump(kwargs, fp, indent=4)
@@ -1,3 +1,6 @@
+from typing import BinaryIO
+
+
 class StorageInterface:
     def create_upload_token(self, model_identifier, user_id, model_id, expiration_min):
         """
@@ -34,7 +37,7 @@ class StorageInterface:
     def upload_chunk(
         self,
         model_id: str,
-        chunk_data: bytes,
+        chunk_file: BinaryIO,
         chunk_number: int,
         model_type: str,
         compressed: bool,
@@ -45,7 +48,7 @@ class StorageInterface:
         Parameters:
         - model_id: str - The ID of the model.
             Example: "model456"
-        - chunk_data: bytes - The raw bytes of the chunk.
+        - chunk_file: BinaryIO - A file object with the raw bytes of the chunk.
         - chunk_number: int - The position of the chunk.
             Example: 1
         - model_type: str - The type of the model (e.g., "ndb").
@@ -1,10 +1,14 @@
 import os
 import shutil
 import zipfile
+from typing import BinaryIO
 
 from storage.interface import StorageInterface
 from storage.utils import create_token, verify_token
 
+# Size of the chunks that uploaded model chunks are copied to disk in.
+UPLOAD_COPY_CHUNK_SIZE = 1024 * 1024
+
 
 class LocalStorage(StorageInterface):
     def __init__(self, root: str):
@@ -64,7 +68,7 @@ class LocalStorage(StorageInterface):
     def upload_chunk(
         self,
         model_id: str,
-        chunk_data: bytes,
+        chunk_file: BinaryIO,
         chunk_number: int,
         model_type: str = "ndb",
         compressed: bool = True,
@@ -75,7 +79,8 @@ class LocalStorage(StorageInterface):
         Parameters:
         - model_id: str - The ID of the model.
             Example: "model456"
-        - chunk_data: bytes - The raw bytes of the chunk.
+        - chunk_file: BinaryIO - A file object with the raw bytes of the chunk,
+            which is copied to disk in chunks instead of being read into memory.
         - chunk_number: int - The position of the chunk.
             Example: 1
         - model_type: str - The type of the model (default: "ndb").
@@ -89,7 +94,7 @@ class LocalStorage(StorageInterface):
         os.makedirs(os.path.dirname(chunk_path), exist_ok=True)
 
         with open(chunk_path, "wb") as f:
-            f.write(chunk_data)
+            shutil.copyfileobj(chunk_file, f, length=UPLOAD_COPY_CHUNK_SIZE)
 
     def commit_upload(
         self,
@@ -0,0 +1,54 @@
+from unittest.mock import patch
+
+import pytest
+from platform_common import file_handler
+from platform_common.file_handler import SignedUrlCache, get_cloud_client
+
+pytestmark = [pytest.mark.unit]
+
+
+def test_cloud_clients_are_reused_per_credentials(monkeypatch):
+    created = []
+
+    def create_cloud_client(provider, credentials):
+        created.append((provider, credentials))
+        return object()
+
+    monkeypatch.setenv("AWS_ACCESS_KEY", "key-1")
+    monkeypatch.setenv("AWS_ACCESS_SECRET", "secret")
+
+    with patch.object(file_handler, "_cloud_clients", {}), patch.object(
+        file_handler, "create_cloud_client", create_cloud_client
+    ):
+        client = get_cloud_client(provider="s3")
+        assert get_cloud_client(provider="s3") is client
+        assert len(created) == 1
+
+        # Changing the credentials creates a new client.
+        monkeypatch.setenv("AWS_ACCESS_KEY", "key-2")
+        assert get_cloud_client(provider="s3") is not client
+        assert len(created) == 2
+        assert created[1][1][0] == "key-2"
+
+        with pytest.raises(ValueError):
+            get_cloud_client(provider="dropbox")
+
+
+def test_signed_url_cache():
+    cache = SignedUrlCache(max_entries=2)
+    urls = iter(f"url-{i}" for i in range(10))
+
+    with patch.object(file_handler.time, "monotonic", return_value=0):
+        assert cache.get_or_create("a", 10, lambda: next(urls)) == "url-0"
+        assert cache.get_or_create("a", 10, lambda: next(urls)) == "url-0"
+        assert cache.get_or_create("b", 10, lambda: next(urls)) == "url-1"
+
+    # URLs are refreshed once half of their validity has passed.
+    with patch.object(file_handler.time, "monotonic", return_value=299):
+        assert cache.get_or_create("a", 10, lambda: next(urls)) == "url-0"
+    with patch.object(file_handler.time, "monotonic", return_value=300):
+        assert cache.get_or_create("a", 10, lambda: next(urls)) == "url-2"
+
+        # The least recently used entry is evicted.
+        assert cache.get_or_create("c", 10, lambda: next(urls)) == "url-3"
+        assert cache.get_or_create("b", 10, lambda: next(urls)) == "url-4"
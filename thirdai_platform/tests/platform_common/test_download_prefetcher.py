@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+from platform_common.download_prefetcher import DownloadPrefetcher
+from platform_common.pydantic_models.training import FileInfo, FileLocation
+
+pytestmark = [pytest.mark.unit]
+
+FILE_SIZE = 100
+
+
+class FakeDownloads:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_progress = 0
+        self.max_in_progress = 0
+
+    def get_cloud_client(self, provider):
+        return object()
+
+    def download_file(self, doc, tmp_dir, client):
+        with self.lock:
+            self.in_progress += 1
+            self.max_in_progress = max(self.max_in_progress, self.in_progress)
+        time.sleep(0.01)
+        with self.lock:
+            self.in_progress -= 1
+
+        if doc.path.endswith("missing.txt"):
+            return None
+        local_path = os.path.join(tmp_dir, os.path.basename(doc.path))
+        with open(local_path, "wb") as f:
+            f.write(b"x" * FILE_SIZE)
+        return local_path
+
+
+def make_files():
+    files = [
+        FileInfo(path=f"s3://bucket/dir{i}/doc.txt", location=FileLocation.s3)
+        for i in range(20)
+    ]
+    files[5] = FileInfo(path="/local/doc.txt", location=FileLocation.local)
+    files[7] = FileInfo(path="s3://bucket/missing.txt", location=FileLocation.s3)
+    return files
+
+
+def test_prefetcher_yields_files_in_order(tmp_path):
+    fake = FakeDownloads()
+    files = make_files()
+    prefetcher = DownloadPrefetcher(
+        files, tmp_dir=str(tmp_path), max_outstanding=4, download_threads=4
+    )
+
+    with patch(
+        "platform_common.download_prefetcher.get_cloud_client", fake.get_cloud_client
+    ), patch("platform_common.download_prefetcher.download_file", fake.download_file):
+        results = []
+        for file, local_path in prefetcher:
+            if local_path:
+                assert os.path.getsize(local_path) == FILE_SIZE
+            results.append((file, local_path))
+            prefetcher.release()
+
+    assert [file for file, _ in results] == files
+    assert results[5][1] is None
+    assert results[7][1] is None
+    # Objects with the same name are downloaded to different paths.
+    downloaded = [path for _, path in results if path]
+    assert len(set(downloaded)) == len(files) - 2
+
+    assert 1 < fake.max_in_progress <= 4
+
+    # Released files are deleted.
+    assert os.listdir(tmp_path) == []
+
+
+def test_prefetcher_staging_budget(tmp_path):
+    fake = FakeDownloads()
+    files = [f for f in make_files() if f.location == FileLocation.s3]
+    prefetcher = DownloadPrefetcher(
+        files,
+        tmp_dir=str(tmp_path),
+        max_outstanding=len(files),
+        download_threads=1,
+        staging_bytes=3 * FILE_SIZE,
+    )
+
+    with patch(
+        "platform_common.download_prefetcher.get_cloud_client", fake.get_cloud_client
+    ), patch("platform_common.download_prefetcher.download_file", fake.download_file):
+        iterator = iter(prefetcher)
+        yielded = [next(iterator) for _ in range(3)]
+        assert all(local_path for _, local_path in yielded)
+
+        # No more downloads are started until staged files are released.
+        time.sleep(0.1)
+        assert len(os.listdir(tmp_path)) == 3
+        assert prefetcher.staged_bytes == 3 * FILE_SIZE
+
+        for _ in yielded:
+            prefetcher.release()
+        for _ in iterator:
+            assert prefetcher.staged_bytes <= 3 * FILE_SIZE
+            prefetcher.release()
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_prefetcher_close_stops_iteration(tmp_path):
+    fake = FakeDownloads()
+    files = [f for f in make_files() if f.location == FileLocation.s3]
+    prefetcher = DownloadPrefetcher(
+        files, tmp_dir=str(tmp_path), max_outstanding=2, download_threads=2
+    )
+
+    with patch(
+        "platform_common.download_prefetcher.get_cloud_client", fake.get_cloud_client
+    ), patch("platform_common.download_prefetcher.download_file", fake.download_file):
+        iterator = iter(prefetcher)
+        yielded = [next(iterator) for _ in range(2)]
+
+        # The consumer stops without releasing the files, and the iterator is
+        # blocked in another thread until files are released, as the thread of
+        # the parsing pool which consumes it would be.
+        consumer = threading.Thread(target=lambda: list(iterator))
+        consumer.start()
+        time.sleep(0.1)
+        assert consumer.is_alive()
+
+        prefetcher.close()
+        consumer.join(timeout=5)
+        assert not consumer.is_alive()
+
+        # Releasing files after closing is a no-op.
+        prefetcher.release()
+
+        # Downloads which were in progress delete their files once they finish.
+        time.sleep(0.1)
+
+    assert all(not os.path.exists(local_path) for _, local_path in yielded)
+    assert os.listdir(tmp_path) == []
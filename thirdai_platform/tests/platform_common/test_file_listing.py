@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+from platform_common.file_handler import (
+    expand_cloud_buckets_and_directories,
+    handle_iterator_exceptions,
+    iter_expanded_file_info,
+    walk_prefixes,
+)
+from platform_common.pydantic_models.training import FileInfo, FileLocation
+
+pytestmark = [pytest.mark.unit]
+
+
+def make_tree(depth: int, fanout: int, files_per_prefix: int):
+    tree = {}
+
+    def add(prefix: str, level: int):
+        sub_prefixes = (
+            [f"{prefix}d{i}/" for i in range(fanout)] if level < depth else []
+        )
+        tree[prefix] = (
+            [f"{prefix}f{i}" for i in range(files_per_prefix)],
+            sub_prefixes,
+        )
+        for sub_prefix in sub_prefixes:
+            add(sub_prefix, level + 1)
+
+    add("root/", 0)
+    return tree
+
+
+def test_walk_prefixes_lists_all_files():
+    tree = make_tree(depth=3, fanout=3, files_per_prefix=5)
+    threads = set()
+
+    def list_prefix(prefix):
+        threads.add(threading.get_ident())
+        files, sub_prefixes = tree[prefix]
+        # Split into pages to check that every page is yielded.
+        yield files[:2], sub_prefixes[:1]
+        yield files[2:], sub_prefixes[1:]
+
+    files = list(walk_prefixes(list_prefix, "root/", max_workers=4))
+
+    expected = [file for files, _ in tree.values() for file in files]
+    assert sorted(files) == sorted(expected)
+    assert len(threads) > 1
+
+
+def test_walk_prefixes_errors_and_early_exit():
+    tree = make_tree(depth=2, fanout=2, files_per_prefix=100)
+
+    def list_prefix(prefix):
+        if prefix == "root/d1/d0/":
+            raise ValueError("listing failed")
+        yield tree[prefix]
+
+    with pytest.raises(ValueError, match="listing failed"):
+        list(walk_prefixes(list_prefix, "root/", max_workers=2))
+
+    # Closing the iterator early stops the listing threads.
+    listing = walk_prefixes(
+        lambda prefix: iter([tree[prefix]]), "root/", max_buffered_pages=1
+    )
+    assert len([file for _, file in zip(range(10), listing)]) == 10
+    listing.close()
+
+
+def test_walk_prefixes_early_exit_skips_queued_prefixes():
+    listed = []
+
+    def list_prefix(prefix):
+        listed.append(prefix)
+        if prefix == "root/":
+            yield ["root/f"], [f"root/d{i}/" for i in range(50)]
+        else:
+            time.sleep(0.05)
+            yield [f"{prefix}f"], []
+
+    listing = walk_prefixes(list_prefix, "root/", max_workers=1)
+    assert next(listing) == "root/f"
+    start = time.perf_counter()
+    listing.close()
+
+    # Closing does not wait for the queued prefixes to be listed.
+    assert time.perf_counter() - start < 1
+    time.sleep(0.2)
+    assert len(listed) < 10
+
+
+def test_handle_iterator_exceptions():
+    class Handler:
+        @handle_iterator_exceptions
+        def iter_files(self, bucket_name, source_path):
+            yield "a"
+            raise ValueError("listing failed")
+
+    files = Handler().iter_files("bucket", "path")
+    assert next(files) == "a"
+    with pytest.raises(HTTPException, match="listing failed"):
+        next(files)
+
+
+def test_expand_nfs_directory(tmp_path):
+    for i in range(3):
+        os.makedirs(tmp_path / f"dir{i}" / "nested")
+        (tmp_path / f"dir{i}" / "a.txt").write_text("a")
+        (tmp_path / f"dir{i}" / "nested" / "b.txt").write_text("b")
+    os.symlink(tmp_path / "dir0", tmp_path / "link")
+
+    expanded = expand_cloud_buckets_and_directories(
+        [FileInfo(path=str(tmp_path), location=FileLocation.nfs, source_id="id")]
+    )
+
+    expected = [
+        os.path.join(root, file)
+        for root, _, files in os.walk(tmp_path)
+        for file in files
+    ]
+    assert sorted(file.path for file in expanded) == sorted(expected)
+    assert all(file.source_id is None for file in expanded)
+
+
+def test_iter_expanded_file_info_source_id():
+    file_info = FileInfo(path="s3://bucket/a", location=FileLocation.s3, source_id="id")
+
+    [single] = iter_expanded_file_info(["s3://bucket/a"], file_info)
+    assert single.source_id == "id"
+
+    many = list(iter_expanded_file_info(iter(["a", "b", "c"]), file_info))
+    assert [file.path for file in many] == ["a", "b", "c"]
+    assert all(file.source_id is None for file in many)
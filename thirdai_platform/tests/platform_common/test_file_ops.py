@@ -0,0 +1,73 @@
+import os
+from unittest.mock import patch
+
+import pytest
+from platform_common import file_ops
+
+pytestmark = [pytest.mark.unit]
+
+
+def write_file(path, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def read_file(path) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("sync", [True, False])
+def test_copy_file(tmp_path, sync):
+    src = tmp_path / "src" / "doc.txt"
+    data = os.urandom(3 * 1024 * 1024 + 7)
+    write_file(src, data)
+    os.utime(src, (1_000_000, 1_000_000))
+
+    dst_dir = tmp_path / "dst"
+    os.makedirs(dst_dir)
+    file_ops.copy(str(src), str(dst_dir), sync=sync)
+
+    dst = dst_dir / "doc.txt"
+    assert read_file(dst) == data
+    assert os.stat(dst).st_mtime == 1_000_000
+
+    # Copying to a file path overwrites the existing file.
+    write_file(src, b"new")
+    file_ops.copy(str(src), str(dst), sync=sync)
+    assert read_file(dst) == b"new"
+
+
+def test_copy_falls_back_if_in_kernel_copy_unsupported(tmp_path):
+    src = tmp_path / "doc.txt"
+    write_file(src, b"content")
+
+    def unsupported(*args):
+        raise OSError(file_ops.errno.EXDEV, "unsupported")
+
+    with patch.object(file_ops.os, "copy_file_range", unsupported), patch.object(
+        file_ops.os, "sendfile", unsupported
+    ):
+        file_ops.copy(str(src), str(tmp_path / "copy.txt"))
+    assert read_file(tmp_path / "copy.txt") == b"content"
+
+
+def test_copy_directory_and_sync_barrier(tmp_path):
+    files = {"a.txt": b"a", "nested/b.txt": b"b" * 10000, "nested/deep/c.txt": b""}
+    for name, data in files.items():
+        write_file(tmp_path / "src" / name, data)
+
+    file_ops.copy(str(tmp_path / "src"), str(tmp_path / "dst"), sync=False)
+    for name, data in files.items():
+        assert read_file(tmp_path / "dst" / name) == data
+
+    synced = []
+    with patch.object(file_ops, "_sync_filesystem", synced.append):
+        file_ops.sync_barrier(
+            [str(tmp_path / "dst"), str(tmp_path / "src"), str(tmp_path / "missing")]
+        )
+    # Each filesystem is synced once, and paths that do not exist are skipped.
+    assert synced == [str(tmp_path / "dst")]
+
+    file_ops.sync_barrier([str(tmp_path / "dst")])
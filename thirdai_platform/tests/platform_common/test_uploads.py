@@ -0,0 +1,60 @@
+import hashlib
+import io
+import os
+from unittest.mock import patch
+
+import pytest
+from fastapi import UploadFile
+from platform_common import file_handler
+from platform_common.file_handler import download_local_files, save_upload_file
+from platform_common.pydantic_models.training import FileInfo, FileLocation
+
+pytestmark = [pytest.mark.unit]
+
+
+class ChunkCheckingFile(io.BytesIO):
+    def __init__(self, data: bytes, max_read: int):
+        super().__init__(data)
+        self.max_read = max_read
+
+    def read(self, size=-1):
+        assert 0 < size <= self.max_read
+        return super().read(size)
+
+
+def test_save_upload_file_in_chunks(tmp_path):
+    data = os.urandom(10 * 1024 + 3)
+    upload = UploadFile(file=ChunkCheckingFile(data, max_read=1024), filename="a.bin")
+
+    with patch.object(file_handler, "UPLOAD_COPY_CHUNK_SIZE", 1024):
+        digest = save_upload_file(upload, str(tmp_path / "a.bin"), "sha256")
+
+    assert (tmp_path / "a.bin").read_bytes() == data
+    assert digest == hashlib.sha256(data).hexdigest()
+
+    empty = UploadFile(file=io.BytesIO(b""), filename="empty.bin")
+    assert save_upload_file(empty, str(tmp_path / "empty.bin")) is None
+    assert (tmp_path / "empty.bin").read_bytes() == b""
+
+
+def test_download_local_files(tmp_path):
+    uploads = [
+        UploadFile(file=io.BytesIO(b"first"), filename="dir/a.txt"),
+        UploadFile(file=io.BytesIO(b"second"), filename="b.txt"),
+    ]
+    file_infos = [
+        FileInfo(path="dir/a.txt", location=FileLocation.local, source_id="a"),
+        FileInfo(path="/some/path/b.txt", location=FileLocation.local),
+        FileInfo(path="s3://bucket/c.txt", location=FileLocation.s3),
+    ]
+
+    saved = download_local_files(uploads, file_infos, str(tmp_path))
+
+    assert [file.path for file in saved] == [
+        str(tmp_path / "dir" / "a.txt"),
+        str(tmp_path / "b.txt"),
+        "s3://bucket/c.txt",
+    ]
+    assert saved[0].source_id == "a"
+    assert (tmp_path / "dir" / "a.txt").read_bytes() == b"first"
+    assert (tmp_path / "b.txt").read_bytes() == b"second"
@@ -3,14 +3,24 @@ import multiprocessing as mp
 import os
 import shutil
 import time
-from collections import defaultdict
+from collections import defaultdict, deque
 from logging import Logger
-from typing import List
+from typing import Iterable, Iterator, List, Tuple
 
 import thirdai
-from platform_common.file_handler import expand_cloud_buckets_and_directories
+from platform_common import file_ops
+from platform_common.download_prefetcher import DownloadPrefetcher
+from platform_common.file_handler import (
+    expand_cloud_buckets_and_directories,
+    iter_expanded_cloud_buckets_and_directories,
+)
 from platform_common.logging.logcodes import LogCode
-from platform_common.ndb.ndbv2_parser import parse_doc
+from platform_common.ndb.document_store import DocumentStore
+from platform_common.ndb.ndbv2_parser import (
+    ParsedDoc,
+    parse_doc_if_new,
+    parse_doc_if_new_from_args,
+)
 from platform_common.ndb.utils import delete_docs_and_remove_files
 from platform_common.pydantic_models.feedback_logs import ActionType, FeedbackLog
 from platform_common.pydantic_models.training import FileInfo, TrainConfig
@@ -87,8 +97,12 @@ class NeuralDBV2(Model):
     def doc_save_path(self):
         return os.path.join(self.ndb_save_path(), "documents")
 
-    def unsupervised_files(self) -> List[FileInfo]:
-        return expand_cloud_buckets_and_directories(self.config.data.unsupervised_files)
+    def unsupervised_files(self) -> Iterator[FileInfo]:
+        # Listed lazily so that parsing starts while large buckets or directories
+        # are still being listed.
+        return iter_expanded_cloud_buckets_and_directories(
+            self.config.data.unsupervised_files
+        )
 
     def supervised_files(self) -> List[FileInfo]:
         all_files = expand_cloud_buckets_and_directories(
@@ -101,7 +115,13 @@ class NeuralDBV2(Model):
                 )
         return all_files
 
-    def unsupervised_train(self, files: List[FileInfo], batch_size=500):
+    def unsupervised_train(
+        self, files: Iterable[FileInfo], batch_size=500
+    ) -> Tuple[int, int]:
+        """
+        Parses and inserts the files, returning the number of files processed and
+        the number of files that were successfully indexed.
+        """
         self.logger.debug("Starting unsupervised training.")
 
         n_jobs = max(1, min(os.cpu_count() - 6, 20))
@@ -114,58 +134,124 @@ class NeuralDBV2(Model):
         docs_indexed = 0
         successfully_indexed_files = 0
 
-        batches = [files[i : i + batch_size] for i in range(0, len(files), batch_size)]
-        with mp.Pool(processes=n_jobs) as pool:
-            first_batch_start = time.perf_counter()
-            curr_batch = pool.starmap(
-                parse_doc,
-                [(doc, doc_save_dir, tmp_dir) for doc in batches[0]],
-                chunksize=10,
-            )
-            first_batch_end = time.perf_counter()
-            self.logger.debug(
-                f"First batch parsed in {first_batch_end - first_batch_start:.3f}s"
-            )
+        # Cloud files are downloaded ahead of the parsing processes, and at most
+        # two batches of files are downloaded or parsed and not yet indexed. The
+        # downloaded copy of each file is released as soon as it is parsed, so
+        # that the staging budget only counts files waiting to be parsed.
+        prefetcher = DownloadPrefetcher(
+            files,
+            tmp_dir=str(tmp_dir),
+            max_outstanding=2 * batch_size,
+            download_threads=self.config.model_options.download_threads,
+            prefetch=self.config.model_options.download_prefetch,
+            staging_bytes=self.config.model_options.download_staging_bytes,
+        )
 
-            for i in range(len(batches)):
-                start = time.perf_counter()
-                if i + 1 < len(batches):
-                    next_batch = pool.starmap_async(
-                        parse_doc,
-                        [(doc, doc_save_dir, tmp_dir) for doc in batches[i + 1]],
-                        chunksize=10,
+        # Documents which are unchanged since they were inserted into the model
+        # are not parsed or indexed again.
+        document_store = DocumentStore(doc_save_dir)
+        # Content hashes of the documents that are indexed, so that documents
+        # which are repeated in the files are only indexed once.
+        indexed_hashes = set()
+        upsert_doc_ids = []
+
+        def insert_batch(
+            batch_files: List[FileInfo], batch_parsed: List[ParsedDoc], start: float
+        ):
+            # Checked per batch because the files are not known in advance.
+            check_disk(self.db, self.config.model_bazaar_dir, batch_files)
+
+            docs, doc_hashes, unchanged = [], [], 0
+            for file, parsed_doc in zip(batch_files, batch_parsed):
+                if parsed_doc.content_hash in indexed_hashes:
+                    parsed_doc.discard()
+                    unchanged += 1
+                    continue
+
+                if parsed_doc.stored:
+                    if document_store.is_current(self.db, parsed_doc.stored):
+                        indexed_hashes.add(parsed_doc.content_hash)
+                        unchanged += 1
+                        continue
+                    # The stored version has since been deleted or replaced. The
+                    # prefetched copy was released once the file was parsed, so
+                    # cloud files are downloaded again, which is rare since it
+                    # only happens for documents that were deleted or replaced.
+                    parsed_doc = parse_doc_if_new(
+                        file, doc_save_dir, tmp_dir, sync=False, skip_stored=False
                     )
-                else:
-                    next_batch = None
-
-                docs = []
-                for doc_idx, doc in enumerate(curr_batch):
-                    if not doc:
-                        msg = f"Unable to parse {batches[i][doc_idx].path}. Unsupported filetype."
-                        self.logger.error(msg, code=LogCode.MODEL_INSERT)
-                        self.reporter.report_warning(
-                            model_id=self.config.model_id,
-                            message=msg,
-                        )
-                    else:
-                        docs.append(doc)
 
-                index_start = time.perf_counter()
-                self.db.insert(docs)
-                index_end = time.perf_counter()
+                if not parsed_doc.doc:
+                    msg = f"Unable to parse {file.path}. Unsupported filetype."
+                    self.logger.error(msg, code=LogCode.MODEL_INSERT)
+                    self.reporter.report_warning(
+                        model_id=self.config.model_id,
+                        message=msg,
+                    )
+                    continue
 
-                docs_indexed += len(curr_batch)
-                successfully_indexed_files += len(docs)
+                indexed_hashes.add(parsed_doc.content_hash)
+                docs.append(parsed_doc.doc)
+                doc_hashes.append(parsed_doc.content_hash)
+                if file.source_id and file.options.get("upsert", False):
+                    upsert_doc_ids.append(file.source_id)
 
-                if next_batch:
-                    next_batch.wait()
-                    curr_batch = next_batch.get()
+            # The copies of the local files in the batch are synced together.
+            file_ops.sync_barrier([doc_save_dir])
 
-                end = time.perf_counter()
-                self.logger.debug(
-                    f"Batch {i+1} inserted in {end - start:.3f}s, insertion time: {index_end - index_start:.3f}s, "
-                    f"total documents indexed so far: {docs_indexed}"
-                )
+            index_start = time.perf_counter()
+            inserted = self.db.insert(docs)
+            document_store.add_inserted(doc_hashes, docs, inserted)
+            index_end = time.perf_counter()
+
+            self.logger.debug(
+                f"Batch of {len(batch_files)} files parsed and inserted in {index_end - start:.3f}s, "
+                f"insertion time: {index_end - index_start:.3f}s, "
+                f"unchanged files skipped: {unchanged}, "
+                f"total documents indexed so far: {docs_indexed + len(batch_files)}"
+            )
+            return len(docs) + unchanged
+
+        # Files that have been sent to the parsing processes, in order. The files
+        # are appended by the thread of the pool that feeds it tasks.
+        parsing_files = deque()
+
+        def parse_args():
+            for file, downloaded_path in prefetcher:
+                parsing_files.append(file)
+                yield (file, doc_save_dir, tmp_dir, downloaded_path, False)
+
+        with mp.Pool(processes=n_jobs) as pool:
+            # The prefetcher is closed before the pool is terminated, since the
+            # pool waits for the thread which is feeding it tasks from the
+            # prefetcher, which may be waiting for files to be released.
+            try:
+                batch_files, batch_parsed = [], []
+                start = time.perf_counter()
+                for parsed_doc in pool.imap(
+                    parse_doc_if_new_from_args, parse_args(), chunksize=1
+                ):
+                    # Released before the batch is indexed, since a batch can be
+                    # larger than the staging budget.
+                    prefetcher.release()
+                    batch_files.append(parsing_files.popleft())
+                    batch_parsed.append(parsed_doc)
+
+                    if len(batch_files) == batch_size:
+                        successfully_indexed_files += insert_batch(
+                            batch_files, batch_parsed, start
+                        )
+                        docs_indexed += len(batch_files)
+                        batch_files, batch_parsed = [], []
+                        start = time.perf_counter()
+
+                if batch_files:
+                    successfully_indexed_files += insert_batch(
+                        batch_files, batch_parsed, start
+                    )
+                    docs_indexed += len(batch_files)
+            finally:
+                prefetcher.close()
 
         total_chunks = self.db.retriever.retriever.size()
         self.logger.info(
@@ -173,12 +259,6 @@ class NeuralDBV2(Model):
             code=LogCode.MODEL_INSERT,
         )
 
-        upsert_doc_ids = [
-            file.source_id
-            for file in files
-            if file.source_id and file.options.get("upsert", False)
-        ]
-
         self.logger.info(
             f"Found {len(upsert_doc_ids)} docs to upsert, removing old versions",
             code=LogCode.MODEL_DELETE,
@@ -203,7 +283,7 @@ class NeuralDBV2(Model):
             code=LogCode.MODEL_DELETE,
         )
 
-        return successfully_indexed_files
+        return docs_indexed, successfully_indexed_files
 
     def rlhf_retraining(self, path: str):
         feedback_samples = defaultdict(int)
@@ -312,13 +392,6 @@ class NeuralDBV2(Model):
         self.logger.info("Training process started.", code=LogCode.MODEL_TRAIN)
         self.reporter.report_status(self.config.model_id, "in_progress")
 
-        s = time.perf_counter()
-        unsupervised_files = self.unsupervised_files()
-        e = time.perf_counter()
-        self.logger.debug(
-            f"Listed {len(unsupervised_files)} unsupervised files in {e-s:.4f} seconds"
-        )
-
         s = time.perf_counter()
         supervised_files = self.supervised_files()
         e = time.perf_counter()
@@ -328,17 +401,18 @@ class NeuralDBV2(Model):
 
         start_time = time.time()
 
-        successfully_indexed_files = 0
-        if unsupervised_files:
-            check_disk(self.db, self.config.model_bazaar_dir, unsupervised_files)
-            successfully_indexed_files = self.unsupervised_train(unsupervised_files)
+        unsupervised_files_count, successfully_indexed_files = 0, 0
+        if self.config.data.unsupervised_files:
+            unsupervised_files_count, successfully_indexed_files = (
+                self.unsupervised_train(self.unsupervised_files())
+            )
 
         successfully_trained_files = 0
         if supervised_files:
             check_disk(self.db, self.config.model_bazaar_dir, supervised_files)
             successfully_trained_files = self.supervised_train(supervised_files)
 
-        if len(unsupervised_files) > 0 or len(supervised_files) > 0:
+        if unsupervised_files_count > 0 or len(supervised_files) > 0:
             if successfully_indexed_files == 0 and successfully_trained_files == 0:
                 msg = "The number of documents indexed and trained is 0. Marking training as failed."
                 self.logger.error(msg, code=LogCode.MODEL_TRAIN)
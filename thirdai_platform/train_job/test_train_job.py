@@ -1,7 +1,9 @@
 import os
 import shutil
+import threading
 from pathlib import Path
 from typing import Dict
+from unittest.mock import patch
 
 import pandas as pd
 import pytest
@@ -189,6 +191,56 @@ def test_ndbv2_train(feedback_train_file, on_disk):
     assert len(db.documents()) == 3
 
 
+def test_ndbv2_train_batch_larger_than_staging_budget():
+    verify_license.verify_and_activate(THIRDAI_LICENSE)
+
+    articles = os.path.join(file_dir(), "articles.csv")
+    files = [
+        FileInfo(
+            path=f"s3://bucket/dir{i}/articles.csv",
+            location="s3",
+            options={"csv_weak_columns": ["text"]},
+        )
+        for i in range(12)
+    ]
+    config = TrainConfig(
+        user_id="user_123",
+        model_bazaar_dir=MODEL_BAZAAR_DIR,
+        license_key=THIRDAI_LICENSE,
+        model_bazaar_endpoint="",
+        model_id="ndb_123",
+        data_id="data_123",
+        # Only two of the downloaded files fit in the staging budget, so each
+        # batch is larger than the budget.
+        model_options=NDBOptions(
+            download_threads=2,
+            download_staging_bytes=2 * os.path.getsize(articles),
+        ),
+        data=NDBData(unsupervised_files=files),
+        job_options=JobOptions(),
+    )
+    model = get_model(config, DummyReporter(), logger)
+
+    def download_file(doc, tmp_dir, client=None):
+        return shutil.copy(articles, tmp_dir)
+
+    result = {}
+
+    def train():
+        result["counts"] = model.unsupervised_train(files, batch_size=5)
+
+    with patch(
+        "platform_common.download_prefetcher.download_file", download_file
+    ), patch("platform_common.download_prefetcher.get_cloud_client"):
+        thread = threading.Thread(target=train, daemon=True)
+        thread.start()
+        thread.join(timeout=120)
+
+    assert not thread.is_alive(), "training stalled on the staging budget"
+    assert result["counts"] == (len(files), len(files))
+    assert len(model.db.documents()) == len(files)
+
+
 def test_udt_text_train():
     verify_license.verify_and_activate(THIRDAI_LICENSE)
 